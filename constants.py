@@ -10,9 +10,229 @@ import os
 
 ## @brief Length of RSA key in bits (as per requirements: 4096)
 RSA_KEY_LENGTH = 4096
+## @brief Length of RSA key in bits for the optional long-term profile
+RSA_8192_KEY_LENGTH = 8192
+## @brief Public exponent of generated RSA keys
+RSA_PUBLIC_EXPONENT = 65537
+## @brief Number of prime candidates a key generation worker tests before reporting back
+KEYGEN_CANDIDATES_PER_TASK = 64
 ## @brief Maximum PIN length for key encryption/decryption
 MAX_PIN_LENGTH = 6
 
+## @brief RSA key type (as per requirements)
+KEY_TYPE_RSA = 'rsa'
+## @brief RSA key type with an 8192-bit modulus
+KEY_TYPE_RSA_8192 = 'rsa-8192'
+## @brief ECDSA key type on the NIST P-256 curve
+KEY_TYPE_ECDSA_P256 = 'ecdsa-p256'
+## @brief Ed25519 key type
+KEY_TYPE_ED25519 = 'ed25519'
+## @brief All supported key types
+KEY_TYPES = (KEY_TYPE_RSA, KEY_TYPE_RSA_8192, KEY_TYPE_ECDSA_P256, KEY_TYPE_ED25519)
+## @brief Key type used for new keys unless another one is selected
+DEFAULT_KEY_TYPE = KEY_TYPE_RSA
+
+## @brief Magic bytes at the start of every key container file
+KEY_CONTAINER_MAGIC = b'PADESKEY'
+## @brief Current key container format version
+KEY_CONTAINER_VERSION = 1
+## @brief Size of the fixed key container header in bytes
+KEY_CONTAINER_HEADER_SIZE = 128
+## @brief File extension of private key files
+PRIVATE_KEY_EXTENSION = '.key'
+## @brief File extension of public key containers
+PUBLIC_KEY_EXTENSION = '.pub'
+## @brief File extension of public keys stored as plain PEM (keys made before containers existed)
+LEGACY_PUBLIC_KEY_EXTENSION = '.pem'
+## @brief scrypt cost parameter (log2 of N) for deriving the key encryption key from the PIN
+KEY_KDF_SCRYPT_LOG2_N = 15
+## @brief scrypt block size parameter
+KEY_KDF_SCRYPT_R = 8
+## @brief scrypt parallelization parameter
+KEY_KDF_SCRYPT_P = 1
+
+## @brief Maximum number of decrypted keys kept ready for signing
+SIGNER_CACHE_SIZE = 4
+
+## @brief Environment variable forcing the hash backend (hashlib, pycryptodomex, cryptography)
+HASH_BACKEND_ENV = 'PADES_HASH_BACKEND'
+## @brief Environment variable forcing the signature backend (pycryptodomex, cryptography)
+SIGNATURE_BACKEND_ENV = 'PADES_SIGNATURE_BACKEND'
+
+#### SIGNATURE ####
+
+## @brief Digest profile hashing the extracted text of every page (signatures made before profiles existed)
+DIGEST_PROFILE_TEXT = 'text'
+## @brief Digest profile hashing every byte of the original file
+DIGEST_PROFILE_FULL = 'full'
+## @brief Digest profile hashing the raw content streams of every page
+DIGEST_PROFILE_CONTENT = 'content'
+## @brief Digest profile hashing a declared page subset with all objects it references
+DIGEST_PROFILE_PAGES = 'pages'
+## @brief All supported digest profiles
+DIGEST_PROFILES = (DIGEST_PROFILE_FULL, DIGEST_PROFILE_CONTENT, DIGEST_PROFILE_PAGES, DIGEST_PROFILE_TEXT)
+## @brief Digest profile used for new signatures
+DEFAULT_DIGEST_PROFILE = DIGEST_PROFILE_FULL
+## @brief Size of the chunks read from disk while hashing byte ranges
+DIGEST_CHUNK_SIZE = 1024 * 1024
+## @brief Number of chunk buffers the read-ahead thread fills while the previous ones are hashed
+READ_AHEAD_BUFFERS = 2
+
+## @brief Whether signing rewrites documents in a size-optimized form before signing them
+OPTIMIZE_ON_SIGN = False
+## @brief Maximum number of objects packed into one compressed object stream
+OBJECT_STREAM_MAX_OBJECTS = 100
+## @brief zlib compression level used for object streams and recompressed content streams
+OPTIMIZE_COMPRESSION_LEVEL = 9
+
+## @brief Number of pending output files that triggers a group commit
+FSYNC_BATCH_MAX_FILES = 32
+## @brief Maximum seconds an output file waits for its group commit
+FSYNC_BATCH_MAX_DELAY = 0.5
+
+#### VISIBLE SIGNATURE ####
+
+## @brief Whether signing adds a visible signature stamp to the last page
+VISIBLE_STAMP_ON_SIGN = False
+## @brief Width of the signature stamp in points
+STAMP_WIDTH = 216
+## @brief Height of the signature stamp in points
+STAMP_HEIGHT = 64
+## @brief Distance of the stamp from the bottom and right edges of the page in points
+STAMP_MARGIN = 36
+## @brief Standard Type 1 font of the stamp text
+STAMP_FONT = 'Helvetica'
+## @brief Font size of the stamp text in points
+STAMP_FONT_SIZE = 8
+## @brief Maximum width and height of the stamp logo in pixels
+STAMP_LOGO_MAX_PIXELS = 128
+## @brief Number of stamp appearances (per signer and day) kept in memory
+STAMP_CACHE_SIZE = 8
+
+#### TIMESTAMPING ####
+
+## @brief Environment variable holding the timestamp authority URL (timestamping is off when unset)
+TSA_URL_ENV = 'PADES_TSA_URL'
+## @brief Environment variable holding the path to the timestamp authority's public key
+TSA_PUBLIC_KEY_ENV = 'PADES_TSA_PUBLIC_KEY'
+## @brief Maximum number of timestamp requests sent in one batch
+TSA_BATCH_SIZE = 64
+## @brief Seconds a timestamp request waits for other requests to share its batch
+TSA_BATCH_DELAY = 0.01
+## @brief Maximum number of timestamp batches in flight at the same time
+TSA_MAX_IN_FLIGHT = 2
+## @brief Seconds to wait for a timestamp authority response
+TSA_TIMEOUT = 10.0
+## @brief Port of the local timestamp authority stand-in
+LOCAL_TSA_PORT = 8318
+
+#### TRUST STORE ####
+
+## @brief Minimum seconds between checks of the trust store file for changes
+TRUST_STORE_CHECK_INTERVAL = 1.0
+
+#### SIGNATURE REGISTRY ####
+
+## @brief Environment variable switching on the signature registry for sign_pdf_file (off when unset or "0")
+SIGNATURE_REGISTRY_ENV = 'PADES_SIGNATURE_REGISTRY'
+## @brief Directory name of the signature registry database
+REGISTRY_DIRNAME = 'registry'
+## @brief Filename of the signature registry database
+REGISTRY_FILENAME = 'signatures.db'
+
+#### DIGEST MEMO ####
+
+## @brief Whether sign_pdf_file and verify_pdf_signature share memoized document digests
+DIGEST_MEMO_ENABLED = True
+## @brief Maximum number of files whose digests are memoized
+DIGEST_MEMO_SIZE = 1024
+## @brief Number of bytes sampled at each end of a file to check a memoized digest
+DIGEST_MEMO_SAMPLE_SIZE = 4096
+
+#### ARCHIVE VERIFICATION ####
+
+## @brief Pattern of the archive members verified by archive verification
+ARCHIVE_MEMBER_PATTERN = 'SIGNED_*.pdf'
+## @brief Largest compressed archive member (in bytes) that is decompressed into memory for verification
+ARCHIVE_MEMBER_MEMORY_LIMIT = 256 * 1024 * 1024
+
+#### PARSE INDEX ####
+
+## @brief Environment variable switching on the parse index for verifications (off when unset or "0")
+PARSE_INDEX_ENV = 'PADES_PARSE_INDEX'
+## @brief Directory name (inside the cache directory) of the parse index
+PARSE_INDEX_DIRNAME = 'parse_index'
+## @brief File name (inside the parse index directory) of the key authenticating the index entries
+PARSE_INDEX_KEY_FILENAME = '.index_key'
+## @brief Number of leading bytes hashed to tell files apart in the parse index
+PARSE_INDEX_HEAD_SIZE = 4096
+## @brief Byte ranges read by a verification that are closer than this are merged in the parse index
+PARSE_INDEX_RANGE_GAP = 4096
+
+#### REMOTE DOCUMENTS ####
+
+## @brief Size of the blocks fetched with HTTP range requests
+HTTP_RANGE_BLOCK_SIZE = 64 * 1024
+## @brief Maximum number of fetched blocks kept in memory per remote document
+HTTP_RANGE_CACHE_BLOCKS = 256
+## @brief Number of blocks fetched ahead in parallel once a remote document is read sequentially
+HTTP_RANGE_PREFETCH_BLOCKS = 8
+## @brief Maximum number of keep-alive connections per remote document store
+HTTP_RANGE_CONNECTIONS = 4
+## @brief Seconds to wait for a remote document store response
+HTTP_RANGE_TIMEOUT = 10.0
+## @brief Port of the local document store stand-in
+LOCAL_DOCUMENT_STORE_PORT = 8319
+
+#### USB ####
+
+## @brief Maximum number of USB drives scanned for keys at the same time
+USB_SCAN_WORKERS = 8
+## @brief Seconds a drive's cached key inventory is reused while its root folder is unchanged
+USB_KEY_RESCAN_INTERVAL = 30.0
+
+#### PKCS#11 TOKENS ####
+
+## @brief Environment variable holding the path to the PKCS#11 module (token signing is off when unset)
+PKCS11_MODULE_ENV = 'PADES_PKCS11_MODULE'
+## @brief Environment variable holding the default token label
+PKCS11_TOKEN_ENV = 'PADES_PKCS11_TOKEN'
+## @brief Environment variable holding the default label of the signing key on the token
+PKCS11_KEY_ENV = 'PADES_PKCS11_KEY'
+## @brief Maximum number of sessions a token signer opens for concurrent signatures
+PKCS11_SESSION_POOL_SIZE = 4
+## @brief Number of token signers (with their logged-in sessions) kept open
+PKCS11_SIGNER_CACHE_SIZE = 4
+## @brief Usual install locations of the SoftHSM v2 PKCS#11 module
+SOFTHSM_MODULE_PATHS = (
+    '/usr/lib/softhsm/libsofthsm2.so',
+    '/usr/lib/x86_64-linux-gnu/softhsm/libsofthsm2.so',
+    '/usr/lib/aarch64-linux-gnu/softhsm/libsofthsm2.so',
+    '/usr/local/lib/softhsm/libsofthsm2.so',
+    '/opt/homebrew/lib/softhsm/libsofthsm2.so',
+    'C:\\SoftHSM2\\lib\\softhsm2-x64.dll',
+)
+
+#### WATCH FOLDER ####
+
+## @brief Maximum number of files waiting for a signing worker
+WATCH_QUEUE_SIZE = 64
+## @brief Seconds between directory polls (and inotify wait timeout)
+WATCH_POLL_INTERVAL = 1.0
+## @brief Seconds between statistics log lines
+WATCH_STATS_INTERVAL = 30.0
+## @brief Name of the journal of processed files, kept in the output folder
+WATCH_JOURNAL_FILENAME = '.pades_journal.jsonl'
+## @brief Environment variable holding the PIN for unattended signing
+WATCH_PIN_ENV = 'PADES_PIN'
+
+#### WARM WORKER POOL ####
+
+## @brief Number of jobs after which a warm worker process is replaced
+WARM_POOL_MAX_JOBS = 500
+## @brief Resident set size (in MB) after which a warm worker process is replaced
+WARM_POOL_MAX_RSS_MB = 512
+
 #### LOGGER ####
 
 ## @brief Directory name for storing log files
@@ -22,6 +242,17 @@ LOGS_FILENAME = 'app_logs.log'
 ## @brief Global logger name used throughout the application
 LOGGER_GLOBAL_NAME = 'global_logger'
 
+#### PROFILER ####
+
+## @brief Environment variable switching on the sampling profiler for signing and verification jobs
+PROFILER_ENV = 'PADES_PROFILE'
+## @brief Seconds between stack samples of a profiled thread
+PROFILER_SAMPLE_INTERVAL = 0.005
+## @brief Directory name (inside the logs directory) for profiler output
+PROFILES_DIRNAME = 'profiles'
+## @brief Hidden shortcut switching profiling (of jobs and of the GUI thread) on and off
+PROFILER_TOGGLE_SHORTCUT = 'Ctrl+Shift+P'
+
 #### OTHER PATHS ####
 
 ## @brief Base path of the project directory
@@ -38,8 +269,20 @@ ASSETS_DIR_PATH = os.path.join(BASE_PROJECT_PATH, 'gui', 'assets')
 STYLESHEET_FILE_PATH = os.path.join(STYLES_DIR_PATH, 'signature_app.css')
 ## @brief Path to the application icon file
 ICON_FILE_PATH = os.path.join(ASSETS_DIR_PATH, 'icon.png')
+## @brief Path to the PNG logo drawn in visible signature stamps
+STAMP_LOGO_PATH = ICON_FILE_PATH
 ## @brief Path to the directory where public keys are stored
 KEYS_DIR_PATH= os.path.join(BASE_PROJECT_PATH, KEYS_DIRNAME)
+## @brief Path to the trust store of signer keys (validity windows and revocations)
+TRUST_STORE_PATH = os.path.join(KEYS_DIR_PATH, 'trust_store.json')
+## @brief Path to the directory profiler output is written to
+PROFILES_DIR_PATH = os.path.join(BASE_PROJECT_PATH, LOGS_DIRNAME, PROFILES_DIRNAME)
+## @brief Path to the checked-in memory and latency budgets (see utility/perf_budget.py)
+PERF_BUDGETS_PATH = os.path.join(BASE_PROJECT_PATH, 'perf_budgets.json')
+## @brief Path to the parse index of verified documents
+PARSE_INDEX_DIR_PATH = os.path.join(BASE_PROJECT_PATH, 'cache', PARSE_INDEX_DIRNAME)
+## @brief Path to the signature registry database
+SIGNATURE_REGISTRY_PATH = os.path.join(BASE_PROJECT_PATH, REGISTRY_DIRNAME, REGISTRY_FILENAME)
 
 #### GUI CONSTANTS ####
 
@@ -55,6 +298,18 @@ SIGN_PAGE_NAME = "sign_page"
 ## @brief Object name for the verification page
 VERIFY_PAGE_NAME = "verify_page"
 
+## @brief Width in pixels of pages rendered in the document preview
+PREVIEW_PAGE_WIDTH = 240
+## @brief Maximum number of rendered pages kept by the document preview
+PREVIEW_CACHE_PAGES = 24
+## @brief Milliseconds the document preview waits for scrolling to settle before rendering
+PREVIEW_RENDER_DELAY_MS = 50
+
+## @brief Key source choice of the signing page using the encrypted key file on the USB drive
+KEY_SOURCE_FILE = "USB key file"
+## @brief Key source choice of the signing page using a PKCS#11 token
+KEY_SOURCE_TOKEN = "PKCS#11 token"
+
 ## @brief Title of the main application window
 MAIN_WINDOW_TITLE = "PAdES Signature App"
 
@@ -6,7 +6,7 @@
 import logging
 from pathlib import Path
 
-from PyQt6.QtCore import QTimer
+from PyQt6.QtCore import QTimer, pyqtSignal
 from PyQt6.QtGui import QIcon
 from PyQt6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QPushButton, QStackedWidget
@@ -14,8 +14,11 @@ from PyQt6.QtWidgets import (
 
 from constants import LOGGER_GLOBAL_NAME, KEYGEN_PAGE_NAME, \
     ICON_FILE_PATH, STYLESHEET_FILE_PATH, KEYS_DIR_PATH, AUXILIARY_WINDOW_TITLE
+from gui.DeviceState import DeviceState
+from gui.DrivePicker import DrivePicker
 from gui.PageKeygen import KeygenPage
-from utility.usb_handler import check_for_usb_device, search_usb_for_private_key, search_local_machine_for_public_key
+from utility.drive_inventory import DriveInventory
+from utility.usb_handler import check_for_usb_device, search_local_machine_for_public_key
 
 logger = logging.getLogger(LOGGER_GLOBAL_NAME)
 
@@ -24,6 +27,9 @@ logger = logging.getLogger(LOGGER_GLOBAL_NAME)
 ## Manages the auxiliary application window that focuses on key generation functionality.
 ## Includes USB detection and provides information about key status.
 class AuxiliaryApp(QWidget):
+    ## @brief Signal emitted from the scan thread pool with the list of scanned drives
+    drives_scanned_signal = pyqtSignal(object)
+
     ## @brief Initializes the auxiliary application window
     def __init__(self):
         self._main_layout = None
@@ -50,10 +56,21 @@ class AuxiliaryApp(QWidget):
 
         logger.info("==== AUXILIARY APP INITIALIZING GUI ====")
         super().__init__()
+
+        ## @brief Observable USB and key status
+        self.device_state = DeviceState()
+        self.device_state.changed.connect(self._device_state_changed)
+
+        ## @brief Background key discovery on all USB drives
+        self._drive_inventory = DriveInventory()
+        self._scan_in_progress = False
+        self.drives_scanned_signal.connect(self._drives_scanned)
+
         self._init_ui()
         self.show()
         logger.info("==== AUXILIARY APP GUI INITIALIZATION FINISHED ====")
 
+        self._device_state_changed()
         self._refresh_pages()
 
     ## @brief Sets up the user interface
@@ -79,70 +96,89 @@ class AuxiliaryApp(QWidget):
 
 
 
-    ## @brief Checks USB status and updates the UI
+    ## @brief Detects USB devices and starts scanning them for keys
+    ##
+    ## Every detected drive is scanned concurrently in the drive inventory's
+    ## thread pool; the result arrives in _drives_scanned. A poll is skipped
+    ## while the previous scan is still running.
     def _update_usb_status(self):
-        logger.info("Checking for USB devices...")
-        result, drives = check_for_usb_device()
+        if self._scan_in_progress:
+            return
+        logger.debug("Checking for USB devices...")
+        self._scan_in_progress = True
+        try:
+            result, drives = check_for_usb_device()
+            self._drive_inventory.scan_async(drives if result else [], self.drives_scanned_signal.emit)
+        except Exception as e:
+            logger.error(f"Checking for USB devices failed: {e}")
+            self._scan_in_progress = False
 
-        usb_found_status = ""
-        usb_private_key_found_status = ""
-        local_public_key_found_status = ""
+    ## @brief Stores the scanned drives and the local public key in the device state
+    ##
+    ## The device state emits a change signal only if the result differs from
+    ## the previous check, so nothing is re-rendered while idle.
+    ## @param drives List of DriveInfo
+    def _drives_scanned(self, drives):
+        self._scan_in_progress = False
 
         # Search for public key on local machine
         public_keys_found = search_local_machine_for_public_key(local_machine_path=KEYS_DIR_PATH)
-        if public_keys_found:
-            self.public_key_found = True
-            self.public_key_path = public_keys_found[0]
-            local_public_key_found_status += \
+        public_key_path = public_keys_found[0] if public_keys_found else None
+
+        self.device_state.update(drives, public_key_path)
+
+    ## @brief Updates the UI after the USB or key status changed
+    ##
+    ## Copies the device state to the instance variables read by the pages,
+    ## updates the USB status button text and refreshes all application pages.
+    def _device_state_changed(self):
+        state = self.device_state
+        logger.info("USB or key status changed")
+        self.usb_path = state.usb_path
+        self.private_key_path = state.private_key_path
+        self.private_key_found = state.private_key_found
+        self.public_key_path = state.public_key_path
+        self.public_key_found = state.public_key_found
+
+        if state.public_key_found:
+            local_public_key_found_status = \
                 (
                     f"🔑 Public key found on local machine at:\n"
-                    f"{str(public_keys_found[0])}"
+                    f"{str(state.public_key_path)}"
                 )
         else:
-            self.public_key_found = False
-            self.public_key_path = None
-            local_public_key_found_status += "❌ No public key found on local machine"
+            local_public_key_found_status = "❌ No public key found on local machine"
 
-
-        # If USB detected, search for private key
-        if not result:
-            self.usb_path = None
-            self.private_key_found = False
-            self.private_key_path = None
-            usb_found_status += "❌ No USB detected"
+        if state.usb_path is None:
+            usb_found_status = "❌ No USB detected"
+            usb_private_key_found_status = ""
         else:
-            self.usb_path = drives[0]['device']
-            usb_found_status += \
+            usb_found_status = \
                 (
-                    f"🟢 USB detected:\n"
-                    f"{drives[0]['device']}{drives[0]['name']}"
+                    f"🟢 USB detected ({len(state.drives)} in total):\n"
+                    f"{state.usb_path}{state.usb_name}"
                 )
-            # Search for private key
-            private_keys_found = search_usb_for_private_key(usb_path=self.usb_path)
-            if private_keys_found:
-                self.private_key_found = True
-                self.private_key_path = private_keys_found[0]
-                usb_private_key_found_status += \
+            if state.private_key_found:
+                usb_private_key_found_status = \
                     (
                         f"🔑 Private key found on USB at:\n"
-                        f"{str(private_keys_found[0])}"
+                        f"{str(state.private_key_path)}"
                     )
             else:
-                self.private_key_found = False
-                usb_private_key_found_status += "❌ No private key found on USB drive"
-
+                usb_private_key_found_status = "❌ No private key found on USB drive"
 
         self._btn_usb.setText(
             f"{usb_found_status}\n"
             f"{usb_private_key_found_status}\n"
             f"{local_public_key_found_status}"
         )
+        self._page_keygen.refresh_page()
 
-    ## @brief Refreshes all pages status periodically
+    ## @brief Polls the USB and key status periodically
+    ##
+    ## Pages are refreshed through _device_state_changed only when the status changes.
     def _refresh_pages(self):
-        logger.info("Refreshing pages...")
         self._update_usb_status()
-        self._page_keygen.refresh_page()
         QTimer.singleShot(2000, self._refresh_pages)
 
     ## @brief Loads the application stylesheet from CSS file
@@ -165,6 +201,9 @@ class AuxiliaryApp(QWidget):
         self._btn_usb.setFixedHeight(180)
         self._side_menu.addWidget(self._btn_usb)
 
+        self._drive_picker = DrivePicker(self.device_state, show_keys=False)
+        self._side_menu.addWidget(self._drive_picker)
+
         self._side_menu.addStretch()
 
     ## @brief Creates the content area with all pages
@@ -0,0 +1,119 @@
+## @file DeviceState.py
+## @brief Observable USB and key status shared by the application windows
+##
+## Holds every detected USB drive with its private keys, the drive and key
+## selected by the user, and the local public key. A signal is emitted only
+## when one of them actually changes, so pages and the status panel re-render
+## on real changes instead of on every poll. When a drive or a key file
+## disappears, the decrypted keys and token sessions cached for signing are
+## dropped.
+
+from pathlib import Path
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+from utility.drive_inventory import DriveInfo
+from utility.pkcs11_token import close_token_signers
+from utility.signer import clear_signer_cache
+
+
+## @brief USB drive and key status model
+class DeviceState(QObject):
+    ## @brief Signal emitted once after an update that changed at least one value
+    changed = pyqtSignal()
+
+    ## @brief Initializes an empty state (no USB, no keys)
+    def __init__(self):
+        super().__init__()
+        ## @brief All detected USB drives with their private keys
+        self.drives: tuple[DriveInfo, ...] = ()
+        ## @brief Path to the selected USB device
+        self.usb_path: str | None = None
+        ## @brief Volume name of the selected USB device
+        self.usb_name: str | None = None
+        ## @brief Path to the selected private key file on USB
+        self.private_key_path: Path | None = None
+        ## @brief Path to the public key file on local machine
+        self.public_key_path: Path | None = None
+
+    ## @brief Flag indicating if a private key was found
+    @property
+    def private_key_found(self) -> bool:
+        return self.private_key_path is not None
+
+    ## @brief Flag indicating if a public key was found
+    @property
+    def public_key_found(self) -> bool:
+        return self.public_key_path is not None
+
+    ## @brief Private keys found on the selected drive
+    @property
+    def private_keys(self) -> tuple[Path, ...]:
+        for drive in self.drives:
+            if drive.device == self.usb_path:
+                return drive.private_keys
+        return ()
+
+    ## @brief Container headers of the private keys on the selected drive (None for keys without one)
+    @property
+    def key_headers(self) -> tuple:
+        for drive in self.drives:
+            if drive.device == self.usb_path:
+                return drive.key_headers
+        return ()
+
+    ## @brief Replaces the detected drives and public key, keeping the selection if possible
+    ##
+    ## Without a previous selection (or if the selected drive is gone) the first
+    ## drive holding a private key is selected, otherwise the first drive.
+    ## @param drives Detected drives as a sequence of DriveInfo
+    ## @param public_key_path Path to the public key file, or None
+    ## @return True if the state changed
+    def update(self, drives, public_key_path) -> bool:
+        drives = tuple(drives)
+        return self._set(drives, *self._resolve(drives, self.usb_path, self.private_key_path), public_key_path)
+
+    ## @brief Selects a drive and a private key on it
+    ## @param usb_path Path to the drive to select
+    ## @param private_key_path Key on that drive to select, or None for its first key
+    ## @return True if the state changed
+    def select(self, usb_path, private_key_path=None) -> bool:
+        return self._set(self.drives, *self._resolve(self.drives, usb_path, private_key_path), self.public_key_path)
+
+    ## @brief Resolves the drive and key to select among the detected drives
+    ## @return Tuple (usb_path, usb_name, private_key_path)
+    @staticmethod
+    def _resolve(drives, usb_path, private_key_path) -> tuple:
+        drive = next((d for d in drives if d.device == usb_path), None) \
+            or next((d for d in drives if d.private_keys), None) \
+            or (drives[0] if drives else None)
+        if drive is None:
+            return None, None, None
+        if private_key_path not in drive.private_keys:
+            private_key_path = drive.private_keys[0] if drive.private_keys else None
+        return drive.device, drive.name, private_key_path
+
+    ## @brief Stores new values, emitting changed only if something differs
+    ## @return True if the state changed
+    def _set(self, drives, usb_path, usb_name, private_key_path, public_key_path) -> bool:
+        new_values = (drives, usb_path, usb_name, private_key_path, public_key_path)
+        if new_values == (self.drives, self.usb_path, self.usb_name, self.private_key_path, self.public_key_path):
+            return False
+        if self._removed(self.drives, drives):
+            clear_signer_cache()
+            close_token_signers()
+        self.drives, self.usb_path, self.usb_name, self.private_key_path, self.public_key_path = new_values
+        self.changed.emit()
+        return True
+
+    ## @brief Returns whether drives or private keys disappeared between two scans
+    ## @param old_drives Previously detected drives
+    ## @param new_drives Newly detected drives
+    ## @return True if a drive or a key file of @p old_drives is missing from @p new_drives
+    @staticmethod
+    def _removed(old_drives, new_drives) -> bool:
+        new_keys = {(drive.device, key) for drive in new_drives for key in drive.private_keys}
+        new_devices = {drive.device for drive in new_drives}
+        return any(drive.device not in new_devices
+                   or any((drive.device, key) not in new_keys for key in drive.private_keys)
+                   for drive in old_drives)
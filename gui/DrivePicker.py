@@ -0,0 +1,78 @@
+## @file DrivePicker.py
+## @brief USB drive and private key selector
+##
+## Lists the drives and keys held by a DeviceState and writes the user's
+## choice back to it.
+
+from pathlib import Path
+
+from PyQt6.QtCore import Qt
+from PyQt6.QtWidgets import QWidget, QVBoxLayout, QComboBox
+
+
+## @brief Drive and key selection widget bound to a DeviceState
+class DrivePicker(QWidget):
+    ## @brief Creates the selector
+    ## @param device_state DeviceState to display and update
+    ## @param show_keys Whether to show the private key selector
+    def __init__(self, device_state, show_keys=True):
+        super().__init__()
+        self._device_state = device_state
+
+        self._combo_drive = QComboBox()
+        self._combo_drive.setToolTip("USB drive")
+        self._combo_drive.currentIndexChanged.connect(self._drive_selected)
+
+        self._combo_key = QComboBox()
+        self._combo_key.setToolTip("Private key on the selected USB drive")
+        self._combo_key.currentIndexChanged.connect(self._key_selected)
+        self._combo_key.setVisible(show_keys)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self._combo_drive)
+        layout.addWidget(self._combo_key)
+        self.setLayout(layout)
+
+        self._device_state.changed.connect(self.refresh)
+        self.refresh()
+
+    ## @brief Re-populates both selectors from the device state
+    def refresh(self):
+        state = self._device_state
+
+        self._combo_drive.blockSignals(True)
+        self._combo_drive.clear()
+        for drive in state.drives:
+            self._combo_drive.addItem(f"💾 {drive.name} ({drive.device})", drive.device)
+        self._combo_drive.setCurrentIndex(self._combo_drive.findData(state.usb_path))
+        self._combo_drive.blockSignals(False)
+
+        self._combo_key.blockSignals(True)
+        self._combo_key.clear()
+        for key_path, header in zip(state.private_keys, state.key_headers):
+            if header is None:
+                label = f"🔑 {key_path.name}"
+            else:
+                label = f"🔑 {key_path.name} ({header.key_type}-{header.key_bits}, {header.fingerprint_hex[:8]})"
+            # Stored as text: findData() does not match pathlib.Path item data
+            self._combo_key.addItem(label, str(key_path))
+            self._combo_key.setItemData(self._combo_key.count() - 1, str(key_path), role=Qt.ItemDataRole.ToolTipRole)
+        self._combo_key.setCurrentIndex(self._combo_key.findData(str(state.private_key_path)))
+        self._combo_key.blockSignals(False)
+
+        self._combo_drive.setEnabled(len(state.drives) > 1)
+        self._combo_key.setEnabled(len(state.private_keys) > 1)
+        self.setVisible(bool(state.drives))
+
+    ## @brief Selects the drive chosen by the user
+    ## @param index Index of the chosen item
+    def _drive_selected(self, index):
+        if index >= 0:
+            self._device_state.select(self._combo_drive.itemData(index))
+
+    ## @brief Selects the private key chosen by the user
+    ## @param index Index of the chosen item
+    def _key_selected(self, index):
+        if index >= 0:
+            self._device_state.select(self._device_state.usb_path, Path(self._combo_key.itemData(index)))
@@ -9,9 +9,9 @@ import logging
 from PyQt6.QtCore import Qt
 from PyQt6.QtGui import QIntValidator
 from PyQt6.QtWidgets import QWidget, QVBoxLayout, QGroupBox, QGridLayout, QPushButton, QLineEdit, QHBoxLayout, \
-    QLabel, QMessageBox, QProgressDialog
+    QLabel, QMessageBox, QProgressDialog, QComboBox
 
-from constants import LOGGER_GLOBAL_NAME, KEYGEN_PAGE_NAME, MAX_PIN_LENGTH
+from constants import LOGGER_GLOBAL_NAME, KEYGEN_PAGE_NAME, MAX_PIN_LENGTH, KEY_TYPES, DEFAULT_KEY_TYPE
 from utility.RSAWorkerThread import RSAWorkerThread
 from utility.misc import change_opacity
 
@@ -50,13 +50,13 @@ class KeygenPage(QWidget):
     def _init_ui(self):
         self._layout = QVBoxLayout()
 
-        self._group = QGroupBox("🔑 [Auxillary] Generate and encrypt RSA Key Pair")
+        self._group = QGroupBox("🔑 [Auxillary] Generate and encrypt Key Pair")
         self._group_layout = QVBoxLayout()
 
         # ========== PINPAD INIT ==========
         self._pinpad_init()
 
-        self._btn_save_key = QPushButton("🔐 Generate RSA Key Pair and Save Encrypted Private Key on USB drive")
+        self._btn_save_key = QPushButton("🔐 Generate Key Pair and Save Encrypted Private Key on USB drive")
         self._btn_save_key.clicked.connect(self._generate_and_encrypt_keypair)
 
         #keyname_input_label = QLabel("Enter key filename:")
@@ -66,11 +66,17 @@ class KeygenPage(QWidget):
         self._key_filename_input.setMaxLength(50)
         #self._key_filename_input.setText("default_keyname")
 
+        self._combo_key_type = QComboBox()
+        self._combo_key_type.addItems(KEY_TYPES)
+        self._combo_key_type.setCurrentText(DEFAULT_KEY_TYPE)
+        self._combo_key_type.setToolTip("Type of the generated key pair")
+
 
         self._group_layout.addLayout(self._pin_layout)
         self._group_layout.addLayout(self._numpad_layout)
         #self._group_layout.addWidget(keyname_input_label)
         self._group_layout.addWidget(self._key_filename_input)
+        self._group_layout.addWidget(self._combo_key_type)
         self._group_layout.addWidget(self._btn_save_key)
 
 
@@ -183,22 +189,34 @@ class KeygenPage(QWidget):
             return
         pin = self._input_pin.text()
         key_filename = self._key_filename_input.text()
+        key_type = self._combo_key_type.currentText()
         usb_path = self.parent_app.usb_path
 
-        self._progress_dialog = QProgressDialog("Starting...", None, 0, 0, self)
+        self._progress_dialog = QProgressDialog("Starting...", "Cancel", 0, 0, self)
         self._progress_dialog.setWindowTitle("Key generation and encryption status")
-        self._progress_dialog.setCancelButton(None)
+        self._progress_dialog.setAutoClose(False)
+        self._progress_dialog.setAutoReset(False)
         self._progress_dialog.setMinimumDuration(0)
         self._progress_dialog.setWindowModality(Qt.WindowModality.ApplicationModal)
         self._progress_dialog.setWindowFlag(Qt.WindowType.WindowCloseButtonHint, False)
         self._progress_dialog.setGeometry(300, 300, 400, 100)
         self._progress_dialog.show()
 
-        self._rsa_worker_thread = RSAWorkerThread(pin=pin, filename=key_filename, usb_path=usb_path)
+        self._rsa_worker_thread = RSAWorkerThread(pin=pin, filename=key_filename, usb_path=usb_path, key_type=key_type)
         self._rsa_worker_thread.change_progress_signal.connect(self._rsa_worker_update_progress)
         self._rsa_worker_thread.task_finished_signal.connect(self._rsa_worker_task_finished)
+        self._progress_dialog.canceled.connect(self._rsa_worker_cancel)
         self._rsa_worker_thread.start()
 
+    ## @brief Cancels the running key generation
+    ##
+    ## The dialog stays open until the worker thread confirms the cancellation.
+    def _rsa_worker_cancel(self):
+        logger.info("User cancelled key generation")
+        self._rsa_worker_thread.cancel()
+        self._progress_dialog.show()
+        self._progress_dialog.setLabelText("Cancelling key generation...")
+
     ## @brief Updates progress dialog with status from the worker thread
     ## @param message Status message to display
     def _rsa_worker_update_progress(self, message):
@@ -5,15 +5,19 @@
 ## to sign PDF documents with their private key.
 
 import logging
+import os
 
 from PyQt6.QtCore import Qt
 from PyQt6.QtGui import QIntValidator
-from PyQt6.QtWidgets import QWidget, QVBoxLayout, QGroupBox, QGridLayout, QPushButton, QLineEdit, QLabel, QFileDialog, \
-    QMessageBox, QProgressDialog, QProgressBar
-from constants import LOGGER_GLOBAL_NAME, SIGN_PAGE_NAME
+from PyQt6.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QGroupBox, QGridLayout, QPushButton, QLineEdit, QLabel, QFileDialog, \
+    QMessageBox, QProgressDialog, QProgressBar, QComboBox, QCheckBox
+from constants import LOGGER_GLOBAL_NAME, SIGN_PAGE_NAME, DIGEST_PROFILES, DEFAULT_DIGEST_PROFILE, DIGEST_PROFILE_PAGES, \
+    OPTIMIZE_ON_SIGN, VISIBLE_STAMP_ON_SIGN, KEY_SOURCE_FILE, KEY_SOURCE_TOKEN, PKCS11_TOKEN_ENV, PKCS11_KEY_ENV
+from gui.PdfPreview import PdfPreview
 from utility.PDFWorkerThread import SignPDFWorkerThread
 from utility.misc import change_opacity
 from utility.pdf_sign import sign_pdf_file
+from utility.pkcs11_token import token_signing_available
 
 
 logger = logging.getLogger(LOGGER_GLOBAL_NAME)
@@ -49,28 +53,74 @@ class SignPage(QWidget):
         self._selected_file_label = QPushButton("No file selected")
         self._selected_file_label.setDisabled(True)
 
+        self._combo_key_source = QComboBox()
+        self._combo_key_source.addItems([KEY_SOURCE_FILE, KEY_SOURCE_TOKEN])
+        self._combo_key_source.setToolTip("Sign with the key file on the USB drive or with a key kept on a PKCS#11 token")
+        self._combo_key_source.setVisible(token_signing_available())
+        self._combo_key_source.currentTextChanged.connect(self._key_source_changed)
+
+        self._input_token_label = QLineEdit(os.getenv(PKCS11_TOKEN_ENV, ""))
+        self._input_token_label.setPlaceholderText("Token label")
+        self._input_token_label.setVisible(False)
+
+        self._input_key_label = QLineEdit(os.getenv(PKCS11_KEY_ENV, ""))
+        self._input_key_label.setPlaceholderText("Key label (optional)")
+        self._input_key_label.setVisible(False)
+
         self._input_sign_pin = QLineEdit()
         self._input_sign_pin.setPlaceholderText("Enter PIN to Decrypt Key")
         self._input_sign_pin.setMaxLength(6)
         self._input_sign_pin.setValidator(QIntValidator(0, 999999, self))
 
+        self._combo_digest_profile = QComboBox()
+        self._combo_digest_profile.addItems(DIGEST_PROFILES)
+        self._combo_digest_profile.setCurrentText(DEFAULT_DIGEST_PROFILE)
+        self._combo_digest_profile.setToolTip("Part of the document covered by the signature")
+        self._combo_digest_profile.currentTextChanged.connect(self._digest_profile_changed)
+
+        self._input_pages = QLineEdit()
+        self._input_pages.setPlaceholderText("Pages to sign, e.g. 1-3,7")
+        self._input_pages.setVisible(False)
+
+        self._check_optimize = QCheckBox("Optimize file size")
+        self._check_optimize.setChecked(OPTIMIZE_ON_SIGN)
+        self._check_optimize.setToolTip("Merge duplicate objects and compress the document before signing it")
+
+        self._check_stamp = QCheckBox("Add visible signature stamp")
+        self._check_stamp.setChecked(VISIBLE_STAMP_ON_SIGN)
+        self._check_stamp.setToolTip("Show the signing key, date and algorithm on the last page")
+
         self._btn_sign = QPushButton("✔️ Sign & Save PDF")
         self._btn_sign.clicked.connect(self._sign_pdf_file)
 
         group_layout = QVBoxLayout()
         group_layout.addWidget(self._btn_select_pdf)
         group_layout.addWidget(self._selected_file_label)
+        group_layout.addWidget(self._combo_digest_profile)
+        group_layout.addWidget(self._input_pages)
+        group_layout.addWidget(self._check_optimize)
+        group_layout.addWidget(self._check_stamp)
+        group_layout.addWidget(self._combo_key_source)
+        group_layout.addWidget(self._input_token_label)
+        group_layout.addWidget(self._input_key_label)
         group_layout.addWidget(self._input_sign_pin)
         group_layout.addWidget(self._btn_sign)
 
         self._group.setLayout(group_layout)
 
-        layout.addWidget(self._group)
+        self._preview = PdfPreview()
+
+        content_layout = QHBoxLayout()
+        content_layout.addWidget(self._group, 1)
+        content_layout.addWidget(self._preview, 1)
+
+        layout.addLayout(content_layout)
         self.setLayout(layout)
 
-    ## @brief Updates page state based on USB and key availability
+    ## @brief Updates page state based on USB, key and token availability
     def refresh_page(self):
-        if self.parent_app.usb_path is None or self.parent_app.private_key_found == False:
+        if (self.parent_app.usb_path is None or self.parent_app.private_key_found == False) \
+                and not token_signing_available():
             self.setEnabled(False)
             change_opacity(widget=self, value=0.5)
         else:
@@ -78,6 +128,35 @@ class SignPage(QWidget):
             change_opacity(widget=self, value=1.0)
 
 
+    ## @brief Shows the page range input only for the page subset digest profile
+    ## @param profile Selected digest profile
+    def _digest_profile_changed(self, profile):
+        self._input_pages.setVisible(profile == DIGEST_PROFILE_PAGES)
+
+    ## @brief Shows the token inputs and switches the PIN input to token PINs for the token key source
+    ## @param source Selected key source
+    def _key_source_changed(self, source):
+        use_token = source == KEY_SOURCE_TOKEN
+        self._input_token_label.setVisible(use_token)
+        self._input_key_label.setVisible(use_token)
+        self._input_sign_pin.clear()
+        if use_token:
+            # Token PINs are not limited to the 6 digits of the key file PIN
+            self._input_sign_pin.setPlaceholderText("Enter token PIN")
+            self._input_sign_pin.setValidator(None)
+            self._input_sign_pin.setMaxLength(64)
+            self._input_sign_pin.setEchoMode(QLineEdit.EchoMode.Password)
+        else:
+            self._input_sign_pin.setPlaceholderText("Enter PIN to Decrypt Key")
+            self._input_sign_pin.setMaxLength(6)
+            self._input_sign_pin.setValidator(QIntValidator(0, 999999, self))
+            self._input_sign_pin.setEchoMode(QLineEdit.EchoMode.Normal)
+
+    ## @brief Returns whether the key kept on a PKCS#11 token is selected
+    ## @return True for the token key source
+    def _token_selected(self):
+        return self._combo_key_source.currentText() == KEY_SOURCE_TOKEN
+
     ## @brief Opens a file dialog to select a PDF file for signing
     def _select_pdf_file(self):
         logger.info("User prompted to select PDF file to sign")
@@ -91,6 +170,7 @@ class SignPage(QWidget):
             logger.info(f"User selected PDF file: {pdf_to_sign_path}")
             self.pdf_filepath = pdf_to_sign_path
             self._selected_file_label.setText(self.pdf_filepath)
+            self._preview.load(self.pdf_filepath)
         else:
             logger.info("User cancelled PDF selection")
 
@@ -121,7 +201,29 @@ class SignPage(QWidget):
                 defaultButton=QMessageBox.StandardButton.Ok,
             )
             return False
-        if not self.parent_app.private_key_found:
+        if self._combo_digest_profile.currentText() == DIGEST_PROFILE_PAGES and not self._input_pages.text():
+            error_message = "No pages selected for signing"
+            logger.error(error_message)
+            error_dialog = QMessageBox.critical(
+                self,
+                "Validation error",
+                error_message,
+                buttons=QMessageBox.StandardButton.Ok,
+                defaultButton=QMessageBox.StandardButton.Ok,
+            )
+            return False
+        if self._token_selected() and not self._input_token_label.text():
+            error_message = "No token label given"
+            logger.error(error_message)
+            error_dialog = QMessageBox.critical(
+                self,
+                "Validation error",
+                error_message,
+                buttons=QMessageBox.StandardButton.Ok,
+                defaultButton=QMessageBox.StandardButton.Ok,
+            )
+            return False
+        if not self._token_selected() and not self.parent_app.private_key_found:
             error_message = "No private key found on usb"
             logger.error(error_message)
             error_dialog = QMessageBox.critical(
@@ -142,6 +244,10 @@ class SignPage(QWidget):
         pin = self._input_sign_pin.text()
         private_key_path = self.parent_app.private_key_path
         pdf_filepath = self.pdf_filepath
+        digest_profile = self._combo_digest_profile.currentText()
+        pages = self._input_pages.text() if digest_profile == DIGEST_PROFILE_PAGES else None
+        token_label = self._input_token_label.text() if self._token_selected() else None
+        key_label = self._input_key_label.text() or None
 
         self._progress_dialog = QProgressDialog("Starting...", None, 0, 0, self)
         self._progress_dialog.setWindowTitle("PDF signing status")
@@ -153,7 +259,11 @@ class SignPage(QWidget):
 
         self._progress_dialog.show()
 
-        self._pdf_worker_thread = SignPDFWorkerThread(pdf_filepath=pdf_filepath, pin=pin, private_key_filepath=private_key_path)
+        self._pdf_worker_thread = SignPDFWorkerThread(pdf_filepath=pdf_filepath, pin=pin, private_key_filepath=private_key_path,
+                                                      digest_profile=digest_profile, pages=pages,
+                                                      optimize=self._check_optimize.isChecked(),
+                                                      visible_stamp=self._check_stamp.isChecked(),
+                                                      token_label=token_label, key_label=key_label)
         self._pdf_worker_thread.change_progress_signal.connect(self._pdf_worker_update_progress)
         self._pdf_worker_thread.task_finished_signal.connect(self._pdf_worker_task_finished)
         self._pdf_worker_thread.start()
@@ -8,11 +8,12 @@ import logging
 from PyQt6.QtCore import Qt
 from PyQt6.QtGui import QFont
 from PyQt6.QtWidgets import (
-    QWidget, QVBoxLayout, QGroupBox, QGridLayout, QPushButton,
+    QWidget, QVBoxLayout, QHBoxLayout, QGroupBox, QGridLayout, QPushButton,
     QLabel, QFileDialog, QMessageBox, QProgressDialog
 )
 
 from constants import LOGGER_GLOBAL_NAME, VERIFY_PAGE_NAME
+from gui.PdfPreview import PdfPreview
 from utility.VerifyPDFWorkerThread import VerifyPDFWorkerThread
 from utility.misc import change_opacity
 
@@ -63,7 +64,14 @@ class VerifyPage(QWidget):
         group_layout.addWidget(self._label_result, 3, 0, 1, 2)
 
         group.setLayout(group_layout)
-        layout.addWidget(group)
+
+        self._preview = PdfPreview()
+
+        content_layout = QHBoxLayout()
+        content_layout.addWidget(group, 1)
+        content_layout.addWidget(self._preview, 1)
+
+        layout.addLayout(content_layout)
         self.setLayout(layout)
 
     ## @brief Updates page state based on public key availability
@@ -88,6 +96,7 @@ class VerifyPage(QWidget):
             logger.info(f"User selected PDF file: {pdf_to_verify_path}")
             self.pdf_filepath = pdf_to_verify_path
             self._selected_file_label.setText(self.pdf_filepath)
+            self._preview.load(self.pdf_filepath)
         else:
             logger.info("User cancelled PDF selection")
 
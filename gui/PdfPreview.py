@@ -0,0 +1,262 @@
+## @file PdfPreview.py
+## @brief Lazy PDF document preview
+##
+## Shows the pages of a PDF document in a scrollable list. Only the pages in
+## view are rendered, on a background thread, and at most PREVIEW_CACHE_PAGES
+## rendered pages are kept, so large documents open instantly and use bounded
+## memory.
+
+import logging
+import threading
+from collections import OrderedDict
+
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex, QSize, QThread, QTimer, pyqtSignal
+from PyQt6.QtGui import QImage, QColor
+from PyQt6.QtPdf import QPdfDocument
+from PyQt6.QtWidgets import QWidget, QVBoxLayout, QListView, QLabel, QApplication
+
+from constants import LOGGER_GLOBAL_NAME, PREVIEW_PAGE_WIDTH, PREVIEW_CACHE_PAGES, PREVIEW_RENDER_DELAY_MS
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+
+## @brief Background thread rendering requested pages
+##
+## Owns its own QPdfDocument. A new request replaces the pages still waiting
+## from the previous one, so pages scrolled past are never rendered.
+class PreviewRenderThread(QThread):
+    ## @brief Signal emitted with (document generation, page index, rendered image)
+    page_rendered_signal = pyqtSignal(int, int, QImage)
+
+    ## @brief Creates the (not yet started) thread
+    def __init__(self):
+        super().__init__()
+        self._condition = threading.Condition()
+        self._filepath = None
+        self._generation = 0
+        self._pending: list[int] = []
+        self._width = PREVIEW_PAGE_WIDTH
+        self._stopped = False
+
+    ## @brief Switches to another document, dropping pending requests
+    ## @param filepath Path to the PDF file, or None
+    ## @param generation Number identifying the document in page_rendered_signal
+    def set_document(self, filepath, generation):
+        with self._condition:
+            self._filepath = filepath
+            self._generation = generation
+            self._pending = []
+            self._condition.notify()
+
+    ## @brief Requests pages, replacing previous pending requests
+    ## @param pages Page indices in rendering order
+    ## @param width Width of the rendered pages in pixels
+    def request(self, pages, width):
+        with self._condition:
+            self._pending = list(pages)
+            self._width = width
+            self._condition.notify()
+
+    ## @brief Stops the thread and waits for it
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+        self.wait()
+
+    ## @brief Rendering loop
+    def run(self):
+        document = QPdfDocument(None)
+        loaded_filepath = None
+        while True:
+            with self._condition:
+                while not self._stopped and not self._pending:
+                    self._condition.wait()
+                if self._stopped:
+                    break
+                page = self._pending.pop(0)
+                filepath, generation, width = self._filepath, self._generation, self._width
+
+            if filepath is None:
+                continue
+            if filepath != loaded_filepath:
+                document.close()
+                document.load(filepath)
+                loaded_filepath = filepath
+            if document.status() != QPdfDocument.Status.Ready or page >= document.pageCount():
+                continue
+
+            point_size = document.pagePointSize(page)
+            height = round(width * point_size.height() / point_size.width()) if point_size.width() else width
+            image = document.render(page, QSize(width, height))
+            self.page_rendered_signal.emit(generation, page, image)
+        document.close()
+
+
+## @brief List model with one row per page, backed by an LRU cache of rendered pages
+class PreviewPageModel(QAbstractListModel):
+    ## @brief Creates an empty model
+    ## @param page_missing Callback called when a visible page is not rendered yet
+    def __init__(self, page_missing):
+        super().__init__()
+        self._page_missing = page_missing
+        self._page_count = 0
+        self._cache: OrderedDict[int, QImage] = OrderedDict()
+        self._placeholder = QImage()
+
+    ## @brief Replaces the document
+    ## @param page_count Number of pages
+    ## @param page_size Size of the rendered pages (used for the placeholder)
+    def reset(self, page_count, page_size):
+        self.beginResetModel()
+        self._page_count = page_count
+        self._cache.clear()
+        self._placeholder = QImage(page_size, QImage.Format.Format_RGB32)
+        self._placeholder.fill(QColor("lightgray"))
+        self.endResetModel()
+
+    ## @brief Returns whether a page is rendered and cached
+    ## @param page Page index
+    def is_cached(self, page) -> bool:
+        return page in self._cache
+
+    ## @brief Stores a rendered page, evicting the least recently used page if full
+    ## @param page Page index
+    ## @param image Rendered page
+    def add_page(self, page, image):
+        if page >= self._page_count:
+            return
+        self._cache[page] = image
+        self._cache.move_to_end(page)
+        while len(self._cache) > PREVIEW_CACHE_PAGES:
+            self._cache.popitem(last=False)
+        index = self.index(page)
+        self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+    ## @brief Number of pages
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self._page_count
+
+    ## @brief Page image (or placeholder) and page label
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        page = index.row()
+        if role == Qt.ItemDataRole.DisplayRole:
+            return f"Page {page + 1} / {self._page_count}"
+        if role == Qt.ItemDataRole.DecorationRole:
+            image = self._cache.get(page)
+            if image is None:
+                self._page_missing()
+                return self._placeholder
+            self._cache.move_to_end(page)
+            return image
+        return None
+
+
+## @brief Scrollable preview of a PDF document
+class PdfPreview(QWidget):
+    ## @brief Creates an empty preview
+    def __init__(self):
+        super().__init__()
+        self._generation = 0
+        self._page_size = QSize(PREVIEW_PAGE_WIDTH, PREVIEW_PAGE_WIDTH)
+        self._render_thread = None
+
+        self._model = PreviewPageModel(page_missing=self._schedule_render)
+
+        self._view = QListView()
+        self._view.setModel(self._model)
+        self._view.setUniformItemSizes(True)
+        self._view.setIconSize(self._page_size)
+        self._view.setSelectionMode(QListView.SelectionMode.NoSelection)
+        self._view.verticalScrollBar().valueChanged.connect(self._schedule_render)
+
+        self._label_empty = QLabel("No document to preview")
+        self._label_empty.setAlignment(Qt.AlignmentFlag.AlignCenter)
+
+        self._render_timer = QTimer(self)
+        self._render_timer.setSingleShot(True)
+        self._render_timer.setInterval(PREVIEW_RENDER_DELAY_MS)
+        self._render_timer.timeout.connect(self._render_visible_pages)
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self._label_empty)
+        layout.addWidget(self._view)
+        self.setLayout(layout)
+        self._view.setVisible(False)
+
+    ## @brief Shows a document
+    ##
+    ## Only the page count and the first page size are read here; pages are
+    ## rendered when they scroll into view.
+    ## @param filepath Path to the PDF file
+    def load(self, filepath):
+        document = QPdfDocument(None)
+        document.load(filepath)
+        if document.status() != QPdfDocument.Status.Ready or document.pageCount() == 0:
+            logger.error(f"Cannot preview {filepath}: {document.status().name}")
+            document.close()
+            self.clear()
+            self._label_empty.setText("Preview not available")
+            return
+
+        point_size = document.pagePointSize(0)
+        height = round(PREVIEW_PAGE_WIDTH * point_size.height() / point_size.width()) \
+            if point_size.width() else PREVIEW_PAGE_WIDTH
+        self._page_size = QSize(PREVIEW_PAGE_WIDTH, height)
+        page_count = document.pageCount()
+        document.close()
+
+        self._generation += 1
+        self._ensure_render_thread().set_document(filepath, self._generation)
+        self._view.setIconSize(self._page_size)
+        self._model.reset(page_count, self._page_size)
+        self._view.scrollToTop()
+        self._label_empty.setVisible(False)
+        self._view.setVisible(True)
+        self._schedule_render()
+
+    ## @brief Removes the shown document
+    def clear(self):
+        self._generation += 1
+        if self._render_thread is not None:
+            self._render_thread.set_document(None, self._generation)
+        self._model.reset(0, self._page_size)
+        self._view.setVisible(False)
+        self._label_empty.setText("No document to preview")
+        self._label_empty.setVisible(True)
+
+    ## @brief Starts the render thread on first use
+    ## @return PreviewRenderThread
+    def _ensure_render_thread(self):
+        if self._render_thread is None:
+            self._render_thread = PreviewRenderThread()
+            self._render_thread.page_rendered_signal.connect(self._page_rendered)
+            QApplication.instance().aboutToQuit.connect(self._render_thread.stop)
+            self._render_thread.start()
+        return self._render_thread
+
+    ## @brief Renders the visible pages once scrolling settles
+    def _schedule_render(self):
+        if self._render_thread is not None:
+            self._render_timer.start()
+
+    ## @brief Requests the visible pages that are not cached yet
+    def _render_visible_pages(self):
+        viewport = self._view.viewport().rect()
+        first = self._view.indexAt(viewport.topLeft())
+        last = self._view.indexAt(viewport.bottomLeft())
+        if not first.isValid():
+            return
+        last_row = last.row() if last.isValid() else self._model.rowCount() - 1
+        pages = [page for page in range(first.row(), last_row + 1) if not self._model.is_cached(page)]
+        if pages:
+            self._render_thread.request(pages, self._page_size.width())
+
+    ## @brief Stores a page rendered by the render thread
+    ## @param generation Document generation the page belongs to
+    ## @param page Page index
+    ## @param image Rendered page
+    def _page_rendered(self, generation, page, image):
+        if generation == self._generation:
+            self._model.add_page(page, image)
@@ -0,0 +1,9 @@
+## @file conftest.py
+## @brief Shared pytest setup
+##
+## Makes the project root importable, as the applications' entry scripts do.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
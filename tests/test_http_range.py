@@ -0,0 +1,132 @@
+## @file test_http_range.py
+## @brief Tests of remote verification against the local document store
+
+import functools
+import os
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from constants import DIGEST_PROFILE_FULL, HTTP_RANGE_BLOCK_SIZE
+from utility.crypto_backend import import_key
+from utility.http_range import HttpRangeError, HttpRangeFile, open_remote, verify_remote_pdf
+from utility.keygen import generate_keypair
+from utility.local_document_store import LocalDocumentStore
+from utility.pdf_sign import sign_pdf_file, verify_pdf_stream
+from utility.perf_budget import _write_document
+from utility.signature_registry import SignatureRegistry
+from utility.signer import DocumentSigner
+from utility.trust_store import TrustStore
+
+## @brief Standard library file server, which ignores Range headers
+class _QuietFileHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+## @brief Pages of the signed fixture, enough for several range blocks
+PAGES = 1000
+
+
+## @brief Signs a generated document once per module
+@pytest.fixture(scope="module")
+def signed(tmp_path_factory):
+    directory = tmp_path_factory.mktemp("store")
+    private_key, public_key = generate_keypair("rsa")
+    public_key_filepath = str(directory / "signer.pem")
+    with open(public_key_filepath, "wb") as f:
+        f.write(public_key)
+    signer = DocumentSigner(import_key(private_key))
+    document = str(directory / "document.pdf")
+    _write_document(document, PAGES)
+    output_dir = directory / "signed"
+    output_dir.mkdir()
+    signed_filepath = sign_pdf_file(signer, document, DIGEST_PROFILE_FULL, output_dir=str(output_dir),
+                                    registry=SignatureRegistry(":memory:"))
+    os.remove(document)
+    return {"directory": str(directory), "public_key": public_key_filepath,
+            "document": os.path.relpath(signed_filepath, directory)}
+
+
+## @brief Local document store serving the signed documents on a free port
+@pytest.fixture
+def store(signed):
+    store = LocalDocumentStore(signed["directory"], port=0)
+    store.start()
+    yield store
+    store.stop()
+
+
+## @brief Trust store kept out of the working directory
+@pytest.fixture
+def trust_store(tmp_path):
+    return TrustStore(str(tmp_path / "trust_store.json"))
+
+
+## @brief Loads the public key of the signed fixture
+def _public_key(signed):
+    with open(signed["public_key"], "rb") as f:
+        return import_key(f.read())
+
+
+def test_verify_remote_pdf(store, signed, trust_store):
+    is_valid, message = verify_remote_pdf(store.url(signed["document"]), signed["public_key"], trust_store)
+    assert is_valid, message
+
+
+def test_tampered_remote_pdf_fails(store, signed, trust_store):
+    with open(os.path.join(signed["directory"], signed["document"]), "rb") as f:
+        data = bytearray(f.read())
+    # Change a byte of the page text, inside the signed byte range
+    offset = data.index(b"page 1)")
+    data[offset] ^= 0x01
+    tampered = os.path.join(signed["directory"], "tampered.pdf")
+    with open(tampered, "wb") as f:
+        f.write(data)
+    try:
+        is_valid, _ = verify_remote_pdf(store.url("tampered.pdf"), signed["public_key"], trust_store)
+    finally:
+        os.remove(tampered)
+    assert not is_valid
+
+
+def test_remote_reads_each_block_once(store, signed, trust_store):
+    size = os.path.getsize(os.path.join(signed["directory"], signed["document"]))
+    with open_remote(store.url(signed["document"])) as stream:
+        is_valid, message = verify_pdf_stream(stream, _public_key(signed), trust_store)
+        stats = stream.raw.stats()
+    assert is_valid, message
+    assert stats["size"] == size
+    # Every byte is digested and none is fetched twice: one HEAD, then at most one range request per block
+    assert stats["bytes_received"] == size
+    assert 1 < stats["requests"] <= 1 + -(-size // HTTP_RANGE_BLOCK_SIZE)
+    assert store.requests == stats["requests"]
+    assert store.bytes_sent == stats["bytes_received"]
+
+
+def test_missing_document(store, signed, trust_store):
+    is_valid, message = verify_remote_pdf(store.url("missing.pdf"), signed["public_key"], trust_store)
+    assert not is_valid
+    assert "404" in message
+    with pytest.raises(HttpRangeError, match="404"):
+        HttpRangeFile(store.url("missing.pdf"))
+
+
+def test_server_without_range_support(signed, trust_store):
+    handler = functools.partial(_QuietFileHandler, directory=signed["directory"])
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host, port = server.server_address[:2]
+        url = f"http://{host}:{port}/{signed['document']}"
+        with pytest.raises(HttpRangeError, match="does not support range requests"):
+            HttpRangeFile(url)
+        is_valid, message = verify_remote_pdf(url, signed["public_key"], trust_store)
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+    assert not is_valid
+    assert "range requests" in message
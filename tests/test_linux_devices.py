@@ -0,0 +1,128 @@
+## @file test_linux_devices.py
+## @brief Tests of removable drive detection against a fake sysfs tree and mount table
+
+import os
+import sys
+
+import pytest
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Linux drive detection")
+
+from utility import usb_handler
+from utility.linux_devices import LinuxRemovableDevices
+
+## @brief Mount table lines: system disk, USB stick (twice, bind mounted) and USB hard drive
+MOUNTS = [
+    "22 1 8:1 / / rw,relatime shared:1 - ext4 /dev/sda1 rw",
+    "40 22 8:17 / /media/user/MY\\040DRIVE rw,nosuid shared:40 - vfat /dev/sdb1 rw",
+    "41 22 8:17 / /mnt/bind rw shared:40 - vfat /dev/sdb1 rw",
+    "42 22 8:32 / /media/user/BACKUP rw,nosuid shared:41 - ext4 /dev/sdc rw",
+]
+
+
+## @brief Writes a sysfs attribute file
+def _attribute(path, value):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(f"{value}\n")
+
+
+## @brief Builds a sysfs tree with a fixed disk, a removable stick and a USB hard drive
+@pytest.fixture
+def sysfs(tmp_path):
+    root = tmp_path / "sys"
+    block = root / "block"
+    _attribute(str(block / "sda" / "removable"), 0)
+    _attribute(str(block / "sda" / "dev"), "8:0")
+    _attribute(str(block / "sda" / "sda1" / "partition"), 1)
+    _attribute(str(block / "sda" / "sda1" / "dev"), "8:1")
+    _attribute(str(block / "sdb" / "removable"), 1)
+    _attribute(str(block / "sdb" / "dev"), "8:16")
+    _attribute(str(block / "sdb" / "sdb1" / "partition"), 1)
+    _attribute(str(block / "sdb" / "sdb1" / "dev"), "8:17")
+    # USB hard drives report removable = 0 and are recognized by their bus path
+    usb_disk = root / "devices" / "pci0000:00" / "usb2" / "2-1" / "host6" / "block" / "sdc"
+    _attribute(str(usb_disk / "removable"), 0)
+    _attribute(str(usb_disk / "dev"), "8:32")
+    os.symlink(usb_disk, block / "sdc")
+    return str(root)
+
+
+## @brief Writes a fake mountinfo file
+@pytest.fixture
+def mountinfo(tmp_path):
+    path = tmp_path / "mountinfo"
+    path.write_text("\n".join(MOUNTS) + "\n")
+    return str(path)
+
+
+def test_lists_mounted_removable_drives(sysfs, mountinfo):
+    devices = LinuxRemovableDevices(sysfs, mountinfo)
+    try:
+        assert devices.devices() == [
+            {"device": "/media/user/MY DRIVE", "name": "MY DRIVE"},
+            {"device": "/media/user/BACKUP", "name": "BACKUP"},
+        ]
+    finally:
+        devices.close()
+
+
+def test_unmounted_removable_drives_are_not_listed(sysfs, tmp_path):
+    path = tmp_path / "mountinfo"
+    path.write_text(MOUNTS[0] + "\n")
+    devices = LinuxRemovableDevices(sysfs, str(path))
+    try:
+        assert devices.devices() == []
+    finally:
+        devices.close()
+
+
+def test_list_is_cached_until_the_mount_table_changes(sysfs, mountinfo, monkeypatch):
+    devices = LinuxRemovableDevices(sysfs, mountinfo)
+    scans = []
+    original_scan = devices._scan
+    monkeypatch.setattr(devices, "_scan", lambda: scans.append(1) or original_scan())
+    try:
+        devices.devices()
+        devices.devices()
+        assert len(scans) == 1
+
+        # Unplugging the stick removes its mount
+        with open(mountinfo, "w") as f:
+            f.write("\n".join(MOUNTS[:1] + MOUNTS[3:]) + "\n")
+        assert devices.devices() == [{"device": "/media/user/BACKUP", "name": "BACKUP"}]
+        assert len(scans) == 2
+    finally:
+        devices.close()
+
+
+def test_missing_sysfs_lists_no_drives(tmp_path, mountinfo):
+    devices = LinuxRemovableDevices(str(tmp_path / "no-sys"), mountinfo)
+    try:
+        assert devices.devices() == []
+    finally:
+        devices.close()
+
+
+def test_check_for_usb_device_reports_removable_drives(sysfs, mountinfo, monkeypatch):
+    monkeypatch.delenv("CUSTOM_FILEPATH", raising=False)
+    devices = LinuxRemovableDevices(sysfs, mountinfo)
+    monkeypatch.setattr(usb_handler, "_linux_devices", devices)
+    try:
+        found, drives = usb_handler.check_for_usb_device()
+        assert found
+        assert [drive["device"] for drive in drives] == ["/media/user/MY DRIVE", "/media/user/BACKUP"]
+    finally:
+        devices.close()
+
+
+def test_check_for_usb_device_without_drives(tmp_path, monkeypatch):
+    monkeypatch.delenv("CUSTOM_FILEPATH", raising=False)
+    path = tmp_path / "mountinfo"
+    path.write_text(MOUNTS[0] + "\n")
+    devices = LinuxRemovableDevices(str(tmp_path / "no-sys"), str(path))
+    monkeypatch.setattr(usb_handler, "_linux_devices", devices)
+    try:
+        assert usb_handler.check_for_usb_device() == (False, None)
+    finally:
+        devices.close()
@@ -0,0 +1,29 @@
+## @file test_perf_budget.py
+## @brief Checks the scenarios of perf_budgets.json against their budgets
+
+import json
+
+import pytest
+
+from constants import PERF_BUDGETS_PATH, TSA_URL_ENV
+from utility.perf_budget import format_results, run_budgets
+
+with open(PERF_BUDGETS_PATH, "r", encoding="utf-8") as budgets_file:
+    ## @brief Names of the scenarios of the checked-in budget file
+    SCENARIOS = list(json.load(budgets_file)["scenarios"])
+
+
+## @brief Runs every scenario once, each one in its own process
+@pytest.fixture(scope="module")
+def results():
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        # run_budgets drops a configured timestamp authority; keep that from leaking into other tests
+        monkeypatch.delenv(TSA_URL_ENV, raising=False)
+        return {result["scenario"]: result for result in run_budgets()}
+
+
+@pytest.mark.parametrize("scenario", SCENARIOS)
+def test_scenario_within_budget(results, scenario):
+    result = results[scenario]
+    assert result["budget"], f"{scenario} declares no budget"
+    assert not result["exceeded"], format_results([result])
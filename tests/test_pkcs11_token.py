@@ -0,0 +1,103 @@
+## @file test_pkcs11_token.py
+## @brief Tests of token signing against a SoftHSM token
+##
+## Skipped unless python-pkcs11, the SoftHSM module and softhsm2-util are installed.
+
+import hashlib
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from constants import KEY_TYPE_RSA, KEY_TYPE_ECDSA_P256, KEY_TYPE_ED25519, PKCS11_SESSION_POOL_SIZE
+from utility import pkcs11_token
+from utility.crypto_backend import SIGNATURE_ALGORITHMS, verify_digest
+from utility.local_token import SOFTHSM_CONF_ENV, add_key, check_signer, create_token, export_public_key, \
+    find_softhsm_module
+from utility.pdf_sign import DecryptionError, sign_pdf_file, verify_pdf_signature
+from utility.perf_budget import _write_document
+from utility.pkcs11_token import TokenError, TokenSigner, close_token_signers, load_token_signer
+from utility.signature_registry import SignatureRegistry
+from utility.trust_store import TrustStore
+
+pytestmark = pytest.mark.skipif(
+    pkcs11_token.pkcs11 is None or find_softhsm_module() is None or shutil.which("softhsm2-util") is None,
+    reason="needs python-pkcs11 and SoftHSM v2")
+
+TOKEN_LABEL = "pades-test"
+PIN = "123456"
+KEY_TYPES = (KEY_TYPE_RSA, KEY_TYPE_ECDSA_P256, KEY_TYPE_ED25519)
+
+
+## @brief Creates one token holding a key of every type
+##
+## SoftHSM reads its configuration and tokens once per process, so all tests share this token.
+@pytest.fixture(scope="module")
+def module_path(tmp_path_factory):
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        # create_token points SoftHSM at the token directory for the whole process
+        monkeypatch.delenv(SOFTHSM_CONF_ENV, raising=False)
+        directory = str(tmp_path_factory.mktemp("token"))
+        module_path = create_token(directory, TOKEN_LABEL, PIN, "12345678", KEY_TYPES[0], KEY_TYPES[0])
+        for key_type in KEY_TYPES[1:]:
+            add_key(module_path, TOKEN_LABEL, PIN, key_type, key_type)
+        yield module_path
+
+
+## @brief Logs out after every test; a second login to the token would fail
+@pytest.fixture(autouse=True)
+def close_signers():
+    yield
+    close_token_signers()
+
+
+@pytest.mark.parametrize("key_type", KEY_TYPES)
+def test_sign_digest(module_path, key_type):
+    signer = load_token_signer(TOKEN_LABEL, PIN, key_type, module_path)
+    assert signer.key_type == key_type
+    assert signer.algorithm == SIGNATURE_ALGORITHMS[key_type]
+    assert signer.private_key is None
+    digest = hashlib.sha256(b"document").digest()
+    verify_digest(signer.public_key(), digest, signer.sign(digest))
+    with pytest.raises(ValueError):
+        verify_digest(signer.public_key(), hashlib.sha256(b"other document").digest(), signer.sign(digest))
+
+
+@pytest.mark.parametrize("key_type", KEY_TYPES)
+def test_sign_pdf(module_path, key_type, tmp_path):
+    signer = load_token_signer(TOKEN_LABEL, PIN, key_type, module_path)
+    public_key_filepath = str(tmp_path / "token.pem")
+    with open(public_key_filepath, "wb") as f:
+        f.write(export_public_key(signer))
+    document = str(tmp_path / "document.pdf")
+    _write_document(document, 3)
+    signed = sign_pdf_file(signer, document, registry=SignatureRegistry(":memory:"))
+    is_valid, message = verify_pdf_signature(signed, public_key_filepath, TrustStore(str(tmp_path / "trust.json")))
+    assert is_valid, message
+
+
+def test_concurrent_signatures(module_path):
+    signer = load_token_signer(TOKEN_LABEL, PIN, KEY_TYPE_ECDSA_P256, module_path)
+    # check_signer verifies every signature and raises on the first bad one
+    check_signer(signer, 64, 2 * PKCS11_SESSION_POOL_SIZE)
+    assert 1 <= len(signer._sessions) <= PKCS11_SESSION_POOL_SIZE
+
+
+def test_concurrent_loads_share_one_signer(module_path):
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        signers = list(executor.map(lambda _: load_token_signer(TOKEN_LABEL, PIN, KEY_TYPE_RSA, module_path),
+                                    range(8)))
+    assert all(signer is signers[0] for signer in signers)
+
+
+def test_wrong_pin(module_path):
+    with pytest.raises(DecryptionError):
+        TokenSigner(TOKEN_LABEL, "000000", KEY_TYPE_RSA, module_path)
+    with pytest.raises(DecryptionError):
+        load_token_signer(TOKEN_LABEL, "000000", KEY_TYPE_RSA, module_path)
+
+
+def test_unknown_key(module_path):
+    with pytest.raises(TokenError, match="No private key missing"):
+        TokenSigner(TOKEN_LABEL, PIN, "missing", module_path)
+
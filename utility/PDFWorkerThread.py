@@ -4,9 +4,13 @@ from time import sleep
 
 from PyQt6.QtCore import QThread, pyqtSignal
 
-from constants import KEYS_DIR_PATH, LOGGER_GLOBAL_NAME
+from constants import KEYS_DIR_PATH, LOGGER_GLOBAL_NAME, DEFAULT_DIGEST_PROFILE, OPTIMIZE_ON_SIGN, \
+    VISIBLE_STAMP_ON_SIGN
 from utility.keygen import generate_rsa_keypair, encrypt_private_key
-from utility.pdf_sign import decrypt_private_key, DecryptionError, sign_pdf_file
+from utility.pdf_sign import DecryptionError, sign_pdf_file
+from utility.signer import load_signer
+from utility.pkcs11_token import load_token_signer
+from utility.profiler import profile_job, phase
 
 logger = logging.getLogger(LOGGER_GLOBAL_NAME)
 
@@ -24,22 +28,51 @@ class SignPDFWorkerThread(QThread):
     ## @param pdf_filepath Path to the PDF file to sign
     ## @param pin User PIN for private key decryption
     ## @param private_key_filepath Path to the encrypted private key file
-    def __init__(self, pdf_filepath, pin, private_key_filepath):
+    ## @param digest_profile Digest profile deciding which parts of the document are signed
+    ## @param pages Page range specification for the "pages" digest profile
+    ## @param optimize Whether to sign a size-optimized rewrite of the document
+    ## @param visible_stamp Whether to add a visible signature stamp to the last page
+    ## @param token_label Label of the PKCS#11 token to sign with instead of the key file, or None
+    ## @param key_label Label of the key on the token, or None for the token's only key
+    def __init__(self, pdf_filepath, pin, private_key_filepath, digest_profile=DEFAULT_DIGEST_PROFILE, pages=None,
+                 optimize=OPTIMIZE_ON_SIGN, visible_stamp=VISIBLE_STAMP_ON_SIGN, token_label=None, key_label=None):
         super().__init__()
         self.pdf_filepath = pdf_filepath
         self.pin = pin
         self.private_key_filepath = private_key_filepath
+        self.token_label = token_label
+        self.key_label = key_label
+        self.digest_profile = digest_profile
+        self.pages = pages
+        self.optimize = optimize
+        self.visible_stamp = visible_stamp
+
+    ## @brief Forwards the hashing progress to the progress dialog
+    ## @param percent Percentage of the document read
+    def _report_progress(self, percent):
+        self.change_progress_signal.emit(f"Signing PDF ({self.digest_profile} digest profile)... {percent}%")
 
     ## @brief Main execution method of the thread
     ##
-    ## Decrypts the private key with the PIN and signs the PDF file
+    ## Decrypts the private key with the PIN, or logs in to the token, and signs
+    ## the PDF file, under the sampling profiler if profiling is enabled
     def run(self):
         try:
             sleep(1)
-            self.change_progress_signal.emit("Decrypting private key with provided PIN...")
-            decrypted_private_key = decrypt_private_key(private_key_filepath=self.private_key_filepath, pin=self.pin)
-            sleep(0.5)
-            sign_pdf_file(decrypted_private_key=decrypted_private_key, pdf_filepath=self.pdf_filepath)
+            with profile_job("sign"):
+                if self.token_label:
+                    self.change_progress_signal.emit("Logging in to the token with provided PIN...")
+                    with phase("token login"):
+                        signer = load_token_signer(self.token_label, self.pin, self.key_label)
+                else:
+                    self.change_progress_signal.emit("Decrypting private key with provided PIN...")
+                    with phase("decrypt key"):
+                        signer = load_signer(private_key_filepath=self.private_key_filepath, pin=self.pin)
+                sleep(0.5)
+                self.change_progress_signal.emit(f"Signing PDF ({self.digest_profile} digest profile)...")
+                sign_pdf_file(decrypted_private_key=signer, pdf_filepath=self.pdf_filepath,
+                              digest_profile=self.digest_profile, pages=self.pages, progress=self._report_progress,
+                              optimize=self.optimize, visible_stamp=self.visible_stamp)
             sleep(0.5)
 
 
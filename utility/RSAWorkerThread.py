@@ -1,14 +1,17 @@
 import os
+import threading
 from time import sleep
 
 from PyQt6.QtCore import QThread, pyqtSignal
 
-from constants import KEYS_DIR_PATH
-from utility.keygen import generate_rsa_keypair, encrypt_private_key
+from constants import KEYS_DIR_PATH, DEFAULT_KEY_TYPE, PRIVATE_KEY_EXTENSION, PUBLIC_KEY_EXTENSION
+from utility.keygen import generate_keypair, encrypt_private_key
+from utility.key_container import pack_public_key
+from utility.parallel_keygen import KeygenCancelled
 
-## @brief Worker thread for RSA key generation and encryption
+## @brief Worker thread for key generation and encryption
 ##
-## This class handles the generation and encryption of RSA key pairs
+## This class handles the generation and encryption of RSA, ECDSA P-256 and Ed25519 key pairs
 ## in a separate thread to keep the UI responsive during the operation
 class RSAWorkerThread(QThread):
     ## @brief Signal emitted when generation progress changes
@@ -21,20 +24,43 @@ class RSAWorkerThread(QThread):
     ## @param filename Base filename for the key files
     ## @param pin PIN for private key encryption
     ## @param usb_path Path to the USB drive for private key storage
-    def __init__(self, filename, pin, usb_path):
+    ## @param key_type Type of the key pair to generate (one of KEY_TYPES)
+    def __init__(self, filename, pin, usb_path, key_type=DEFAULT_KEY_TYPE):
         super().__init__()
         self.filename = filename
         self.pin = pin
         self.usb_path = usb_path
+        self.key_type = key_type
+        self._cancel_event = threading.Event()
+
+    ## @brief Requests cancellation of a running key generation
+    ##
+    ## Takes effect while the key pair is being generated; nothing is written
+    ## to the USB drive or the keys directory after a cancellation.
+    def cancel(self):
+        self._cancel_event.set()
+
+    ## @brief Reports prime search progress to the UI
+    ## @param tested Number of prime candidates tested so far
+    ## @param primes_found Number of primes found so far (0-2)
+    def _report_keygen_progress(self, tested, primes_found):
+        self.change_progress_signal.emit(
+            f"Generating {self.key_type.upper()} keypair... "
+            f"{tested} candidates tested, {primes_found}/2 primes found"
+        )
 
     ## @brief Main execution method of the thread
     ##
-    ## Generates RSA key pair, encrypts the private key, and saves both keys
+    ## Generates the key pair, encrypts the private key, and saves both keys
     def run(self):
         try:
             sleep(1)
-            self.change_progress_signal.emit("Generating RSA keypair...")
-            private_key, public_key = generate_rsa_keypair()
+            self.change_progress_signal.emit(f"Generating {self.key_type.upper()} keypair...")
+            private_key, public_key = generate_keypair(
+                key_type=self.key_type,
+                progress=self._report_keygen_progress,
+                cancel_event=self._cancel_event,
+            )
             sleep(0.5)
 
             self.change_progress_signal.emit("Encrypting private key...")
@@ -42,7 +68,7 @@ class RSAWorkerThread(QThread):
             sleep(0.5)
 
             self.change_progress_signal.emit("Saving private key to USB storage drive...")
-            with open(os.path.join(self.usb_path, f"{self.filename}_private.key"), "wb") as f:
+            with open(os.path.join(self.usb_path, f"{self.filename}_private{PRIVATE_KEY_EXTENSION}"), "wb") as f:
                 f.write(encrypted_private_key)
             sleep(0.5)
 
@@ -55,9 +81,13 @@ class RSAWorkerThread(QThread):
 
 
             self.change_progress_signal.emit("Saving public key to local keys directory...")
-            with open(os.path.join(KEYS_DIR_PATH, f"{self.filename}_public.pem"), "wb") as f:
-                f.write(public_key)
+            with open(os.path.join(KEYS_DIR_PATH, f"{self.filename}_public{PUBLIC_KEY_EXTENSION}"), "wb") as f:
+                f.write(pack_public_key(public_key))
             sleep(0.5)
+        except KeygenCancelled:
+            self.change_progress_signal.emit("Key generation cancelled. No keys were saved.")
+            sleep(1)
+            self.task_finished_signal.emit()
         except Exception as e:
             self.change_progress_signal.emit("Generation and encryption failed. ❌ Please try again. \n Error: " + str(e))
             sleep(3)
@@ -5,6 +5,7 @@ from PyQt6.QtCore import QThread, pyqtSignal
 
 from constants import LOGGER_GLOBAL_NAME
 from utility.pdf_sign import verify_pdf_signature
+from utility.profiler import profile_job
 
 logger = logging.getLogger(LOGGER_GLOBAL_NAME)
 
@@ -28,9 +29,15 @@ class VerifyPDFWorkerThread(QThread):
         self.pdf_filepath = pdf_filepath
         self.public_key_filepath = public_key_filepath
 
+    ## @brief Forwards the hashing progress to the progress dialog
+    ## @param percent Percentage of the signed byte range hashed
+    def _report_progress(self, percent):
+        self.change_progress_signal.emit(f"Verifying PDF signature... {percent}%")
+
     ## @brief Main execution method of the thread
     ##
-    ## Verifies the PDF signature and emits signals for progress updates and completion
+    ## Verifies the PDF signature and emits signals for progress updates and completion,
+    ## under the sampling profiler if profiling is enabled
     def run(self):
         try:
             sleep(1)
@@ -38,10 +45,12 @@ class VerifyPDFWorkerThread(QThread):
             sleep(0.5)
 
             self.change_progress_signal.emit("Verifying PDF signature...")
-            is_valid, message = verify_pdf_signature(
-                pdf_filepath=self.pdf_filepath,
-                public_key_filepath=self.public_key_filepath
-            )
+            with profile_job("verify"):
+                is_valid, message = verify_pdf_signature(
+                    pdf_filepath=self.pdf_filepath,
+                    public_key_filepath=self.public_key_filepath,
+                    progress=self._report_progress
+                )
             sleep(0.5)
 
             self.task_finished_signal.emit(is_valid, message)
@@ -0,0 +1,267 @@
+## @file archive_verify.py
+## @brief Verification of signed PDFs inside ZIP and TAR archives without extraction
+##
+## Members matching ARCHIVE_MEMBER_PATTERN are verified in parallel straight
+## from the archive, in one pass over it and without temporary files:
+##  - stored ZIP members and members of uncompressed TAR archives are read
+##    through seekable views of the archive file, so they cost no memory
+##  - compressed ZIP members are decompressed by the worker verifying them,
+##    into memory up to ARCHIVE_MEMBER_MEMORY_LIMIT, larger ones through the
+##    seekable ZIP member stream
+##  - members of compressed TAR archives can only be read in archive order;
+##    each is decompressed into memory (up to ARCHIVE_MEMBER_MEMORY_LIMIT) and
+##    handed to a worker, with at most two pending members per worker
+##
+## One JSON line per member is written to the report as results come in.
+##
+## Run with: python utility/archive_verify.py ARCHIVE PUBLIC_KEY [--report FILE] [--workers N]
+
+import argparse
+import fnmatch
+import io
+import json
+import logging
+import os
+import struct
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import LOGGER_GLOBAL_NAME, ARCHIVE_MEMBER_PATTERN, ARCHIVE_MEMBER_MEMORY_LIMIT
+from utility.crypto_backend import import_key
+from utility.key_container import read_public_key
+from utility.pdf_sign import verify_pdf_stream
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+## @brief Layout of a ZIP local file header
+_ZIP_LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+
+
+## @brief Exception raised when an archive cannot be read
+class ArchiveError(Exception):
+    pass
+
+
+## @brief Read-only, seekable view of a byte range of a file
+##
+## Every view opens its own handle, so views are used from several threads at once.
+class _FileSlice(io.RawIOBase):
+    ## @brief Opens the view
+    ## @param filepath Path to the archive file
+    ## @param offset Offset of the first byte of the range
+    ## @param size Length of the range
+    def __init__(self, filepath: str, offset: int, size: int):
+        super().__init__()
+        self._file = open(filepath, "rb")
+        self._offset = offset
+        self._size = size
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, buffer):
+        count = min(len(buffer), self._size - self._position)
+        if count <= 0:
+            return 0
+        self._file.seek(self._offset + self._position)
+        count = self._file.readinto(memoryview(buffer)[:count])
+        self._position += count
+        return count
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self._size
+        if offset < 0:
+            raise ValueError("Negative seek position")
+        self._position = offset
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+## @brief Opens a view of a byte range of a file as a buffered stream
+## @return io.BufferedReader
+def _open_slice(filepath: str, offset: int, size: int):
+    return io.BufferedReader(_FileSlice(filepath, offset, size))
+
+
+## @brief Reads a whole stream into memory
+## @param stream Binary stream
+## @param size Number of bytes expected
+## @return io.BytesIO
+## @throws ArchiveError if the member exceeds ARCHIVE_MEMBER_MEMORY_LIMIT
+def _read_into_memory(stream, size: int):
+    if size > ARCHIVE_MEMBER_MEMORY_LIMIT:
+        raise ArchiveError(f"Member of {size} bytes exceeds the in-memory limit of "
+                           f"{ARCHIVE_MEMBER_MEMORY_LIMIT} bytes for compressed archives")
+    return io.BytesIO(stream.read())
+
+
+## @brief Lists the matching members of a ZIP archive with openers running in the workers
+## @param archive_path Path to the archive
+## @param archive Open ZipFile
+## @param pattern Pattern of the member file names
+## @return Generator of (member name, size, opener returning a seekable stream)
+def _iter_zip_members(archive_path: str, archive: zipfile.ZipFile, pattern: str):
+    members = [info for info in archive.infolist()
+               if not info.is_dir() and fnmatch.fnmatch(os.path.basename(info.filename), pattern)]
+    # Archive order, so the workers together sweep the file once
+    members.sort(key=lambda info: info.header_offset)
+    with open(archive_path, "rb") as f:
+        for info in members:
+            if info.flag_bits & 0x1:
+                def opener(name=info.filename):
+                    raise ArchiveError(f"Encrypted member {name} cannot be verified")
+            elif info.compress_type == zipfile.ZIP_STORED:
+                f.seek(info.header_offset)
+                header = _ZIP_LOCAL_HEADER.unpack(f.read(_ZIP_LOCAL_HEADER.size))
+                data_offset = info.header_offset + _ZIP_LOCAL_HEADER.size + header[9] + header[10]
+
+                def opener(offset=data_offset, size=info.file_size):
+                    return _open_slice(archive_path, offset, size)
+            elif info.file_size <= ARCHIVE_MEMBER_MEMORY_LIMIT:
+                def opener(member=info):
+                    with archive.open(member) as stream:
+                        return _read_into_memory(stream, member.file_size)
+            else:
+                # Seekable, but seeking backwards decompresses again from the start
+                def opener(member=info):
+                    return archive.open(member)
+            yield info.filename, info.file_size, opener
+
+
+## @brief Lists the matching members of a TAR archive
+##
+## Uncompressed archives yield openers of views of the archive file;
+## compressed archives are read as a stream and yield members already in memory.
+## @param archive_path Path to the archive
+## @param pattern Pattern of the member file names
+## @return Generator of (member name, size, opener returning a seekable stream)
+def _iter_tar_members(archive_path: str, pattern: str):
+    try:
+        archive = tarfile.open(archive_path, "r:")
+        seekable = True
+    except tarfile.ReadError:
+        archive = tarfile.open(archive_path, "r|*")
+        seekable = False
+    with archive:
+        for member in archive:
+            if not member.isfile() or not fnmatch.fnmatch(os.path.basename(member.name), pattern):
+                continue
+            if seekable:
+                def opener(offset=member.offset_data, size=member.size):
+                    return _open_slice(archive_path, offset, size)
+            else:
+                try:
+                    data = _read_into_memory(archive.extractfile(member), member.size)
+                except ArchiveError as e:
+                    def opener(error=e):
+                        raise error
+                else:
+                    def opener(data=data):
+                        return data
+            yield member.name, member.size, opener
+
+
+## @brief Opens a ZIP or TAR archive for listing its matching members
+##
+## The openers may be called until the context is left.
+## @param archive_path Path to the archive
+## @param pattern Pattern of the member file names
+## @return Context manager yielding a generator of (member name, size, opener returning a seekable stream)
+## @throws ArchiveError if the file is neither a ZIP nor a TAR archive
+@contextmanager
+def open_archive_members(archive_path: str, pattern: str = ARCHIVE_MEMBER_PATTERN):
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            yield _iter_zip_members(archive_path, archive, pattern)
+    elif tarfile.is_tarfile(archive_path):
+        yield _iter_tar_members(archive_path, pattern)
+    else:
+        raise ArchiveError(f"{archive_path} is neither a ZIP nor a TAR archive")
+
+
+## @brief Verifies every signed PDF in an archive
+## @param archive_path Path to the ZIP or TAR archive (optionally gzip, bzip2 or xz compressed)
+## @param public_key_filepath Path to the public key file
+## @param report Writable text stream receiving one JSON line per member, or None
+## @param workers Number of verification threads
+## @param pattern Pattern of the member file names
+## @param trust_store Optional TrustStore, defaults to the one at TRUST_STORE_PATH
+## @return Dictionary with the number of members, valid and invalid signatures
+## @throws ArchiveError if the archive cannot be read
+def verify_archive(archive_path: str, public_key_filepath: str, report=None, workers: int | None = None,
+                   pattern: str = ARCHIVE_MEMBER_PATTERN, trust_store=None) -> dict:
+    public_key = import_key(read_public_key(public_key_filepath))
+    workers = workers or os.cpu_count() or 1
+    pending = threading.BoundedSemaphore(workers * 2)
+    report_lock = threading.Lock()
+    summary = {"members": 0, "valid": 0, "invalid": 0}
+
+    def verify_member(index, name, size, opener):
+        start = time.perf_counter()
+        try:
+            with opener() as stream:
+                is_valid, message = verify_pdf_stream(stream, public_key, trust_store)
+        except Exception as e:
+            is_valid, message = False, f"Member cannot be read: {e}"
+        finally:
+            pending.release()
+        entry = {"index": index, "member": name, "size": size, "valid": is_valid, "message": message,
+                 "seconds": round(time.perf_counter() - start, 4)}
+        with report_lock:
+            summary["valid" if is_valid else "invalid"] += 1
+            if report is not None:
+                report.write(json.dumps(entry) + "\n")
+
+    try:
+        with open_archive_members(archive_path, pattern) as members, \
+                ThreadPoolExecutor(max_workers=workers, thread_name_prefix="archive-verify") as executor:
+            for index, (name, size, opener) in enumerate(members):
+                pending.acquire()
+                summary["members"] += 1
+                executor.submit(verify_member, index, name, size, opener)
+    except (tarfile.TarError, zipfile.BadZipFile, OSError) as e:
+        raise ArchiveError(f"Cannot read {archive_path}: {e}")
+
+    logger.info(f"Verified {summary['members']} member(s) of {archive_path}: "
+                f"{summary['valid']} valid, {summary['invalid']} invalid")
+    return summary
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Verify signed PDFs inside a ZIP or TAR archive")
+    parser.add_argument("archive", help="ZIP or TAR archive")
+    parser.add_argument("public_key", help="public key of the signer")
+    parser.add_argument("--report", help="file the JSON lines report is written to (default: standard output)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of verification threads")
+    parser.add_argument("--pattern", default=ARCHIVE_MEMBER_PATTERN, help="pattern of the member file names")
+    args = parser.parse_args()
+
+    report_file = open(args.report, "w", encoding="utf-8") if args.report else sys.stdout
+    try:
+        result = verify_archive(args.archive, args.public_key, report_file, args.workers, args.pattern)
+    finally:
+        if args.report:
+            report_file.close()
+    print(f"{result['members']} member(s): {result['valid']} valid, {result['invalid']} invalid", file=sys.stderr)
+    sys.exit(0 if result["invalid"] == 0 else 1)
@@ -0,0 +1,233 @@
+## @file atomic_writer.py
+## @brief Crash-safe output file writing with optional group commit
+##
+## Output files are written to a temporary file in the target directory and
+## renamed into place only after their data is on disk, so a crash never
+## leaves a truncated file under the final name. Several files can share one
+## flush through an FsyncBatch: their temporary files are flushed together
+## (a single syncfs() call on Linux), then renamed, then each directory is
+## flushed once.
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from constants import LOGGER_GLOBAL_NAME, FSYNC_BATCH_MAX_FILES, FSYNC_BATCH_MAX_DELAY
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    _syncfs = _libc.syncfs
+except (OSError, AttributeError, TypeError):
+    _syncfs = None
+
+# Read once: os.umask() can only be read by setting it, which is not thread-safe later on
+_umask = os.umask(0)
+os.umask(_umask)
+
+
+## @brief Flushes a directory entry table to disk (no-op on Windows)
+## @param dir_path Path to the directory
+## @return None
+def fsync_directory(dir_path: str) -> None:
+    if os.name == "nt":
+        return
+    fd = os.open(dir_path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+## @brief Opens a file for writing that appears under its final name only when complete
+##
+## Without a batch the file is flushed, renamed and its directory flushed when
+## the block exits. With a batch the rename is left to the batch's next commit.
+## On an exception the temporary file is removed.
+## @param filepath Final path of the file
+## @param batch Optional FsyncBatch sharing the flush with other files
+## @param on_commit Optional callback(error) called by the batch after the rename
+## @return Context manager yielding a binary file object
+@contextmanager
+def atomic_write(filepath: str, batch=None, on_commit=None):
+    dir_path, filename = os.path.split(os.path.abspath(filepath))
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, prefix=f".{filename}.", suffix=".tmp")
+    try:
+        # mkstemp creates the file as 0600; give it the mode open() would have
+        if hasattr(os, "fchmod"):
+            os.fchmod(fd, 0o666 & ~_umask)
+        with os.fdopen(fd, "wb") as f:
+            yield f
+            f.flush()
+            if batch is None:
+                os.fsync(f.fileno())
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+    if batch is None:
+        try:
+            os.replace(tmp_path, filepath)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+        fsync_directory(dir_path)
+        if on_commit is not None:
+            on_commit(None)
+    else:
+        try:
+            batch.add(tmp_path, filepath, on_commit)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+## @brief Group commit of several atomically written files
+##
+## Files are committed when max_files are pending, when the oldest pending
+## file waited max_delay seconds, or when commit()/close() is called.
+class FsyncBatch:
+    ## @brief Creates a batch and its background committer
+    ## @param max_files Number of pending files that triggers a commit
+    ## @param max_delay Maximum seconds a file waits for its commit
+    def __init__(self, max_files: int = FSYNC_BATCH_MAX_FILES, max_delay: float = FSYNC_BATCH_MAX_DELAY):
+        self.max_files = max_files
+        self.max_delay = max_delay
+        ## @brief Number of commits done so far
+        self.commits = 0
+        ## @brief Number of files committed so far
+        self.files_committed = 0
+        self._pending: list[tuple[str, str, object]] = []
+        self._oldest = None
+        self._condition = threading.Condition()
+        self._commit_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="fsync-batch", daemon=True)
+        self._thread.start()
+
+    ## @brief Adds a written (not yet flushed) temporary file to the batch
+    ## @param tmp_path Path to the temporary file
+    ## @param filepath Final path of the file
+    ## @param on_commit Optional callback(error) called after the rename
+    def add(self, tmp_path: str, filepath: str, on_commit=None) -> None:
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("FsyncBatch is closed")
+            self._pending.append((tmp_path, filepath, on_commit))
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            self._condition.notify()
+
+    ## @brief Flushes, renames and reports every pending file
+    ## @return Number of files committed
+    def commit(self) -> int:
+        with self._commit_lock:
+            with self._condition:
+                pending, self._pending = self._pending, []
+                self._oldest = None
+            if not pending:
+                return 0
+
+            error = None
+            try:
+                self._flush_files([tmp_path for tmp_path, _, _ in pending])
+            except OSError as e:
+                error = e
+                logger.error(f"Group commit flush failed: {e}")
+
+            directories = {}
+            results = []
+            for tmp_path, filepath, on_commit in pending:
+                file_error = error
+                dir_path = None
+                if file_error is None:
+                    try:
+                        os.replace(tmp_path, filepath)
+                        dir_path = os.path.dirname(os.path.abspath(filepath))
+                        directories[dir_path] = None
+                    except OSError as e:
+                        file_error = e
+                if file_error is not None:
+                    try:
+                        os.unlink(tmp_path)
+                    except OSError:
+                        pass
+                results.append((on_commit, file_error, dir_path))
+
+            # A failure is reported to the files it concerns and never stops the committer
+            for dir_path in directories:
+                try:
+                    fsync_directory(dir_path)
+                except Exception as e:
+                    logger.error(f"Group commit directory flush failed for {dir_path}: {e}")
+                    directories[dir_path] = e
+
+            self.commits += 1
+            self.files_committed += len(pending)
+            for on_commit, file_error, dir_path in results:
+                if on_commit is None:
+                    continue
+                if file_error is None and dir_path is not None:
+                    file_error = directories[dir_path]
+                try:
+                    on_commit(file_error)
+                except Exception as e:
+                    logger.error(f"Group commit callback failed: {e}")
+            return len(pending)
+
+    ## @brief Commits pending files and stops the background committer
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self._thread.join()
+        self.commit()
+
+    ## @brief Flushes the data of the given files to disk
+    ##
+    ## Uses one syncfs() per file system where available, otherwise one
+    ## fsync() per file.
+    ## @param tmp_paths Paths to the files
+    @staticmethod
+    def _flush_files(tmp_paths: list[str]) -> None:
+        synced_devices = set()
+        for tmp_path in tmp_paths:
+            fd = os.open(tmp_path, os.O_RDONLY)
+            try:
+                if _syncfs is not None:
+                    device = os.fstat(fd).st_dev
+                    if device in synced_devices:
+                        continue
+                    if _syncfs(fd) == 0:
+                        synced_devices.add(device)
+                        continue
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    ## @brief Background committer loop
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if len(self._pending) >= self.max_files:
+                        break
+                    if self._oldest is not None:
+                        remaining = self._oldest + self.max_delay - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    else:
+                        self._condition.wait()
+                if self._closed:
+                    return
+            self.commit()
@@ -0,0 +1,343 @@
+## @file crypto_backend.py
+## @brief Pluggable hash and signature backends with runtime selection
+##
+## Hashing can be done by hashlib (OpenSSL, using SHA extensions where the CPU
+## has them), pycryptodomex or cryptography. Signing and verification can be
+## done by pycryptodomex or cryptography. Key objects are always pycryptodomex
+## keys; the cryptography backend converts them once into its own key type.
+##
+## Unless a backend is forced with an environment variable, a short
+## micro-benchmark picks the fastest available backend the first time one is needed.
+
+import hashlib
+import logging
+import os
+import time
+from functools import lru_cache
+
+from Cryptodome.Hash import SHA256
+from Cryptodome.PublicKey import ECC, RSA
+from Cryptodome.Signature import DSS, eddsa, pkcs1_15
+
+from constants import LOGGER_GLOBAL_NAME, KEY_TYPE_RSA, KEY_TYPE_ECDSA_P256, KEY_TYPE_ED25519, \
+    HASH_BACKEND_ENV, SIGNATURE_BACKEND_ENV
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+try:
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec, padding, utils
+except ImportError:
+    hashes = None
+
+## @brief Signature algorithm recorded in the signed document for each key type
+SIGNATURE_ALGORITHMS = {
+    KEY_TYPE_RSA: "rsa-pkcs1v15-sha256",
+    KEY_TYPE_ECDSA_P256: "ecdsa-p256-sha256",
+    KEY_TYPE_ED25519: "ed25519-sha256",
+}
+
+## @brief Size of the buffer hashed by the hash backend benchmark
+_BENCHMARK_DATA_SIZE = 1024 * 1024
+## @brief Number of operations timed per backend by the benchmarks
+_BENCHMARK_ROUNDS = 5
+
+
+## @brief Exception raised when a requested backend is unknown or unavailable
+class BackendUnavailableError(Exception):
+    pass
+
+
+## @brief SHA-256 digest computed elsewhere, usable by pycryptodomex signature schemes
+##
+## pycryptodomex signers only call digest() and read the OID and digest size,
+## so the digest can come from any hash backend.
+class PrehashedSHA256:
+    ## @brief OID of SHA-256, used in the PKCS#1 v1.5 DigestInfo
+    oid = SHA256.new().oid
+    ## @brief Digest size in bytes
+    digest_size = SHA256.digest_size
+
+    ## @brief Wraps a precomputed digest
+    ## @param digest 32-byte SHA-256 digest
+    def __init__(self, digest: bytes):
+        self._digest = digest
+
+    ## @brief Returns the wrapped digest
+    ## @return Digest bytes
+    def digest(self) -> bytes:
+        return self._digest
+
+
+## @brief Hash object adapter giving cryptography hashes the hashlib interface
+class _CryptographySHA256:
+    def __init__(self):
+        self._ctx = hashes.Hash(hashes.SHA256())
+        self._digest = None
+
+    ## @brief Feeds data into the hash
+    ## @param data Bytes-like object
+    def update(self, data) -> None:
+        self._ctx.update(data)
+
+    ## @brief Finalizes the hash (once) and returns the digest
+    ## @return Digest bytes
+    def digest(self) -> bytes:
+        if self._digest is None:
+            self._digest = self._ctx.finalize()
+        return self._digest
+
+
+## @brief SHA-256 hash backend
+class HashBackend:
+    ## @brief Creates a hash backend
+    ## @param name Backend name
+    ## @param factory Callable returning a new hash object with update() and digest()
+    def __init__(self, name: str, factory):
+        self.name = name
+        self._factory = factory
+
+    ## @brief Creates a new SHA-256 hash object
+    ## @return Hash object with update() and digest()
+    def new(self):
+        return self._factory()
+
+
+## @brief Signature backend built on pycryptodomex
+class CryptodomeSignatureBackend:
+    name = "pycryptodomex"
+
+    ## @brief Converts a key into the backend's own key object
+    ## @param key pycryptodomex key
+    ## @return Key object used by sign() and verify()
+    def load_key(self, key):
+        return key
+
+    ## @brief Signs a SHA-256 digest
+    ## @param key Private key returned by load_key()
+    ## @param key_type Key type of @p key
+    ## @param digest SHA-256 digest of the document
+    ## @return Signature bytes
+    def sign(self, key, key_type: str, digest: bytes) -> bytes:
+        if key_type == KEY_TYPE_RSA:
+            return pkcs1_15.new(key).sign(PrehashedSHA256(digest))
+        if key_type == KEY_TYPE_ECDSA_P256:
+            return DSS.new(key, "fips-186-3", encoding="der").sign(PrehashedSHA256(digest))
+        return eddsa.new(key, "rfc8032").sign(digest)
+
+    ## @brief Verifies a signature of a SHA-256 digest
+    ## @param key Public key returned by load_key()
+    ## @param key_type Key type of @p key
+    ## @param digest SHA-256 digest of the document
+    ## @param signature Signature bytes
+    ## @throws ValueError if the signature is invalid
+    def verify(self, key, key_type: str, digest: bytes, signature: bytes) -> None:
+        if key_type == KEY_TYPE_RSA:
+            pkcs1_15.new(key).verify(PrehashedSHA256(digest), signature)
+        elif key_type == KEY_TYPE_ECDSA_P256:
+            DSS.new(key, "fips-186-3", encoding="der").verify(PrehashedSHA256(digest), signature)
+        else:
+            eddsa.new(key, "rfc8032").verify(digest, signature)
+
+
+## @brief Signature backend built on cryptography (OpenSSL)
+class CryptographySignatureBackend:
+    name = "cryptography"
+
+    ## @brief Converts a pycryptodomex key into a cryptography key object
+    ## @param key pycryptodomex key
+    ## @return cryptography key object
+    def load_key(self, key):
+        if key.has_private():
+            if isinstance(key, RSA.RsaKey):
+                der = key.export_key(format="DER", pkcs=8)
+            else:
+                der = key.export_key(format="DER")
+            return serialization.load_der_private_key(der, password=None)
+        return serialization.load_der_public_key(key.export_key(format="DER"))
+
+    ## @brief Signs a SHA-256 digest
+    ## @param key Private key returned by load_key()
+    ## @param key_type Key type of @p key
+    ## @param digest SHA-256 digest of the document
+    ## @return Signature bytes
+    def sign(self, key, key_type: str, digest: bytes) -> bytes:
+        if key_type == KEY_TYPE_RSA:
+            return key.sign(digest, padding.PKCS1v15(), utils.Prehashed(hashes.SHA256()))
+        if key_type == KEY_TYPE_ECDSA_P256:
+            return key.sign(digest, ec.ECDSA(utils.Prehashed(hashes.SHA256())))
+        return key.sign(digest)
+
+    ## @brief Verifies a signature of a SHA-256 digest
+    ## @param key Public key returned by load_key()
+    ## @param key_type Key type of @p key
+    ## @param digest SHA-256 digest of the document
+    ## @param signature Signature bytes
+    ## @throws ValueError if the signature is invalid
+    def verify(self, key, key_type: str, digest: bytes, signature: bytes) -> None:
+        try:
+            if key_type == KEY_TYPE_RSA:
+                key.verify(signature, digest, padding.PKCS1v15(), utils.Prehashed(hashes.SHA256()))
+            elif key_type == KEY_TYPE_ECDSA_P256:
+                key.verify(signature, digest, ec.ECDSA(utils.Prehashed(hashes.SHA256())))
+            else:
+                key.verify(signature, digest)
+        except InvalidSignature:
+            raise ValueError("Invalid signature")
+
+
+## @brief Returns all hash backends usable on this host
+## @return Dictionary mapping backend name to HashBackend
+def available_hash_backends() -> dict[str, HashBackend]:
+    backends = {
+        "hashlib": HashBackend("hashlib", hashlib.sha256),
+        "pycryptodomex": HashBackend("pycryptodomex", SHA256.new),
+    }
+    if hashes is not None:
+        backends["cryptography"] = HashBackend("cryptography", _CryptographySHA256)
+    return backends
+
+
+## @brief Returns all signature backends usable on this host
+## @return Dictionary mapping backend name to signature backend
+def available_signature_backends() -> dict:
+    backends = {"pycryptodomex": CryptodomeSignatureBackend()}
+    if hashes is not None:
+        backends["cryptography"] = CryptographySignatureBackend()
+    return backends
+
+
+## @brief Returns the hash backend used by the application
+##
+## Uses the backend named in the PADES_HASH_BACKEND environment variable,
+## otherwise the fastest one according to benchmark_hash_backends().
+## @return HashBackend
+## @throws BackendUnavailableError if the forced backend is not available
+@lru_cache(maxsize=None)
+def get_hash_backend() -> HashBackend:
+    backends = available_hash_backends()
+    forced = os.getenv(HASH_BACKEND_ENV)
+    if forced:
+        if forced not in backends:
+            raise BackendUnavailableError(f"Hash backend not available: {forced}")
+        return backends[forced]
+    timings = benchmark_hash_backends(backends)
+    name = min(timings, key=timings.get)
+    logger.info(f"Selected hash backend: {name} ({_format_timings(timings)})")
+    return backends[name]
+
+
+## @brief Returns the signature backend used by the application
+##
+## Uses the backend named in the PADES_SIGNATURE_BACKEND environment variable,
+## otherwise the fastest one according to benchmark_signature_backends().
+## @return Signature backend
+## @throws BackendUnavailableError if the forced backend is not available
+@lru_cache(maxsize=None)
+def get_signature_backend():
+    backends = available_signature_backends()
+    forced = os.getenv(SIGNATURE_BACKEND_ENV)
+    if forced:
+        if forced not in backends:
+            raise BackendUnavailableError(f"Signature backend not available: {forced}")
+        return backends[forced]
+    timings = benchmark_signature_backends(backends)
+    name = min(timings, key=timings.get)
+    logger.info(f"Selected signature backend: {name} ({_format_timings(timings)})")
+    return backends[name]
+
+
+## @brief Measures how long each hash backend takes to hash a 1 MiB buffer
+## @param backends Dictionary of hash backends, defaults to all available ones
+## @return Dictionary mapping backend name to best time in seconds
+def benchmark_hash_backends(backends: dict | None = None) -> dict[str, float]:
+    backends = backends or available_hash_backends()
+    data = bytes(_BENCHMARK_DATA_SIZE)
+    timings = {}
+    for name, backend in backends.items():
+        best = float("inf")
+        for _ in range(_BENCHMARK_ROUNDS):
+            start = time.perf_counter()
+            hash_obj = backend.new()
+            hash_obj.update(data)
+            hash_obj.digest()
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+    return timings
+
+
+## @brief Measures how long each signature backend takes to sign and verify a digest
+##
+## Uses a throwaway ECDSA P-256 key so the benchmark stays fast; the relative
+## speed of the backends carries over to the other key types.
+## @param backends Dictionary of signature backends, defaults to all available ones
+## @return Dictionary mapping backend name to best time in seconds
+def benchmark_signature_backends(backends: dict | None = None) -> dict[str, float]:
+    backends = backends or available_signature_backends()
+    private_key = ECC.generate(curve="P-256")
+    public_key = private_key.public_key()
+    digest = hashlib.sha256(b"benchmark").digest()
+    timings = {}
+    for name, backend in backends.items():
+        signing_key = backend.load_key(private_key)
+        verifying_key = backend.load_key(public_key)
+        best = float("inf")
+        for _ in range(_BENCHMARK_ROUNDS):
+            start = time.perf_counter()
+            signature = backend.sign(signing_key, KEY_TYPE_ECDSA_P256, digest)
+            backend.verify(verifying_key, KEY_TYPE_ECDSA_P256, digest, signature)
+            best = min(best, time.perf_counter() - start)
+        timings[name] = best
+    return timings
+
+
+## @brief Imports a private or public key of any supported type
+## @param encoded_key PEM or DER encoded key
+## @return pycryptodomex RSA or ECC key
+## @throws ValueError if the key format is not supported
+def import_key(encoded_key: bytes):
+    try:
+        return RSA.import_key(encoded_key)
+    except ValueError:
+        return ECC.import_key(encoded_key)
+
+
+## @brief Returns the key type of a key
+## @param key pycryptodomex RSA or ECC key
+## @return One of KEY_TYPES
+## @throws ValueError if the key type is not supported
+def get_key_type(key) -> str:
+    if isinstance(key, RSA.RsaKey):
+        return KEY_TYPE_RSA
+    if key.curve == "NIST P-256":
+        return KEY_TYPE_ECDSA_P256
+    if key.curve == "Ed25519":
+        return KEY_TYPE_ED25519
+    raise ValueError(f"Unsupported key type: {key.curve}")
+
+
+## @brief Signs a SHA-256 digest with the selected signature backend
+## @param private_key pycryptodomex private key
+## @param digest SHA-256 digest of the document
+## @return Signature bytes
+def sign_digest(private_key, digest: bytes) -> bytes:
+    backend = get_signature_backend()
+    return backend.sign(backend.load_key(private_key), get_key_type(private_key), digest)
+
+
+## @brief Verifies a signature of a SHA-256 digest with the selected signature backend
+## @param public_key pycryptodomex public key
+## @param digest SHA-256 digest of the document
+## @param signature Signature bytes
+## @throws ValueError if the signature is invalid
+def verify_digest(public_key, digest: bytes, signature: bytes) -> None:
+    backend = get_signature_backend()
+    backend.verify(backend.load_key(public_key), get_key_type(public_key), digest, signature)
+
+
+## @brief Formats benchmark timings for logging
+## @param timings Dictionary mapping backend name to time in seconds
+## @return Human readable summary
+def _format_timings(timings: dict[str, float]) -> str:
+    return ", ".join(f"{name}: {seconds * 1000:.3f} ms" for name, seconds in sorted(timings.items(), key=lambda t: t[1]))
@@ -0,0 +1,182 @@
+## @file digest_memo.py
+## @brief In-memory memo of document digests shared by signing and verification
+##
+## A document is often hashed several times in a row: signed, verified right
+## away, verified again later. The memo keeps the digests computed for a file
+## under the file's identity, so while the file is unchanged its digest is
+## computed once:
+##  - the identity is (device, inode, size, modification time, change time);
+##    rewriting or replacing the file changes it, and the change time cannot
+##    be set back by tools restoring modification times
+##  - a SHA-256 of the size and the first and last DIGEST_MEMO_SAMPLE_SIZE
+##    bytes is checked on every lookup, catching rewrites within one clock tick
+##    that changed the header or the trailer, which every incremental update does
+##  - digests are kept per (profile, page range, signed length), so the
+##    profiles of one file do not mix
+##
+## sign_pdf_file records the digest under the identity of the input file and,
+## once the signed file is in place, of the signed file, whose signed range
+## has the same digest. verify_pdf_signature looks it up before hashing.
+## The memo holds the DIGEST_MEMO_SIZE most recently used files.
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from constants import LOGGER_GLOBAL_NAME, DIGEST_MEMO_SIZE, DIGEST_MEMO_SAMPLE_SIZE
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+_default_memo = None
+_default_memo_lock = threading.Lock()
+
+
+## @brief Memo of document digests keyed by file identity
+class DigestMemo:
+    ## @brief Creates an empty memo
+    ## @param max_files Maximum number of files whose digests are kept
+    ## @param sample_size Number of bytes sampled at the start and at the end of a file
+    def __init__(self, max_files: int = DIGEST_MEMO_SIZE, sample_size: int = DIGEST_MEMO_SAMPLE_SIZE):
+        self.max_files = max_files
+        self.sample_size = sample_size
+        ## @brief Number of lookups answered from the memo
+        self.hits = 0
+        ## @brief Number of lookups that found no valid digest
+        self.misses = 0
+        # (device, inode) -> (identity, sample hash, {digest key: digest})
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    ## @brief Returns the memoized digest of a file, if the file is unchanged
+    ## @param stream Binary stream of the file, opened on the file itself
+    ## @param profile Digest profile
+    ## @param pages Normalized page range specification, or None
+    ## @param signed_length Length of the signed byte range, or None
+    ## @return Digest, or None
+    def lookup(self, stream, profile: str, pages: str | None, signed_length: int | None) -> bytes | None:
+        identity = self._identity(stream)
+        with self._lock:
+            entry = self._entries.get(identity[:2]) if identity is not None else None
+        if entry is None or entry[0] != identity:
+            self._count(hit=False)
+            return None
+        digest = entry[2].get((profile, pages, signed_length))
+        if digest is None:
+            self._count(hit=False)
+            return None
+        if self._sample(stream, identity[2]) != entry[1]:
+            logger.info("Digest memo entry is stale: file content changed without a new timestamp")
+            self._discard(identity)
+            self._count(hit=False)
+            return None
+        with self._lock:
+            if identity[:2] in self._entries:
+                self._entries.move_to_end(identity[:2])
+        self._count(hit=True)
+        return digest
+
+    ## @brief Records the digest of a file
+    ## @param stream Binary stream of the file, opened on the file itself
+    ## @param profile Digest profile
+    ## @param pages Normalized page range specification, or None
+    ## @param signed_length Length of the signed byte range, or None
+    ## @param digest Digest to record
+    ## @return None
+    def record(self, stream, profile: str, pages: str | None, signed_length: int | None, digest: bytes) -> None:
+        identity = self._identity(stream)
+        if identity is None:
+            return
+        sample = self._sample(stream, identity[2])
+        with self._lock:
+            entry = self._entries.get(identity[:2])
+            if entry is None or entry[0] != identity or entry[1] != sample:
+                entry = (identity, sample, {})
+                self._entries[identity[:2]] = entry
+            entry[2][(profile, pages, signed_length)] = digest
+            self._entries.move_to_end(identity[:2])
+            while len(self._entries) > self.max_files:
+                self._entries.popitem(last=False)
+
+    ## @brief Records the digest of a file given by its path
+    ## @param filepath Path to the file
+    ## @see record
+    def record_file(self, filepath: str, profile: str, pages: str | None, signed_length: int | None,
+                    digest: bytes) -> None:
+        try:
+            with open(filepath, "rb") as stream:
+                self.record(stream, profile, pages, signed_length, digest)
+        except OSError as e:
+            logger.warning(f"Digest of {filepath} cannot be memoized: {e}")
+
+    ## @brief Removes all entries
+    ## @return None
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    ## @brief Counts a lookup
+    ## @param hit Whether the lookup was answered from the memo
+    def _count(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    ## @brief Removes the entry of a file if it still has the given identity
+    ## @param identity File identity returned by _identity
+    def _discard(self, identity: tuple) -> None:
+        with self._lock:
+            entry = self._entries.get(identity[:2])
+            if entry is not None and entry[0] == identity:
+                del self._entries[identity[:2]]
+
+    ## @brief Returns the identity of the file a stream reads
+    ## @param stream Binary stream
+    ## @return Tuple (device, inode, size, mtime_ns, ctime_ns), or None if the stream is not backed by a file
+    @staticmethod
+    def _identity(stream) -> tuple | None:
+        try:
+            stat = os.fstat(stream.fileno())
+        except (AttributeError, OSError, ValueError):
+            return None
+        return stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, stat.st_ctime_ns
+
+    ## @brief Hashes the size and the first and last bytes of a file
+    ## @param stream Seekable binary stream of the file
+    ## @param size Size of the file
+    ## @return SHA-256 digest
+    def _sample(self, stream, size: int) -> bytes:
+        hash_obj = hashlib.sha256(size.to_bytes(8, "big"))
+        stream.seek(0)
+        hash_obj.update(stream.read(min(size, self.sample_size)))
+        if size > self.sample_size:
+            stream.seek(max(self.sample_size, size - self.sample_size))
+            hash_obj.update(stream.read(self.sample_size))
+        return hash_obj.digest()
+
+
+## @brief Returns the memo shared by signing and verification in this process
+## @return DigestMemo
+def get_default_digest_memo() -> DigestMemo:
+    global _default_memo
+    with _default_memo_lock:
+        if _default_memo is None:
+            _default_memo = DigestMemo()
+        return _default_memo
+
+
+## @brief Replaces the locks a thread may have held when the process forked
+##
+## The entries stay valid in the child: they describe file contents, not the process.
+def _reset_after_fork() -> None:
+    global _default_memo_lock
+    _default_memo_lock = threading.Lock()
+    if _default_memo is not None:
+        _default_memo._lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,240 @@
+## @file digest_profiles.py
+## @brief Digest profiles selecting which parts of a PDF are signed
+##
+## Each profile feeds a different part of the document into a hash object:
+##  - "text"    extracted text of every page (signatures made before profiles existed)
+##  - "full"    every byte of the original file, read sequentially
+##  - "content" raw content streams of every page
+##  - "pages"   content streams and all referenced objects (fonts, images,
+##              annotations) of a declared page subset
+##
+## Pages are located by walking the page tree with the /Count entries, so
+## only the page objects of the selected pages and the objects they reference
+## are loaded from the cross-reference table.
+
+from bisect import bisect_left
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, PdfObject, StreamObject
+
+from constants import DIGEST_PROFILE_TEXT, DIGEST_PROFILE_FULL, DIGEST_PROFILE_CONTENT, \
+    DIGEST_PROFILE_PAGES, DIGEST_PROFILES
+from utility.pdf_incremental import serialize_object
+from utility.read_ahead import read_ahead
+
+## @brief Keys pointing back up the object graph, skipped when hashing page objects
+_BACK_REFERENCE_KEYS = ("/Parent", "/P")
+
+
+## @brief Exception raised when a digest profile or page range is invalid
+class DigestProfileError(ValueError):
+    pass
+
+
+## @brief Parses a page range specification
+## @param spec Comma separated 1-based pages or ranges, e.g. "1-3,7,10-"
+## @param page_count Number of pages in the document
+## @return Sorted list of 0-based page indices
+## @throws DigestProfileError if the specification is malformed or out of range
+def parse_page_ranges(spec: str, page_count: int) -> list[int]:
+    indices = set()
+    for part in spec.replace(" ", "").split(","):
+        if not part:
+            continue
+        try:
+            if "-" in part:
+                first, last = part.split("-", 1)
+                first = int(first) if first else 1
+                last = int(last) if last else page_count
+            else:
+                first = last = int(part)
+        except ValueError:
+            raise DigestProfileError(f"Invalid page range: {part}")
+        if first < 1 or last > page_count or first > last:
+            raise DigestProfileError(f"Page range {part} outside of document (1-{page_count})")
+        indices.update(range(first - 1, last))
+    if not indices:
+        raise DigestProfileError("Page range is empty")
+    return sorted(indices)
+
+
+## @brief Formats page indices as a normalized page range specification
+## @param indices Sorted list of 0-based page indices
+## @return 1-based specification, e.g. "1-3,7"
+def format_page_ranges(indices: list[int]) -> str:
+    parts = []
+    start = prev = None
+    for index in indices:
+        if prev is not None and index == prev + 1:
+            prev = index
+            continue
+        if start is not None:
+            parts.append(f"{start + 1}-{prev + 1}" if start != prev else f"{start + 1}")
+        start = prev = index
+    if start is not None:
+        parts.append(f"{start + 1}-{prev + 1}" if start != prev else f"{start + 1}")
+    return ",".join(parts)
+
+
+## @brief Returns the number of pages declared in the page tree root
+## @param reader PdfReader of the document
+## @return Page count
+def get_page_count(reader: PdfReader) -> int:
+    return int(reader.trailer["/Root"]["/Pages"]["/Count"])
+
+
+## @brief Feeds the digest of a document into a hash object
+## @param hash_obj Hash object with an update() method
+## @param reader PdfReader of the document
+## @param stream Seekable binary stream of the document (used by the "full" profile)
+## @param profile One of DIGEST_PROFILES
+## @param pages Normalized page range specification (used by the "pages" profile)
+## @param signed_length Number of bytes hashed by the "full" profile
+## @param progress Optional callback receiving the hashed percentage of the "full" profile's byte range
+## @return @p hash_obj
+## @throws DigestProfileError if the profile is unknown
+def update_digest(hash_obj, reader: PdfReader, stream, profile: str,
+                  pages: str | None = None, signed_length: int | None = None, progress=None):
+    if profile == DIGEST_PROFILE_TEXT:
+        for page in reader.pages:
+            text = page.extract_text()
+            if text:
+                hash_obj.update(text.encode())
+    elif profile == DIGEST_PROFILE_FULL:
+        _update_byte_range(hash_obj, stream, signed_length, progress)
+    elif profile == DIGEST_PROFILE_CONTENT:
+        for index, page, _ in iter_pages(reader):
+            hash_obj.update(index.to_bytes(4, "big"))
+            _update_content_streams(hash_obj, page)
+    elif profile == DIGEST_PROFILE_PAGES:
+        if not pages:
+            raise DigestProfileError("Page range required for the pages profile")
+        indices = parse_page_ranges(pages, get_page_count(reader))
+        for index, page, resources in iter_pages(reader, indices):
+            hash_obj.update(index.to_bytes(4, "big"))
+            _update_page_objects(hash_obj, page, resources)
+    else:
+        raise DigestProfileError(f"Unknown digest profile: {profile} (expected one of {', '.join(DIGEST_PROFILES)})")
+    return hash_obj
+
+
+## @brief Iterates over pages by walking the page tree
+##
+## Subtrees whose /Count shows they contain no selected page are skipped
+## without being loaded.
+## @param reader PdfReader of the document
+## @param indices Sorted 0-based page indices to visit, None for all pages
+## @return Generator of (index, page dictionary, inherited /Resources or None)
+## @throws DigestProfileError if a node of the page tree is reached twice (e.g. through a /Kids cycle)
+def iter_pages(reader: PdfReader, indices: list[int] | None = None):
+    root = reader.trailer["/Root"].raw_get("/Pages")
+    visited = {(root.idnum, root.generation)} if isinstance(root, IndirectObject) else set()
+    # Stack of (node, index of its first page, inherited resources)
+    stack = [(root, 0, None)]
+    while stack:
+        node, first, resources = stack.pop()
+        node = node.get_object()
+        resources = node.raw_get("/Resources") if "/Resources" in node else resources
+        if node.get("/Type") == "/Pages" or "/Kids" in node:
+            children = []
+            offset = first
+            for kid in node["/Kids"]:
+                if isinstance(kid, IndirectObject):
+                    if (kid.idnum, kid.generation) in visited:
+                        raise DigestProfileError(f"Page tree reaches object {kid.idnum} twice")
+                    visited.add((kid.idnum, kid.generation))
+                kid_obj = kid.get_object()
+                count = int(kid_obj.get("/Count", 1)) if "/Kids" in kid_obj else 1
+                if indices is None or _contains_index(indices, offset, offset + count):
+                    children.append((kid_obj, offset, resources))
+                offset += count
+            stack.extend(reversed(children))
+        elif indices is None or _contains_index(indices, first, first + 1):
+            yield first, node, resources
+
+
+## @brief Checks if a sorted index list contains a value in [start, stop)
+## @param indices Sorted list of indices
+## @param start First index of the range
+## @param stop Index past the end of the range
+## @return True if any index falls in the range
+def _contains_index(indices: list[int], start: int, stop: int) -> bool:
+    pos = bisect_left(indices, start)
+    return pos < len(indices) and indices[pos] < stop
+
+
+## @brief Hashes a byte range of a file, reading the next chunk while the current one is hashed
+## @param hash_obj Hash object with an update() method
+## @param stream Seekable binary stream
+## @param length Number of bytes from the start of the stream to hash
+## @param progress Optional callback receiving the hashed percentage
+def _update_byte_range(hash_obj, stream, length: int, progress=None) -> None:
+    stream.seek(0)
+    if read_ahead(stream, length, hash_obj.update, progress) < length:
+        raise DigestProfileError("File is shorter than the signed byte range")
+
+
+## @brief Hashes the raw (still encoded) content streams of a page
+##
+## The number of streams is hashed first, so streams cannot be moved between
+## pages and a page without /Contents differs from one with an empty stream.
+## @param hash_obj Hash object with an update() method
+## @param page Page dictionary
+def _update_content_streams(hash_obj, page: DictionaryObject) -> None:
+    contents = page.get("/Contents")
+    if contents is None:
+        streams = []
+    else:
+        streams = contents if isinstance(contents, ArrayObject) else [contents]
+    hash_obj.update(len(streams).to_bytes(4, "big"))
+    for content in streams:
+        data = content.get_object()._data
+        hash_obj.update(len(data).to_bytes(8, "big"))
+        hash_obj.update(data)
+
+
+## @brief Hashes a page and every object reachable from it in a canonical form
+##
+## Dictionary keys are visited in sorted order and indirect objects are
+## replaced by their visiting order, so the result does not depend on object
+## numbers or on how the file was serialized.
+## @param hash_obj Hash object with an update() method
+## @param page Page dictionary
+## @param resources Resources inherited from the page tree, or None
+def _update_page_objects(hash_obj, page: DictionaryObject, resources) -> None:
+    ordinals = {}
+    stack = [page]
+    if "/Resources" not in page and resources is not None:
+        stack.insert(0, resources)
+    while stack:
+        item = stack.pop()
+        if isinstance(item, IndirectObject):
+            key = (item.idnum, item.generation)
+            if key in ordinals:
+                hash_obj.update(b"R" + ordinals[key].to_bytes(4, "big"))
+            else:
+                ordinals[key] = len(ordinals)
+                hash_obj.update(b"O" + ordinals[key].to_bytes(4, "big"))
+                stack.append(item.get_object())
+        elif isinstance(item, DictionaryObject):
+            keys = sorted(k for k in item.keys() if k not in _BACK_REFERENCE_KEYS)
+            children = [b"<<" + len(keys).to_bytes(4, "big")]
+            for key in keys:
+                children.append(key.encode())
+                children.append(dict.__getitem__(item, key))
+            if isinstance(item, StreamObject):
+                data = item._data
+                children.append(b"stream" + len(data).to_bytes(8, "big"))
+                children.append(data)
+            children.append(b">>")
+            stack.extend(reversed(children))
+        elif isinstance(item, ArrayObject):
+            children = [b"[" + len(item).to_bytes(4, "big")]
+            children.extend(list.__iter__(item))
+            children.append(b"]")
+            stack.extend(reversed(children))
+        elif isinstance(item, PdfObject):
+            hash_obj.update(serialize_object(item))
+        else:
+            # Structural markers and stream data queued above
+            hash_obj.update(item)
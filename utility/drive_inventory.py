@@ -0,0 +1,120 @@
+## @file drive_inventory.py
+## @brief Concurrent key discovery on all connected USB drives
+##
+## Every detected drive is searched for private keys in its own worker thread,
+## so discovery takes as long as the slowest drive rather than the sum of all
+## drives. Each drive keeps a cached key inventory that is reused until the
+## drive's root folder changes or the inventory gets older than
+## USB_KEY_RESCAN_INTERVAL.
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from typing import NamedTuple
+
+from constants import LOGGER_GLOBAL_NAME, USB_SCAN_WORKERS, USB_KEY_RESCAN_INTERVAL
+from utility.key_container import KeyHeader, read_headers
+from utility.usb_handler import search_usb_for_private_key
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+
+## @brief Detected USB drive with the private keys found on it
+class DriveInfo(NamedTuple):
+    ## @brief Path to the drive
+    device: str
+    ## @brief Volume name of the drive
+    name: str
+    ## @brief Paths to the private key files on the drive
+    private_keys: tuple[Path, ...]
+    ## @brief Container header of each private key (None for keys without one), in the same order
+    key_headers: tuple[KeyHeader | None, ...] = ()
+
+
+## @brief Scans USB drives for private keys in a background thread pool
+class DriveInventory:
+    ## @brief Creates the inventory and its thread pool
+    ## @param max_workers Maximum number of drives scanned at the same time
+    ## @param rescan_interval Seconds a cached inventory is reused while the drive root is unchanged
+    def __init__(self, max_workers: int = USB_SCAN_WORKERS, rescan_interval: float = USB_KEY_RESCAN_INTERVAL):
+        self.rescan_interval = rescan_interval
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="usb-scan")
+        self._cache: dict[str, tuple[int, float, tuple[Path, ...], tuple[KeyHeader | None, ...]]] = {}
+        self._lock = threading.Lock()
+
+    ## @brief Scans the given drives concurrently
+    ##
+    ## Returns immediately. The callback is called once, from a worker thread,
+    ## with a list of DriveInfo in the order of the given drives. Drives that
+    ## are no longer connected are dropped from the cache.
+    ## @param drives Drive list as returned by check_for_usb_device()
+    ## @param callback Function called with the list of DriveInfo
+    ## @return None
+    def scan_async(self, drives: list[dict], callback) -> None:
+        drives = [drive for drive in drives if drive["device"]]
+        self._forget_missing({drive["device"] for drive in drives})
+        if not drives:
+            callback([])
+            return
+
+        results: list[DriveInfo | None] = [None] * len(drives)
+        remaining = [len(drives)]
+        for index, drive in enumerate(drives):
+            future = self._executor.submit(self._scan_drive, drive["device"])
+            future.add_done_callback(partial(self._drive_scanned, drives, index, results, remaining, callback))
+
+    ## @brief Stops the thread pool
+    ## @return None
+    def close(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    ## @brief Collects the result of one drive and reports when all drives are done
+    def _drive_scanned(self, drives, index, results, remaining, callback, future) -> None:
+        drive = drives[index]
+        try:
+            try:
+                private_keys, key_headers = future.result()
+            except Exception as e:
+                logger.warning(f"Scanning USB drive {drive['device']} failed: {e}")
+                private_keys, key_headers = (), ()
+            results[index] = DriveInfo(drive["device"], drive["name"], private_keys, key_headers)
+        finally:
+            # Counted even if building the result failed, so the callback always comes
+            with self._lock:
+                remaining[0] -= 1
+                finished = remaining[0] == 0
+        if finished:
+            callback(results)
+
+    ## @brief Returns the private keys on a drive, using the cached inventory when it is fresh
+    ##
+    ## Keys are identified by their container header only; nothing is decrypted.
+    ## @param device Path to the drive
+    ## @return Tuple (key file paths, key headers)
+    def _scan_drive(self, device: str) -> tuple[tuple[Path, ...], tuple[KeyHeader | None, ...]]:
+        root_mtime = os.stat(device).st_mtime_ns
+        now = time.monotonic()
+        with self._lock:
+            cached = self._cache.get(device)
+        if cached is not None and cached[0] == root_mtime and now - cached[1] < self.rescan_interval:
+            return cached[2], cached[3]
+
+        private_keys = tuple(sorted(search_usb_for_private_key(usb_path=device)))
+        headers = read_headers(private_keys)
+        key_headers = tuple(headers[path] for path in private_keys)
+        logger.debug(f"Scanned USB drive {device}: {len(private_keys)} private key(s)")
+        with self._lock:
+            self._cache[device] = (root_mtime, now, private_keys, key_headers)
+        return private_keys, key_headers
+
+    ## @brief Drops cached inventories of drives that are no longer connected
+    ## @param devices Paths of the connected drives
+    def _forget_missing(self, devices: set[str]) -> None:
+        with self._lock:
+            for device in list(self._cache):
+                if device not in devices:
+                    del self._cache[device]
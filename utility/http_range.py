@@ -0,0 +1,304 @@
+## @file http_range.py
+## @brief Seekable remote files backed by HTTP range requests
+##
+## HttpRangeFile reads a document from an HTTP server in blocks of
+## HTTP_RANGE_BLOCK_SIZE bytes, fetched with Range requests on pooled
+## keep-alive connections and kept in an LRU block cache. Once the reader
+## moves sequentially, the next HTTP_RANGE_PREFETCH_BLOCKS blocks are fetched
+## in parallel ahead of it. Verifying a remote document thus fetches the
+## trailer, the cross-reference data, the objects the verifier looks at and
+## the digested ranges, never more.
+##
+## Run with: python utility/http_range.py URL PUBLIC_KEY
+
+import argparse
+import io
+import logging
+import os
+import queue
+import re
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse import urlsplit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import LOGGER_GLOBAL_NAME, HTTP_RANGE_BLOCK_SIZE, HTTP_RANGE_CACHE_BLOCKS, HTTP_RANGE_PREFETCH_BLOCKS, \
+    HTTP_RANGE_CONNECTIONS, HTTP_RANGE_TIMEOUT
+from utility.crypto_backend import import_key
+from utility.key_container import read_public_key
+from utility.pdf_sign import verify_pdf_stream
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+
+
+## @brief Exception raised when a remote document cannot be read
+class HttpRangeError(OSError):
+    pass
+
+
+## @brief Pool of keep-alive connections to one server
+class ConnectionPool:
+    ## @brief Creates an empty pool
+    ## @param url Any URL on the server
+    ## @param size Maximum number of idle connections kept
+    ## @param timeout Seconds to wait for a response
+    def __init__(self, url: str, size: int = HTTP_RANGE_CONNECTIONS, timeout: float = HTTP_RANGE_TIMEOUT):
+        parts = urlsplit(url)
+        self._connection_class = HTTPSConnection if parts.scheme == "https" else HTTPConnection
+        self._netloc = parts.netloc
+        self._timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=size)
+        ## @brief Number of requests sent
+        self.requests = 0
+        ## @brief Number of body bytes received
+        self.bytes_received = 0
+        self._stats_lock = threading.Lock()
+
+    ## @brief Sends a request, retrying once on a stale keep-alive connection
+    ## @param method HTTP method
+    ## @param path Request path
+    ## @param headers Request headers
+    ## @return Tuple (response, body)
+    def request(self, method: str, path: str, headers: dict) -> tuple:
+        for attempt in range(2):
+            try:
+                connection = self._idle.get_nowait()
+                reused = True
+            except queue.Empty:
+                connection = self._connection_class(self._netloc, timeout=self._timeout)
+                reused = False
+            try:
+                connection.request(method, path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (OSError, HTTPException):
+                connection.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            with self._stats_lock:
+                self.requests += 1
+                self.bytes_received += len(body)
+            if response.will_close:
+                connection.close()
+            else:
+                try:
+                    self._idle.put_nowait(connection)
+                except queue.Full:
+                    connection.close()
+            return response, body
+
+    ## @brief Closes the idle connections
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+## @brief Read-only, seekable file whose content is fetched with HTTP range requests
+class HttpRangeFile(io.RawIOBase):
+    ## @brief Opens a remote file
+    ## @param url URL of the file
+    ## @param pool Optional ConnectionPool shared with other files on the same server
+    ## @param block_size Size of the fetched blocks
+    ## @param cache_blocks Maximum number of blocks kept in memory
+    ## @param prefetch_blocks Number of blocks fetched ahead of sequential reads
+    ## @throws HttpRangeError if the server does not support range requests
+    def __init__(self, url: str, pool: ConnectionPool | None = None, block_size: int = HTTP_RANGE_BLOCK_SIZE,
+                 cache_blocks: int = HTTP_RANGE_CACHE_BLOCKS, prefetch_blocks: int = HTTP_RANGE_PREFETCH_BLOCKS):
+        super().__init__()
+        parts = urlsplit(url)
+        self.url = url
+        self._path = parts.path + (f"?{parts.query}" if parts.query else "")
+        self._own_pool = pool is None
+        self._pool = pool or ConnectionPool(url)
+        self._block_size = block_size
+        self._cache_blocks = max(cache_blocks, prefetch_blocks + 2)
+        self._prefetch_blocks = prefetch_blocks
+        self._cache: OrderedDict[int, bytes] = OrderedDict()
+        self._inflight: dict = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, prefetch_blocks), thread_name_prefix="range-prefetch") \
+            if prefetch_blocks else None
+        self._position = 0
+        self._last_block = None
+        self._run = 0
+        self.size = self._fetch_size()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.size
+        if offset < 0:
+            raise ValueError("Negative seek position")
+        self._position = offset
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def readinto(self, buffer):
+        view = memoryview(buffer).cast("B")
+        written = 0
+        while written < len(view) and self._position < self.size:
+            index, start = divmod(self._position, self._block_size)
+            block = self._get_block(index, len(view) - written)
+            count = min(len(block) - start, len(view) - written)
+            view[written:written + count] = block[start:start + count]
+            written += count
+            self._position += count
+        return written
+
+    def close(self):
+        if not self.closed:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+            if self._own_pool:
+                self._pool.close()
+            self._cache.clear()
+        super().close()
+
+    ## @brief Returns the statistics of the underlying connection pool
+    ## @return Dictionary with the number of requests and received bytes
+    def stats(self) -> dict:
+        return {"requests": self._pool.requests, "bytes_received": self._pool.bytes_received, "size": self.size}
+
+    ## @brief Learns the size of the file
+    ## @return Size in bytes
+    def _fetch_size(self) -> int:
+        response, _ = self._pool.request("HEAD", self._path, {})
+        if response.status in (401, 403, 404, 410):
+            raise HttpRangeError(f"{self.url} cannot be read ({response.status} {response.reason})")
+        if response.status == 200 and response.getheader("Accept-Ranges", "").lower() == "bytes" \
+                and response.getheader("Content-Length"):
+            return int(response.getheader("Content-Length"))
+        # Servers that do not advertise range support may still honour it
+        response, _ = self._pool.request("GET", self._path, {"Range": "bytes=0-0"})
+        match = _CONTENT_RANGE.match(response.getheader("Content-Range") or "")
+        if response.status != 206 or match is None or match.group(3) == "*":
+            raise HttpRangeError(f"{self.url} does not support range requests ({response.status} {response.reason})")
+        return int(match.group(3))
+
+    ## @brief Returns a block, fetching it (and the blocks a read needs after it) if needed
+    ## @param index Block index
+    ## @param wanted Number of bytes the current read still needs
+    ## @return Block content
+    def _get_block(self, index: int, wanted: int) -> bytes:
+        # Reading on through two block boundaries marks a sequential reader; a
+        # parser reading one object across a boundary does not trigger prefetch
+        if self._last_block is not None and index == self._last_block + 1:
+            self._run += 1
+        elif index != self._last_block:
+            self._run = 0
+        self._last_block = index
+        sequential = self._run >= 2
+        with self._lock:
+            block = self._cache.get(index)
+            if block is not None:
+                self._cache.move_to_end(index)
+            future = self._inflight.get(index)
+        if block is None and future is not None:
+            future.result()
+            with self._lock:
+                block = self._cache.get(index)
+        if block is None:
+            # One request for every missing block this read spans
+            last = min(index + max(1, -(-wanted // self._block_size)), self._block_count()) - 1
+            with self._lock:
+                while last > index and (last in self._cache or last in self._inflight):
+                    last -= 1
+            self._fetch(index, last)
+            with self._lock:
+                block = self._cache[index]
+        if sequential and self._executor is not None:
+            self._prefetch(index + 1)
+        return block
+
+    ## @brief Schedules the blocks after a position that are neither cached nor being fetched
+    ## @param first First block index to prefetch
+    def _prefetch(self, first: int) -> None:
+        with self._lock:
+            for index in range(first, min(first + self._prefetch_blocks, self._block_count())):
+                if index not in self._cache and index not in self._inflight:
+                    self._inflight[index] = self._executor.submit(self._fetch, index, index)
+
+    ## @brief Fetches consecutive blocks with one range request
+    ## @param first First block index
+    ## @param last Last block index (inclusive)
+    def _fetch(self, first: int, last: int) -> None:
+        try:
+            start = first * self._block_size
+            end = min((last + 1) * self._block_size, self.size) - 1
+            response, body = self._pool.request("GET", self._path, {"Range": f"bytes={start}-{end}"})
+            if response.status != 206 or len(body) != end - start + 1:
+                raise HttpRangeError(f"Range request for {self.url} failed ({response.status} {response.reason})")
+            with self._lock:
+                for index in range(first, last + 1):
+                    offset = (index - first) * self._block_size
+                    self._cache[index] = body[offset:offset + self._block_size]
+                    self._cache.move_to_end(index)
+                while len(self._cache) > self._cache_blocks:
+                    self._cache.popitem(last=False)
+        finally:
+            with self._lock:
+                for index in range(first, last + 1):
+                    self._inflight.pop(index, None)
+
+    ## @brief Number of blocks in the file
+    def _block_count(self) -> int:
+        return -(-self.size // self._block_size)
+
+
+## @brief Opens a remote file as a buffered, seekable stream
+## @param url URL of the file
+## @param pool Optional ConnectionPool shared with other files on the same server
+## @return io.BufferedReader over an HttpRangeFile
+def open_remote(url: str, pool: ConnectionPool | None = None):
+    return io.BufferedReader(HttpRangeFile(url, pool), buffer_size=io.DEFAULT_BUFFER_SIZE)
+
+
+## @brief Verifies the signature of a PDF on an HTTP server without downloading it
+## @param url URL of the signed PDF
+## @param public_key_filepath Path to the public key file
+## @param trust_store Optional TrustStore, defaults to the one at TRUST_STORE_PATH
+## @param progress Optional callback receiving the percentage of the signed byte range hashed (0-100)
+## @return Tuple (is_valid, message) where is_valid is a boolean indicating if the signature is valid
+def verify_remote_pdf(url: str, public_key_filepath: str, trust_store=None, progress=None) -> tuple[bool, str]:
+    try:
+        public_key = import_key(read_public_key(public_key_filepath))
+        with open_remote(url) as stream:
+            result = verify_pdf_stream(stream, public_key, trust_store, progress)
+            logger.info(f"Verified {url}: {stream.raw.stats()}")
+            return result
+    except ValueError as ve:
+        return False, f"Invalid signature: {str(ve)}"
+    except (OSError, HTTPException) as e:
+        return False, f"Remote document cannot be read: {str(e)}"
+    except Exception as e:
+        return False, f"Verification failed: {str(e)}"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Verify a signed PDF on an HTTP server using range requests")
+    parser.add_argument("url", help="URL of the signed PDF")
+    parser.add_argument("public_key", help="public key of the signer")
+    args = parser.parse_args()
+
+    is_valid, message = verify_remote_pdf(args.url, args.public_key)
+    print(message)
+    sys.exit(0 if is_valid else 1)
@@ -0,0 +1,245 @@
+## @file key_container.py
+## @brief Versioned binary container for private and public keys
+##
+## A container starts with a fixed-size header holding everything needed to
+## identify the key (kind, key type, size, fingerprint, KDF parameters and
+## creation time), followed by the payload: the PEM public key, or the
+## AES-GCM encrypted PEM private key (nonce + tag + ciphertext). The header of
+## a private key is authenticated as associated data of the encryption.
+## Listing keys only reads the first KEY_CONTAINER_HEADER_SIZE bytes of each
+## file, with no PEM parsing and no decryption.
+##
+## Header layout (little endian):
+## magic(8) version(1) kind(1) key_type(1) kdf(1) key_bits(2) kdf_log2_n(1)
+## kdf_r(1) kdf_p(1) reserved(1) kdf_salt(16) fingerprint(32) created(8)
+## payload_length(4), zero padded to KEY_CONTAINER_HEADER_SIZE.
+
+import hashlib
+import os
+import struct
+import time
+from pathlib import Path
+from typing import NamedTuple
+
+from Cryptodome.Cipher import AES
+from Cryptodome.PublicKey import RSA
+
+from constants import KEY_CONTAINER_MAGIC, KEY_CONTAINER_VERSION, KEY_CONTAINER_HEADER_SIZE, KEY_TYPE_RSA, \
+    KEY_TYPE_ECDSA_P256, KEY_TYPE_ED25519, KEY_KDF_SCRYPT_LOG2_N, KEY_KDF_SCRYPT_R, KEY_KDF_SCRYPT_P
+from utility.crypto_backend import import_key, get_key_type
+
+## @brief Container holding an encrypted private key
+KIND_PRIVATE = 1
+## @brief Container holding a public key
+KIND_PUBLIC = 2
+
+## @brief No key derivation (public keys)
+KDF_NONE = 0
+## @brief Single SHA-256 of the PIN (format of keys made before containers existed)
+KDF_SHA256 = 1
+## @brief scrypt of the PIN with the salt and cost parameters from the header
+KDF_SCRYPT = 2
+
+_KEY_TYPE_CODES = {KEY_TYPE_RSA: 1, KEY_TYPE_ECDSA_P256: 2, KEY_TYPE_ED25519: 3}
+_KEY_TYPES_BY_CODE = {code: key_type for key_type, code in _KEY_TYPE_CODES.items()}
+
+_HEADER = struct.Struct("<8sBBBBHBBBx16s32sQI")
+_NONCE_SIZE = 16
+_TAG_SIZE = 16
+
+
+## @brief Exception raised when a key container is malformed or unsupported
+class KeyContainerError(ValueError):
+    pass
+
+
+## @brief Decoded key container header
+class KeyHeader(NamedTuple):
+    ## @brief KIND_PRIVATE or KIND_PUBLIC
+    kind: int
+    ## @brief One of KEY_TYPES (RSA keys of every size are KEY_TYPE_RSA)
+    key_type: str
+    ## @brief Key size in bits
+    key_bits: int
+    ## @brief SHA-256 of the DER encoded public key
+    fingerprint: bytes
+    ## @brief KDF_NONE, KDF_SHA256 or KDF_SCRYPT
+    kdf: int
+    ## @brief log2 of the scrypt cost parameter N
+    kdf_log2_n: int
+    ## @brief scrypt block size parameter
+    kdf_r: int
+    ## @brief scrypt parallelization parameter
+    kdf_p: int
+    ## @brief KDF salt
+    kdf_salt: bytes
+    ## @brief Creation time (seconds since the epoch)
+    created: int
+    ## @brief Length of the payload following the header
+    payload_length: int
+
+    ## @brief Fingerprint as a hex string
+    @property
+    def fingerprint_hex(self) -> str:
+        return self.fingerprint.hex()
+
+    ## @brief Whether the container holds a private key
+    @property
+    def is_private(self) -> bool:
+        return self.kind == KIND_PRIVATE
+
+
+## @brief Computes the fingerprint of a key
+## @param key pycryptodomex private or public key
+## @return SHA-256 of the DER encoded public key
+def key_fingerprint(key) -> bytes:
+    return hashlib.sha256(key.public_key().export_key(format="DER")).digest()
+
+
+## @brief Returns the size of a key in bits
+## @param key pycryptodomex RSA or ECC key
+## @return Modulus size for RSA, curve size for ECC
+def _key_bits(key) -> int:
+    if isinstance(key, RSA.RsaKey):
+        return key.size_in_bits()
+    return key.pointQ.size_in_bits()
+
+
+## @brief Derives the AES key protecting a private key
+## @param pin User PIN
+## @param header Container header with the KDF parameters
+## @return 32-byte key
+def _derive_key(pin: str, header: KeyHeader) -> bytes:
+    if header.kdf == KDF_SHA256:
+        return hashlib.sha256(pin.encode()).digest()
+    if header.kdf == KDF_SCRYPT:
+        n = 1 << header.kdf_log2_n
+        return hashlib.scrypt(pin.encode(), salt=header.kdf_salt, n=n, r=header.kdf_r, p=header.kdf_p,
+                              maxmem=256 * header.kdf_r * n, dklen=32)
+    raise KeyContainerError(f"Unsupported key derivation function: {header.kdf}")
+
+
+## @brief Serializes a header
+## @param header Header to serialize
+## @return KEY_CONTAINER_HEADER_SIZE bytes
+def _pack_header(header: KeyHeader) -> bytes:
+    packed = _HEADER.pack(
+        KEY_CONTAINER_MAGIC, KEY_CONTAINER_VERSION, header.kind, _KEY_TYPE_CODES[header.key_type], header.kdf,
+        header.key_bits, header.kdf_log2_n, header.kdf_r, header.kdf_p, header.kdf_salt, header.fingerprint,
+        header.created, header.payload_length,
+    )
+    return packed.ljust(KEY_CONTAINER_HEADER_SIZE, b"\0")
+
+
+## @brief Decodes a header
+## @param data First bytes of a file (at least KEY_CONTAINER_HEADER_SIZE to succeed)
+## @return KeyHeader, or None if the data does not start with a container header
+## @throws KeyContainerError if the container version or key type is not supported
+def parse_header(data: bytes) -> KeyHeader | None:
+    if len(data) < KEY_CONTAINER_HEADER_SIZE or not data.startswith(KEY_CONTAINER_MAGIC):
+        return None
+    (_, version, kind, key_type_code, kdf, key_bits, kdf_log2_n, kdf_r, kdf_p, kdf_salt, fingerprint,
+     created, payload_length) = _HEADER.unpack_from(data)
+    if version != KEY_CONTAINER_VERSION:
+        raise KeyContainerError(f"Unsupported key container version: {version}")
+    if key_type_code not in _KEY_TYPES_BY_CODE:
+        raise KeyContainerError(f"Unsupported key type code: {key_type_code}")
+    return KeyHeader(kind, _KEY_TYPES_BY_CODE[key_type_code], key_bits, fingerprint, kdf, kdf_log2_n, kdf_r,
+                     kdf_p, kdf_salt, created, payload_length)
+
+
+## @brief Reads the header of a key file without reading the rest of it
+## @param filepath Path to the key file
+## @return KeyHeader, or None for keys stored in the format used before containers
+## @throws KeyContainerError if the container is not supported
+def read_header(filepath) -> KeyHeader | None:
+    with open(filepath, "rb") as f:
+        return parse_header(f.read(KEY_CONTAINER_HEADER_SIZE))
+
+
+## @brief Reads the headers of several key files
+##
+## Files that cannot be read or hold an unsupported container map to None.
+## @param filepaths Paths to the key files
+## @return Dict mapping each path to its KeyHeader or None
+def read_headers(filepaths) -> dict[Path, KeyHeader | None]:
+    headers = {}
+    for filepath in filepaths:
+        try:
+            headers[filepath] = read_header(filepath)
+        except (OSError, KeyContainerError):
+            headers[filepath] = None
+    return headers
+
+
+## @brief Packs an encrypted private key container
+## @param private_key PEM encoded private key
+## @param pin User PIN
+## @return Container bytes
+def pack_private_key(private_key: bytes, pin: str) -> bytes:
+    key = import_key(private_key)
+    header = KeyHeader(
+        kind=KIND_PRIVATE, key_type=get_key_type(key), key_bits=_key_bits(key), fingerprint=key_fingerprint(key),
+        kdf=KDF_SCRYPT, kdf_log2_n=KEY_KDF_SCRYPT_LOG2_N, kdf_r=KEY_KDF_SCRYPT_R, kdf_p=KEY_KDF_SCRYPT_P,
+        kdf_salt=os.urandom(16), created=int(time.time()),
+        payload_length=_NONCE_SIZE + _TAG_SIZE + len(private_key),
+    )
+    header_bytes = _pack_header(header)
+    cipher = AES.new(_derive_key(pin, header), AES.MODE_GCM, nonce=os.urandom(_NONCE_SIZE))
+    cipher.update(header_bytes)
+    ciphertext, tag = cipher.encrypt_and_digest(private_key)
+    return header_bytes + cipher.nonce + tag + ciphertext
+
+
+## @brief Packs a public key container
+## @param public_key PEM encoded public key
+## @return Container bytes
+def pack_public_key(public_key: bytes) -> bytes:
+    key = import_key(public_key)
+    header = KeyHeader(
+        kind=KIND_PUBLIC, key_type=get_key_type(key), key_bits=_key_bits(key), fingerprint=key_fingerprint(key),
+        kdf=KDF_NONE, kdf_log2_n=0, kdf_r=0, kdf_p=0, kdf_salt=bytes(16), created=int(time.time()),
+        payload_length=len(public_key),
+    )
+    return _pack_header(header) + public_key
+
+
+## @brief Decrypts a private key file
+##
+## Files without a container header are read in the format used before
+## containers (nonce + tag + ciphertext, SHA-256 of the PIN as the key).
+## @param data Content of the private key file
+## @param pin User PIN
+## @return PEM encoded private key
+## @throws ValueError if the PIN is wrong or the data was modified
+def unpack_private_key(data: bytes, pin: str) -> bytes:
+    header = parse_header(data)
+    if header is None:
+        header_bytes = b""
+        header = KeyHeader(KIND_PRIVATE, KEY_TYPE_RSA, 0, b"", KDF_SHA256, 0, 0, 0, b"", 0, len(data))
+    else:
+        if not header.is_private:
+            raise KeyContainerError("Key container does not hold a private key")
+        header_bytes, data = data[:KEY_CONTAINER_HEADER_SIZE], data[KEY_CONTAINER_HEADER_SIZE:]
+    nonce = data[:_NONCE_SIZE]
+    tag = data[_NONCE_SIZE:_NONCE_SIZE + _TAG_SIZE]
+    ciphertext = data[_NONCE_SIZE + _TAG_SIZE:header.payload_length]
+
+    cipher = AES.new(_derive_key(pin, header), AES.MODE_GCM, nonce=nonce)
+    cipher.update(header_bytes)
+    return cipher.decrypt_and_verify(ciphertext, tag)
+
+
+## @brief Reads a public key file
+## @param filepath Path to a public key container or a plain PEM public key
+## @return PEM encoded public key
+## @throws KeyContainerError if the container does not hold a public key
+def read_public_key(filepath) -> bytes:
+    with open(filepath, "rb") as f:
+        data = f.read()
+    header = parse_header(data)
+    if header is None:
+        return data
+    if header.is_private:
+        raise KeyContainerError("Key container does not hold a public key")
+    return data[KEY_CONTAINER_HEADER_SIZE:KEY_CONTAINER_HEADER_SIZE + header.payload_length]
@@ -1,39 +1,69 @@
 ## @file keygen.py
-## @brief RSA key generation and encryption functionality
+## @brief Key generation and encryption functionality
 ##
-## Provides functions to generate RSA keypairs and encrypt private keys using AES.
+## Provides functions to generate RSA, ECDSA P-256 and Ed25519 keypairs and
+## encrypt private keys using AES.
 ## Part of the "2nd auxillary application" functionality for the PAdES application.
 
 import logging
 import os
 
-from Cryptodome.Cipher import AES
 from Cryptodome.Hash import SHA256
-from Cryptodome.PublicKey import RSA
-import hashlib
+from Cryptodome.PublicKey import ECC, RSA
 
-from constants import RSA_KEY_LENGTH, KEYS_DIR_PATH
+from constants import RSA_KEY_LENGTH, KEYS_DIR_PATH, KEY_TYPE_RSA, KEY_TYPE_ECDSA_P256, KEY_TYPE_ED25519, \
+    DEFAULT_KEY_TYPE, KEY_TYPE_RSA_8192, RSA_8192_KEY_LENGTH
 from constants import LOGGER_GLOBAL_NAME
+from utility.key_container import pack_private_key
+from utility.parallel_keygen import ParallelKeygen
 
 logger = logging.getLogger(LOGGER_GLOBAL_NAME)
 
 ## @brief Generates an RSA key pair with the specified key length
+##
+## The prime search runs in parallel worker processes (see ParallelKeygen).
+## @param bits RSA modulus size in bits
+## @param progress Optional callback(candidates_tested, primes_found)
+## @param cancel_event Optional threading.Event; setting it cancels generation
 ## @return Tuple containing (private_key, public_key) as bytes
-def generate_rsa_keypair():
-    key = RSA.generate(RSA_KEY_LENGTH)
+## @throws KeygenCancelled if generation was cancelled
+def generate_rsa_keypair(bits=RSA_KEY_LENGTH, progress=None, cancel_event=None):
+    key = ParallelKeygen(bits=bits, progress=progress, cancel_event=cancel_event).generate()
     private_key = key.export_key()
     public_key = key.publickey().export_key()
     return private_key, public_key
 
+## @brief Curve names of the elliptic curve key types
+_ECC_CURVES = {
+    KEY_TYPE_ECDSA_P256: "P-256",
+    KEY_TYPE_ED25519: "Ed25519",
+}
+
+## @brief Generates a key pair of the given type
+## @param key_type One of KEY_TYPES
+## @param progress Optional callback(candidates_tested, primes_found) for RSA keys
+## @param cancel_event Optional threading.Event cancelling RSA key generation
+## @return Tuple containing (private_key, public_key) as PEM bytes
+## @throws ValueError if the key type is not supported
+## @throws KeygenCancelled if generation was cancelled
+def generate_keypair(key_type: str = DEFAULT_KEY_TYPE, progress=None, cancel_event=None):
+    if key_type == KEY_TYPE_RSA:
+        return generate_rsa_keypair(RSA_KEY_LENGTH, progress, cancel_event)
+    if key_type == KEY_TYPE_RSA_8192:
+        return generate_rsa_keypair(RSA_8192_KEY_LENGTH, progress, cancel_event)
+    if key_type not in _ECC_CURVES:
+        raise ValueError(f"Unsupported key type: {key_type}")
+    key = ECC.generate(curve=_ECC_CURVES[key_type])
+    private_key = key.export_key(format="PEM").encode()
+    public_key = key.public_key().export_key(format="PEM").encode()
+    return private_key, public_key
+
 ## @brief Encrypts a private key using AES-GCM with a PIN-derived key
 ## @param private_key The private key bytes to encrypt
 ## @param pin The user's PIN for encryption
-## @return Encrypted private key bytes (nonce + tag + ciphertext)
+## @return Encrypted private key container (see key_container.py)
 def encrypt_private_key(private_key, pin):
-    key = hashlib.sha256(pin.encode()).digest()
-    cipher = AES.new(key, AES.MODE_GCM)
-    ciphertext, tag = cipher.encrypt_and_digest(private_key)
-    return cipher.nonce + tag + ciphertext
+    return pack_private_key(private_key, pin)
 
 
 
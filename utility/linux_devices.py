@@ -0,0 +1,139 @@
+## @file linux_devices.py
+## @brief Removable drive detection on Linux
+##
+## Lists mounted removable drives from sysfs (/sys/block/*/removable) and the
+## mount table (/proc/self/mountinfo). The result is cached and rebuilt only
+## when the kernel reports a mount table change, so polling it costs a single
+## poll() call while nothing is plugged in or out. The sysfs root and the
+## mountinfo path can point to a fake tree for testing.
+
+import logging
+import os
+import re
+import select
+
+from constants import LOGGER_GLOBAL_NAME
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+## @brief Octal escape used by the kernel for spaces and special characters in mountinfo paths
+_MOUNTINFO_ESCAPE = re.compile(r"\\([0-7]{3})")
+
+
+## @brief Decodes an escaped path from mountinfo
+## @param path Path with octal escapes (e.g. "My\040Drive")
+## @return Decoded path
+def _unescape_mount_path(path: str) -> str:
+    return _MOUNTINFO_ESCAPE.sub(lambda match: chr(int(match.group(1), 8)), path)
+
+
+## @brief Reads a small sysfs attribute
+## @param path Path to the attribute file
+## @return Stripped file content, or None if it cannot be read
+def _read_attribute(path: str) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+## @brief Cached list of mounted removable drives
+class LinuxRemovableDevices:
+    ## @brief Opens the mount table for change notifications
+    ## @param sysfs_root Root of the sysfs tree
+    ## @param mountinfo_path Path to the mountinfo file
+    def __init__(self, sysfs_root: str = "/sys", mountinfo_path: str = "/proc/self/mountinfo"):
+        self.sysfs_root = sysfs_root
+        self.mountinfo_path = mountinfo_path
+        self._mountinfo = open(mountinfo_path)
+        self._devices: list[dict] | None = None
+        self._stat_signature = None
+        # The kernel flags mount table changes on procfs files with POLLPRI;
+        # a fake mountinfo (a regular file) is checked by size and mtime instead.
+        self._poll = None
+        if os.path.realpath(mountinfo_path).startswith("/proc/"):
+            self._poll = select.poll()
+            self._poll.register(self._mountinfo, select.POLLPRI | select.POLLERR)
+
+    ## @brief Returns the mounted removable drives
+    ## @return List of dicts with "device" (mount point) and "name" (volume name)
+    def devices(self) -> list[dict]:
+        if self._devices is None or self._mount_table_changed():
+            self._devices = self._scan()
+            logger.debug(f"Removable drives rescanned: {len(self._devices)} mounted")
+        return list(self._devices)
+
+    ## @brief Closes the mount table
+    ## @return None
+    def close(self) -> None:
+        self._mountinfo.close()
+
+    ## @brief Checks whether the mount table changed since it was last read
+    ## @return True if it changed
+    def _mount_table_changed(self) -> bool:
+        if self._poll is not None:
+            return bool(self._poll.poll(0))
+        stat = os.stat(self.mountinfo_path)
+        return (stat.st_mtime_ns, stat.st_size) != self._stat_signature
+
+    ## @brief Rebuilds the list of mounted removable drives
+    ## @return List of dicts with "device" and "name"
+    def _scan(self) -> list[dict]:
+        removable = self._removable_device_numbers()
+        devices = []
+        seen = set()
+        for device_number, mount_point in self._read_mounts():
+            if device_number in removable and device_number not in seen:
+                seen.add(device_number)
+                devices.append({
+                    "device": mount_point,
+                    "name": os.path.basename(mount_point.rstrip("/")) or mount_point,
+                })
+        return devices
+
+    ## @brief Reads the mount table, re-arming the change notification
+    ## @return List of tuples ("major:minor", mount point)
+    def _read_mounts(self) -> list[tuple[str, str]]:
+        if self._poll is None:
+            stat = os.stat(self.mountinfo_path)
+            self._stat_signature = (stat.st_mtime_ns, stat.st_size)
+        self._mountinfo.seek(0)
+        mounts = []
+        for line in self._mountinfo.read().splitlines():
+            # mount-id parent-id major:minor root mount-point options ... - fstype source super-options
+            fields = line.split()
+            if len(fields) >= 5:
+                mounts.append((fields[2], _unescape_mount_path(fields[4])))
+        return mounts
+
+    ## @brief Collects the device numbers of removable disks and their partitions
+    ##
+    ## A disk counts as removable if its removable flag is set or it sits on a
+    ## USB bus (USB hard drives usually report removable = 0).
+    ## @return Set of "major:minor" strings
+    def _removable_device_numbers(self) -> set[str]:
+        block_dir = os.path.join(self.sysfs_root, "block")
+        numbers = set()
+        try:
+            disks = os.listdir(block_dir)
+        except OSError:
+            return numbers
+        for disk in disks:
+            disk_path = os.path.join(block_dir, disk)
+            on_usb = "/usb" in os.path.realpath(disk_path)
+            if _read_attribute(os.path.join(disk_path, "removable")) != "1" and not on_usb:
+                continue
+            disk_number = _read_attribute(os.path.join(disk_path, "dev"))
+            if disk_number:
+                numbers.add(disk_number)
+            try:
+                entries = os.listdir(disk_path)
+            except OSError:
+                continue
+            for entry in entries:
+                partition_number = _read_attribute(os.path.join(disk_path, entry, "partition")) \
+                    and _read_attribute(os.path.join(disk_path, entry, "dev"))
+                if partition_number:
+                    numbers.add(partition_number)
+        return numbers
@@ -0,0 +1,166 @@
+## @file local_document_store.py
+## @brief Local document store stand-in
+##
+## Serves the files of a directory over HTTP/1.1 with keep-alive connections
+## and single-range requests (206 Partial Content), the way the object stores
+## and web servers holding remote documents do. Counts the requests and bytes
+## served, so the reads of remote verification can be checked. Meant for
+## testing and development.
+##
+## Run with: python utility/local_document_store.py DIRECTORY [--port PORT]
+
+import argparse
+import logging
+import os
+import re
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlsplit
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import LOGGER_GLOBAL_NAME, LOCAL_DOCUMENT_STORE_PORT
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+_RANGE = re.compile(r"bytes=(\d*)-(\d*)$")
+
+
+## @brief HTTP handler serving files with range support
+class _DocumentRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_HEAD(self):
+        self._serve(send_body=False)
+
+    def do_GET(self):
+        self._serve(send_body=True)
+
+    ## @brief Answers a HEAD or GET request
+    ## @param send_body False for HEAD
+    def _serve(self, send_body: bool):
+        filepath = self.server.store.resolve(urlsplit(self.path).path)
+        if filepath is None:
+            self.send_error(404, "Document not found")
+            return
+        size = os.path.getsize(filepath)
+        start, end, status = 0, size - 1, 200
+        requested = self.headers.get("Range")
+        if requested is not None:
+            match = _RANGE.match(requested.strip())
+            if match is None or match.groups() == ("", ""):
+                self.send_error(416, "Only single byte ranges are supported")
+                return
+            first, last = match.groups()
+            if first:
+                start, end = int(first), min(int(last), size - 1) if last else size - 1
+            else:
+                start = max(size - int(last), 0)
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+        length = end - start + 1
+        self.send_response(status)
+        self.send_header("Content-Type", "application/pdf")
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(length))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+        if send_body:
+            with open(filepath, "rb") as f:
+                f.seek(start)
+                self.wfile.write(f.read(length))
+        self.server.store.record(length if send_body else 0)
+
+    ## @brief Routes request logging to the application logger
+    def log_message(self, format, *args):
+        logger.debug(f"Local document store: {format % args}")
+
+
+## @brief Local document store serving one directory
+class LocalDocumentStore:
+    ## @brief Creates the store (not yet serving)
+    ## @param directory Directory whose files are served
+    ## @param host Interface to listen on
+    ## @param port Port to listen on, 0 picks a free port
+    def __init__(self, directory: str, host: str = "127.0.0.1", port: int = LOCAL_DOCUMENT_STORE_PORT):
+        self.directory = os.path.abspath(directory)
+        ## @brief Number of requests answered
+        self.requests = 0
+        ## @brief Number of body bytes sent
+        self.bytes_sent = 0
+        self._stats_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _DocumentRequestHandler)
+        self._server.daemon_threads = True
+        self._server.store = self
+        self._thread = None
+
+    ## @brief Returns the URL of a file of the store
+    ## @param name File name relative to the served directory
+    ## @return URL
+    def url(self, name: str) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/{quote(name.replace(os.sep, '/'))}"
+
+    ## @brief Maps a request path to a served file
+    ## @param path URL path
+    ## @return Path to the file, or None if it is not a file of the served directory
+    def resolve(self, path: str) -> str | None:
+        filepath = os.path.abspath(os.path.join(self.directory, unquote(path).lstrip("/")))
+        if os.path.commonpath([filepath, self.directory]) != self.directory or not os.path.isfile(filepath):
+            return None
+        return filepath
+
+    ## @brief Counts an answered request
+    ## @param sent Number of body bytes sent
+    def record(self, sent: int) -> None:
+        with self._stats_lock:
+            self.requests += 1
+            self.bytes_sent += sent
+
+    ## @brief Resets the request and byte counters
+    ## @return None
+    def reset_stats(self) -> None:
+        with self._stats_lock:
+            self.requests = 0
+            self.bytes_sent = 0
+
+    ## @brief Serves requests on a background thread
+    ## @return None
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._server.serve_forever, name="local-document-store", daemon=True)
+        self._thread.start()
+
+    ## @brief Serves requests on the calling thread until interrupted
+    ## @return None
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    ## @brief Stops serving
+    ## @return None
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local document store with HTTP range requests for testing")
+    parser.add_argument("directory", help="directory whose files are served")
+    parser.add_argument("--host", default="127.0.0.1", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=LOCAL_DOCUMENT_STORE_PORT, help="port to listen on")
+    args = parser.parse_args()
+
+    store = LocalDocumentStore(args.directory, host=args.host, port=args.port)
+    print(f"Local document store serving {store.directory} on {store.url('')}")
+    try:
+        store.serve_forever()
+    except KeyboardInterrupt:
+        pass
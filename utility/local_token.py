@@ -0,0 +1,172 @@
+## @file local_token.py
+## @brief Local PKCS#11 token stand-in built on SoftHSM v2
+##
+## Creates a SoftHSM token in a directory of its own, generates a signing key
+## on it (sensitive and not extractable, like keys on a smart card) and writes
+## the key's public key for verification. With --check, signs random digests
+## on several threads through TokenSigner and verifies every signature, so the
+## token backend can be exercised without hardware. Meant for testing and
+## development; needs softhsm2-util and python-pkcs11.
+##
+## Run with: python utility/local_token.py DIRECTORY [--label LABEL] [--pin PIN] [--key-type TYPE] [--check N]
+## and sign with the printed PKCS11_MODULE_ENV and SOFTHSM2_CONF settings.
+
+import argparse
+import hashlib
+import logging
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Cryptodome.PublicKey import RSA
+
+from constants import LOGGER_GLOBAL_NAME, KEY_TYPE_RSA, KEY_TYPE_ECDSA_P256, KEY_TYPE_ED25519, SOFTHSM_MODULE_PATHS, \
+    PKCS11_MODULE_ENV, PKCS11_TOKEN_ENV, PKCS11_KEY_ENV
+from utility.crypto_backend import verify_digest
+from utility.pkcs11_token import TokenError, TokenSigner, load_pkcs11_library, EC_PARAMS_P256, EC_PARAMS_ED25519
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+## @brief Environment variable SoftHSM reads its configuration file from
+SOFTHSM_CONF_ENV = "SOFTHSM2_CONF"
+
+
+## @brief Finds the SoftHSM PKCS#11 module
+## @return Path to the module, or None if SoftHSM is not installed in a usual location
+def find_softhsm_module() -> str | None:
+    for module_path in SOFTHSM_MODULE_PATHS:
+        if os.path.isfile(module_path):
+            return module_path
+    return None
+
+
+## @brief Creates a SoftHSM token holding one signing key
+##
+## Sets SOFTHSM_CONF_ENV for this process, so it has to run before the module
+## is loaded by anything else.
+## @param directory Directory holding the token's configuration and objects
+## @param label Label of the token
+## @param pin User PIN
+## @param so_pin Security officer PIN
+## @param key_type One of KEY_TYPE_RSA, KEY_TYPE_ECDSA_P256, KEY_TYPE_ED25519
+## @param key_label Label of the key
+## @param module_path Path to the SoftHSM module, defaults to find_softhsm_module()
+## @return Path to the SoftHSM module
+## @throws TokenError if SoftHSM is not installed or the token cannot be created
+def create_token(directory: str, label: str, pin: str, so_pin: str, key_type: str, key_label: str,
+                 module_path: str | None = None) -> str:
+    module_path = module_path or find_softhsm_module()
+    if module_path is None:
+        raise TokenError("SoftHSM v2 module not found (install softhsm2)")
+    token_dir = os.path.join(os.path.abspath(directory), "tokens")
+    os.makedirs(token_dir, exist_ok=True)
+    conf_path = os.path.join(os.path.abspath(directory), "softhsm2.conf")
+    with open(conf_path, "w", encoding="utf-8") as f:
+        f.write(f"directories.tokendir = {token_dir}\nobjectstore.backend = file\nlog.level = ERROR\n")
+    os.environ[SOFTHSM_CONF_ENV] = conf_path
+    try:
+        subprocess.run(["softhsm2-util", "--init-token", "--free", "--label", label, "--pin", pin,
+                        "--so-pin", so_pin], check=True, capture_output=True, text=True)
+    except FileNotFoundError:
+        raise TokenError("softhsm2-util not found (install softhsm2)")
+    except subprocess.CalledProcessError as e:
+        raise TokenError(f"Token cannot be created: {e.stderr.strip() or e}")
+
+    # Loaded after the token exists: SoftHSM reads its tokens when the module is initialized
+    add_key(module_path, label, pin, key_type, key_label)
+    logger.info(f"SoftHSM token {label} created in {directory} with a {key_type} key {key_label}")
+    return module_path
+
+
+## @brief Generates another signing key on a token
+##
+## Must not run while a TokenSigner is logged in to the token: the login
+## belongs to the whole process.
+## @param module_path Path to the PKCS#11 module
+## @param label Label of the token
+## @param pin User PIN
+## @param key_type One of KEY_TYPE_RSA, KEY_TYPE_ECDSA_P256, KEY_TYPE_ED25519
+## @param key_label Label of the key
+## @throws TokenError if python-pkcs11 is not installed or the module cannot be loaded
+def add_key(module_path: str, label: str, pin: str, key_type: str, key_label: str) -> None:
+    library = load_pkcs11_library(module_path)
+    from pkcs11 import Attribute, KeyType
+
+    token = library.get_token(token_label=label)
+    private_template = {Attribute.SENSITIVE: True, Attribute.EXTRACTABLE: False}
+    with token.open(rw=True, user_pin=pin) as session:
+        if key_type == KEY_TYPE_RSA:
+            session.generate_keypair(KeyType.RSA, 2048, label=key_label, store=True,
+                                     private_template=private_template)
+        else:
+            curve = KeyType.EC if key_type == KEY_TYPE_ECDSA_P256 else KeyType.EC_EDWARDS
+            params = EC_PARAMS_P256 if key_type == KEY_TYPE_ECDSA_P256 else EC_PARAMS_ED25519[0]
+            session.create_domain_parameters(curve, {Attribute.EC_PARAMS: params}, local=True) \
+                .generate_keypair(label=key_label, store=True, private_template=private_template)
+
+
+## @brief Exports the public key of a token signer
+## @param signer TokenSigner
+## @return PEM bytes
+def export_public_key(signer: TokenSigner) -> bytes:
+    public_key = signer.public_key()
+    if isinstance(public_key, RSA.RsaKey):
+        return public_key.export_key()
+    return public_key.export_key(format="PEM").encode()
+
+
+## @brief Signs random digests concurrently and verifies every signature
+## @param signer TokenSigner
+## @param count Number of signatures
+## @param threads Number of signing threads
+## @return Signatures per second
+## @throws ValueError if a signature does not verify
+def check_signer(signer: TokenSigner, count: int, threads: int) -> float:
+    public_key = signer.public_key()
+
+    def sign_and_verify(index):
+        digest = hashlib.sha256(index.to_bytes(8, "big") + os.urandom(16)).digest()
+        verify_digest(public_key, digest, signer.sign(digest))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(sign_and_verify, range(count)))
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="SoftHSM token with a signing key for testing")
+    parser.add_argument("directory", help="directory holding the token")
+    parser.add_argument("--label", default="pades-test", help="token label")
+    parser.add_argument("--pin", default="123456", help="user PIN")
+    parser.add_argument("--so-pin", default="12345678", help="security officer PIN")
+    parser.add_argument("--key-type", choices=(KEY_TYPE_RSA, KEY_TYPE_ECDSA_P256, KEY_TYPE_ED25519),
+                        default=KEY_TYPE_RSA, help="type of the generated key")
+    parser.add_argument("--key-label", default="signing-key", help="label of the generated key")
+    parser.add_argument("--public-key", help="file the public key is written to (default: DIRECTORY/public.pem)")
+    parser.add_argument("--check", type=int, metavar="N", help="sign and verify N digests after creating the token")
+    parser.add_argument("--threads", type=int, default=4, help="signing threads of --check")
+    args = parser.parse_args()
+
+    try:
+        module = create_token(args.directory, args.label, args.pin, args.so_pin, args.key_type, args.key_label)
+        token_signer = TokenSigner(args.label, args.pin, args.key_label, module)
+        public_key_filepath = args.public_key or os.path.join(args.directory, "public.pem")
+        with open(public_key_filepath, "wb") as public_key_file:
+            public_key_file.write(export_public_key(token_signer))
+        if args.check:
+            rate = check_signer(token_signer, args.check, args.threads)
+            print(f"{args.check} signatures verified ({rate:.1f}/s on {args.threads} threads)")
+        token_signer.close()
+    except (TokenError, ValueError) as error:
+        print(f"Error: {error}", file=sys.stderr)
+        sys.exit(1)
+    print(f"Public key written to {public_key_filepath}")
+    print(f"{SOFTHSM_CONF_ENV}={os.environ[SOFTHSM_CONF_ENV]}")
+    print(f"{PKCS11_MODULE_ENV}={module}")
+    print(f"{PKCS11_TOKEN_ENV}={args.label}")
+    print(f"{PKCS11_KEY_ENV}={args.key_label}")
@@ -0,0 +1,142 @@
+## @file local_tsa.py
+## @brief Local timestamp authority stand-in
+##
+## Serves batch timestamp requests (see timestamp.py) over HTTP/1.1 with
+## keep-alive connections, signing every token with an Ed25519 key. Meant
+## for testing and development, not as a trusted time source.
+##
+## Run with: python utility/local_tsa.py [--port PORT] [--public-key FILE]
+
+import argparse
+import base64
+import hashlib
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Cryptodome.PublicKey import ECC
+
+from constants import LOGGER_GLOBAL_NAME, LOCAL_TSA_PORT
+from utility.crypto_backend import sign_digest
+from utility.timestamp import canonical_tst_info, CONTENT_TYPE
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+## @brief Policy identifier written into tokens of the stand-in
+LOCAL_TSA_POLICY = "local-test-policy"
+
+
+## @brief HTTP handler answering batch timestamp requests
+class _TimestampRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    ## @brief Handles one batch
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            requests = json.loads(self.rfile.read(length))["requests"]
+            tokens = [self.server.tsa.issue(request) for request in requests]
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_error(400, f"Malformed timestamp request: {e}")
+            return
+        body = json.dumps({"tokens": tokens}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    ## @brief Routes request logging to the application logger
+    def log_message(self, format, *args):
+        logger.debug(f"Local TSA: {format % args}")
+
+
+## @brief Local timestamp authority
+class LocalTSA:
+    ## @brief Creates the authority (not yet serving)
+    ## @param host Interface to listen on
+    ## @param port Port to listen on, 0 picks a free port
+    ## @param private_key Ed25519 signing key, generated if not given
+    def __init__(self, host: str = "127.0.0.1", port: int = LOCAL_TSA_PORT, private_key=None):
+        self.private_key = private_key or ECC.generate(curve="Ed25519")
+        self._serials = itertools.count(1)
+        self._serial_lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _TimestampRequestHandler)
+        self._server.daemon_threads = True
+        self._server.tsa = self
+        self._thread = None
+
+    ## @brief URL of the authority
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/timestamp"
+
+    ## @brief Returns the public key of the authority
+    ## @return PEM encoded public key
+    def public_key_pem(self) -> bytes:
+        return self.private_key.public_key().export_key(format="PEM").encode()
+
+    ## @brief Issues a token for one request
+    ## @param request Request dictionary (message_imprint, hash_algorithm, nonce)
+    ## @return Token dictionary
+    def issue(self, request: dict) -> dict:
+        if request["hash_algorithm"] != "sha256" or len(bytes.fromhex(request["message_imprint"])) != 32:
+            raise ValueError("Only SHA-256 message imprints are supported")
+        with self._serial_lock:
+            serial = next(self._serials)
+        tst_info = {
+            "version": 1,
+            "policy": LOCAL_TSA_POLICY,
+            "hash_algorithm": "sha256",
+            "message_imprint": request["message_imprint"],
+            "serial": serial,
+            "gen_time": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "nonce": request["nonce"],
+        }
+        signature = sign_digest(self.private_key, hashlib.sha256(canonical_tst_info(tst_info)).digest())
+        return {"tst_info": tst_info, "signature": base64.b64encode(signature).decode(), "algorithm": "Ed25519"}
+
+    ## @brief Serves requests on a background thread
+    ## @return None
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._server.serve_forever, name="local-tsa", daemon=True)
+        self._thread.start()
+
+    ## @brief Serves requests on the calling thread until interrupted
+    ## @return None
+    def serve_forever(self) -> None:
+        self._server.serve_forever()
+
+    ## @brief Stops serving
+    ## @return None
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Local timestamp authority for testing")
+    parser.add_argument("--host", default="127.0.0.1", help="interface to listen on")
+    parser.add_argument("--port", type=int, default=LOCAL_TSA_PORT, help="port to listen on")
+    parser.add_argument("--public-key", help="file the authority's public key is written to")
+    args = parser.parse_args()
+
+    tsa = LocalTSA(host=args.host, port=args.port)
+    if args.public_key:
+        with open(args.public_key, "wb") as f:
+            f.write(tsa.public_key_pem())
+    print(f"Local TSA listening on {tsa.url}")
+    try:
+        tsa.serve_forever()
+    except KeyboardInterrupt:
+        pass
@@ -6,10 +6,18 @@
 from PyQt6.QtWidgets import QGraphicsOpacityEffect, QWidget
 
 ## @brief Changes the opacity of a widget
+##
+## Reuses the widget's opacity effect if it already has one and does nothing
+## if the opacity is unchanged, so repeated calls cause no repaint.
 ## @param widget The Qt widget to modify
 ## @param value Opacity value between 0.0 (fully transparent) and 1.0 (fully opaque)
 ## @return None
 def change_opacity(widget: QWidget, value: float):
+    op = widget.graphicsEffect()
+    if isinstance(op, QGraphicsOpacityEffect):
+        if op.opacity() != value:
+            op.setOpacity(value)
+        return
     op = QGraphicsOpacityEffect(widget)
     op.setOpacity(value)
     widget.setGraphicsEffect(op)
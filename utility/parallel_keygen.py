@@ -0,0 +1,119 @@
+## @file parallel_keygen.py
+## @brief Parallel RSA key generation
+##
+## The prime search behind RSA key generation has a long and unpredictable
+## tail. This engine tests random candidates for p and q in several worker
+## processes at once, reports progress and can be cancelled between batches.
+## The resulting primes satisfy the same constraints as pycryptodomex's
+## RSA.generate() (FIPS 186-4 size bound, gcd(p-1, e) = 1, |p-q| bound).
+
+import logging
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from Cryptodome.Math.Numbers import Integer
+from Cryptodome.Math.Primality import test_probable_prime, PROBABLY_PRIME
+from Cryptodome.PublicKey import RSA
+
+from constants import LOGGER_GLOBAL_NAME, RSA_KEY_LENGTH, RSA_PUBLIC_EXPONENT, KEYGEN_CANDIDATES_PER_TASK
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+## @brief Seconds between cancellation checks while waiting for workers
+_CANCEL_POLL_INTERVAL = 0.2
+
+
+## @brief Exception raised when key generation is cancelled
+class KeygenCancelled(Exception):
+    pass
+
+
+## @brief Tests random candidates until a suitable prime is found or the batch is used up
+##
+## Runs in a worker process. Candidates come from the operating system RNG,
+## so forked workers never share random state.
+## @param bits Exact bit size of the prime
+## @param e Public exponent
+## @param candidates Number of candidates to test
+## @return Tuple (prime or None, number of candidates tested)
+def _search_prime(bits: int, e: int, candidates: int) -> tuple[int | None, int]:
+    min_value = (Integer(1) << (2 * bits - 1)).sqrt()
+    for tested in range(1, candidates + 1):
+        candidate = Integer.random(exact_bits=bits)
+        if candidate.is_even():
+            candidate += 1
+        if candidate <= min_value or candidate.size_in_bits() != bits:
+            continue
+        if (candidate - 1).gcd(e) != 1:
+            continue
+        if test_probable_prime(candidate) == PROBABLY_PRIME:
+            return int(candidate), tested
+    return None, candidates
+
+
+## @brief Generates RSA keys with a pool of prime-searching processes
+class ParallelKeygen:
+    ## @brief Configures the engine
+    ## @param bits RSA modulus size in bits (4096 or 8192)
+    ## @param workers Number of worker processes, defaults to the CPU count
+    ## @param progress Optional callback(candidates_tested, primes_found)
+    ## @param cancel_event Optional threading.Event; setting it cancels generation
+    def __init__(self, bits: int = RSA_KEY_LENGTH, workers: int | None = None, progress=None,
+                 cancel_event: threading.Event | None = None):
+        self.bits = bits
+        self.workers = workers or os.cpu_count() or 1
+        self.progress = progress
+        self.cancel_event = cancel_event or threading.Event()
+
+    ## @brief Generates a key
+    ## @return pycryptodomex RSA private key
+    ## @throws KeygenCancelled if the cancel event was set
+    def generate(self) -> RSA.RsaKey:
+        e = RSA_PUBLIC_EXPONENT
+        size_q = self.bits // 2
+        size_p = self.bits - size_q
+        min_distance = 1 << (self.bits // 2 - 100)
+
+        context = multiprocessing.get_context("fork" if os.name != "nt" else "spawn")
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        tested = 0
+        p = q = None
+        try:
+            pending = {executor.submit(_search_prime, size_p, e, KEYGEN_CANDIDATES_PER_TASK)
+                       for _ in range(self.workers)}
+            while q is None:
+                done, pending = wait(pending, timeout=_CANCEL_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+                if self.cancel_event.is_set():
+                    raise KeygenCancelled("Key generation cancelled")
+                for future in done:
+                    prime, count = future.result()
+                    tested += count
+                    if prime is not None:
+                        if p is None:
+                            p = prime
+                        elif q is None and abs(prime - p) > min_distance and self._private_exponent(p, prime):
+                            q = prime
+                    if q is None:
+                        pending.add(executor.submit(_search_prime, size_q if p else size_p, e,
+                                                    KEYGEN_CANDIDATES_PER_TASK))
+                if done and self.progress is not None:
+                    self.progress(tested, (p is not None) + (q is not None))
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        logger.info(f"RSA-{self.bits} primes found after {tested} candidates on {self.workers} workers")
+        n = p * q
+        d = self._private_exponent(p, q)
+        return RSA.construct((n, e, d, min(p, q), max(p, q)))
+
+    ## @brief Computes the private exponent, rejecting ones that are too small
+    ## @param p First prime
+    ## @param q Second prime
+    ## @return Private exponent, or None if it is shorter than half the modulus
+    def _private_exponent(self, p: int, q: int) -> int | None:
+        lcm = (p - 1) * (q - 1) // math.gcd(p - 1, q - 1)
+        d = pow(RSA_PUBLIC_EXPONENT, -1, lcm)
+        return d if d.bit_length() > self.bits // 2 else None
@@ -0,0 +1,301 @@
+## @file parse_index.py
+## @brief Parse index cache letting repeated verifications skip parsing
+##
+## Verifying a document parses it with PyPDF2, walks its pages and hashes the
+## digested parts. Everything the verifier concludes depends only on the
+## bytes it read, so a successful verification can be recorded as:
+##  - the byte ranges the verifier read (xref sections, trailer, signature
+##    dictionary, page objects, digested ranges), merged, and their SHA-256
+##  - the document digest and the signature entries found in those bytes
+##
+## A later verification of the same file (same size, modification time and
+## header) only rereads and hashes those ranges. If they are unchanged, the
+## parse and the digest would give the same result, so only the signature,
+## timestamp and trust store checks are made again. Any other outcome falls
+## back to a full verification, which refreshes the entry.
+##
+## Entries are JSON files in PARSE_INDEX_DIR_PATH named after the file path.
+## Each entry carries an HMAC-SHA256 under a random key created with the
+## index (PARSE_INDEX_KEY_FILENAME, readable by its owner only), so entries
+## copied from another document or written by hand are ignored. An entry
+## must also hash at least one range, and for the "full" profile its ranges
+## must cover the whole signed range.
+## The index is used when PARSE_INDEX_ENV is set to a non-empty value other
+## than "0", or when a ParseIndex is passed to verify_pdf_signature.
+
+import hashlib
+import hmac
+import json
+import logging
+import os
+import secrets
+import tempfile
+import threading
+
+from constants import LOGGER_GLOBAL_NAME, PARSE_INDEX_ENV, PARSE_INDEX_DIR_PATH, PARSE_INDEX_HEAD_SIZE, \
+    PARSE_INDEX_RANGE_GAP, PARSE_INDEX_KEY_FILENAME, DIGEST_PROFILE_FULL
+from utility.atomic_writer import atomic_write
+from utility.read_ahead import read_ahead
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+## @brief Format version of the index entries
+_ENTRY_VERSION = 2
+
+## @brief Length of the entry authentication key in bytes
+_KEY_SIZE = 32
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+## @brief Seekable stream wrapper recording the byte ranges read through it
+class RecordingStream:
+    ## @brief Wraps a stream
+    ## @param stream Seekable binary stream
+    ## @param gap Ranges closer than this many bytes are merged
+    def __init__(self, stream, gap: int = PARSE_INDEX_RANGE_GAP):
+        self._stream = stream
+        self._gap = gap
+        # PyPDF2 reads byte by byte, so the position is tracked here rather than asked for
+        self._position = stream.tell()
+        self._ranges = []
+        self._start = self._end = None
+
+    def read(self, size=-1):
+        data = self._stream.read(size)
+        start = self._position
+        end = self._position = start + len(data)
+        if end != start:
+            if self._start is not None and self._start <= start <= self._end + self._gap:
+                if end > self._end:
+                    self._end = end
+            else:
+                self._flush()
+                self._start, self._end = start, end
+        return data
+
+    def readinto(self, buffer):
+        start = self._position
+        count = self._stream.readinto(buffer) or 0
+        self._position = start + count
+        if count:
+            self._flush()
+            self._ranges.append([start, start + count])
+        return count
+
+    def seek(self, offset, whence=0):
+        self._position = self._stream.seek(offset, whence)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    ## @brief Returns the ranges read so far
+    ## @return Sorted list of disjoint [start, end) ranges
+    def ranges(self) -> list[list[int]]:
+        self._flush()
+        merged = []
+        for start, end in sorted(self._ranges):
+            if merged and start <= merged[-1][1] + self._gap:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        return merged
+
+    ## @brief Moves the range being extended by sequential reads to the list
+    def _flush(self) -> None:
+        if self._start is not None:
+            self._ranges.append([self._start, self._end])
+            self._start = self._end = None
+
+
+## @brief Hashes byte ranges of a stream
+## @param stream Seekable binary stream
+## @param ranges List of [start, end) ranges
+## @param progress Optional callback receiving the hashed percentage (0-100)
+## @return Hex SHA-256 of the ranges' bytes, or None if the stream ends before a range does
+def hash_ranges(stream, ranges: list[list[int]], progress=None) -> str | None:
+    hash_obj = hashlib.sha256()
+    total = sum(end - start for start, end in ranges) or 1
+    done = 0
+    for start, end in ranges:
+        stream.seek(start)
+        if progress is None:
+            count = read_ahead(stream, end - start, hash_obj.update)
+        else:
+            def report(percent, base=done, length=end - start):
+                progress((base + length * percent // 100) * 100 // total)
+
+            count = read_ahead(stream, end - start, hash_obj.update, report)
+        if count != end - start:
+            return None
+        done += count
+    return hash_obj.hexdigest()
+
+
+## @brief Directory of parse index entries
+class ParseIndex:
+    ## @brief Opens the index (the directory is created on the first store)
+    ## @param directory Directory holding the entries
+    def __init__(self, directory: str = PARSE_INDEX_DIR_PATH):
+        self.directory = directory
+        self._key = None
+        self._key_lock = threading.Lock()
+
+    ## @brief Returns the entry of a file if it still describes the file's content
+    ## @param pdf_filepath Path to the PDF file
+    ## @param stream Stream of the open file
+    ## @param progress Optional callback receiving the percentage of the indexed ranges hashed (0-100)
+    ## @return Entry dictionary, or None if there is no valid entry
+    def lookup(self, pdf_filepath: str, stream, progress=None) -> dict | None:
+        try:
+            with open(self._entry_path(pdf_filepath), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Parse index entry of {pdf_filepath} cannot be read: {e}")
+            return None
+        try:
+            if entry.get("version") != _ENTRY_VERSION:
+                return None
+            auth_key = self._auth_key(create=False)
+            if auth_key is None or not hmac.compare_digest(entry.pop("mac", ""), self._mac(auth_key, entry)):
+                logger.warning(f"Parse index entry of {pdf_filepath} is not authentic")
+                return None
+            if not self._covers_signed_range(entry) or entry["key"] != self._file_key(stream):
+                return None
+            if hash_ranges(stream, entry["ranges"], progress) != entry["ranges_sha256"]:
+                logger.info(f"Parse index entry of {pdf_filepath} is stale")
+                return None
+        except (AttributeError, KeyError, TypeError, ValueError) as e:
+            logger.warning(f"Parse index entry of {pdf_filepath} is malformed: {e}")
+            return None
+        except OSError as e:
+            logger.warning(f"Parse index entry of {pdf_filepath} cannot be checked: {e}")
+            return None
+        return entry
+
+    ## @brief Records a successful verification
+    ## @param pdf_filepath Path to the PDF file
+    ## @param stream Stream of the open file
+    ## @param ranges Byte ranges the verifier read (see RecordingStream.ranges)
+    ## @param details Dictionary filled by verify_pdf_stream (digest, signature, algorithm, profile, signed_length, timestamp)
+    ## @return None
+    def store(self, pdf_filepath: str, stream, ranges: list[list[int]], details: dict) -> None:
+        entry = {
+            "version": _ENTRY_VERSION,
+            "path": os.path.abspath(pdf_filepath),
+            "key": self._file_key(stream),
+            "ranges": ranges,
+            "ranges_sha256": hash_ranges(stream, ranges),
+            **details,
+        }
+        if not self._covers_signed_range(entry):
+            return
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            entry["mac"] = self._mac(self._auth_key(create=True), entry)
+            with atomic_write(self._entry_path(pdf_filepath)) as f:
+                f.write(json.dumps(entry).encode())
+        except OSError as e:
+            logger.warning(f"Parse index entry of {pdf_filepath} cannot be written: {e}")
+
+    ## @brief Removes the entry of a file
+    ## @param pdf_filepath Path to the PDF file
+    ## @return None
+    def discard(self, pdf_filepath: str) -> None:
+        try:
+            os.remove(self._entry_path(pdf_filepath))
+        except FileNotFoundError:
+            pass
+
+    ## @brief Returns the key entries are authenticated with
+    ## @param create Whether to create the key if the index has none yet
+    ## @return Key bytes, or None if there is no key and @p create is False
+    ## @throws OSError if the key cannot be read or created
+    def _auth_key(self, create: bool) -> bytes | None:
+        with self._key_lock:
+            if self._key is None:
+                key_path = os.path.join(self.directory, PARSE_INDEX_KEY_FILENAME)
+                if create and not os.path.exists(key_path):
+                    # Written under a temporary name (mode 0600) and linked into place,
+                    # so concurrent processes agree on one complete key
+                    fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix=".key.", suffix=".tmp")
+                    try:
+                        with os.fdopen(fd, "wb") as f:
+                            f.write(secrets.token_bytes(_KEY_SIZE))
+                        os.link(tmp_path, key_path)
+                    except FileExistsError:
+                        pass
+                    finally:
+                        os.unlink(tmp_path)
+                try:
+                    with open(key_path, "rb") as f:
+                        key = f.read()
+                except FileNotFoundError:
+                    return None
+                if len(key) != _KEY_SIZE:
+                    raise OSError(f"Parse index key {key_path} is damaged")
+                self._key = key
+            return self._key
+
+    ## @brief Computes the authentication code of an entry
+    ## @param auth_key Key returned by _auth_key
+    ## @param entry Entry dictionary without its "mac" item
+    ## @return Hex HMAC-SHA256 of the entry's canonical JSON
+    @staticmethod
+    def _mac(auth_key: bytes, entry: dict) -> str:
+        message = json.dumps(entry, sort_keys=True, separators=(",", ":")).encode()
+        return hmac.new(auth_key, message, hashlib.sha256).hexdigest()
+
+    ## @brief Checks that an entry hashes what its verification depended on
+    ## @param entry Entry dictionary
+    ## @return False if the entry has no ranges, or if a "full" profile entry does not cover the signed range
+    @staticmethod
+    def _covers_signed_range(entry: dict) -> bool:
+        ranges = entry["ranges"]
+        if not ranges:
+            return False
+        if entry.get("profile") != DIGEST_PROFILE_FULL:
+            return True
+        signed_length = entry.get("signed_length")
+        return isinstance(signed_length, int) and \
+            any(start <= 0 and end >= signed_length for start, end in ranges)
+
+    ## @brief Returns the path of a file's entry
+    ## @param pdf_filepath Path to the PDF file
+    ## @return Entry path
+    def _entry_path(self, pdf_filepath: str) -> str:
+        name = hashlib.sha256(os.path.realpath(pdf_filepath).encode()).hexdigest()[:32]
+        return os.path.join(self.directory, f"{name}.json")
+
+    ## @brief Computes the cheap identity of a file: size, modification time and header hash
+    ## @param stream Stream of the open file
+    ## @return List [size, mtime_ns, header SHA-256]
+    @staticmethod
+    def _file_key(stream) -> list:
+        stat = os.fstat(stream.fileno())
+        stream.seek(0)
+        head = hashlib.sha256(stream.read(PARSE_INDEX_HEAD_SIZE)).hexdigest()
+        return [stat.st_size, stat.st_mtime_ns, head]
+
+
+## @brief Returns whether verifications use the parse index by default
+## @return True if PARSE_INDEX_ENV is set to a non-empty value other than "0"
+def parse_index_enabled() -> bool:
+    return os.getenv(PARSE_INDEX_ENV, "") not in ("", "0")
+
+
+## @brief Returns the index at PARSE_INDEX_DIR_PATH
+## @return ParseIndex
+def get_default_parse_index() -> ParseIndex:
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = ParseIndex()
+        return _default_index
@@ -0,0 +1,223 @@
+## @file pdf_incremental.py
+## @brief Incremental update helpers for embedding signatures in PDF files
+##
+## Provides functions to append a new document information dictionary (or
+## any added and replaced objects) to an existing PDF as an incremental
+## update, so that the original bytes stay
+## untouched and can be hashed as a byte range, and to check that a signed
+## file was not modified after the signed range.
+
+import re
+from io import BytesIO
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import DictionaryObject, IndirectObject, NameObject, NumberObject
+
+## @brief Number of bytes read from the end of the file when locating startxref
+STARTXREF_TAIL_SIZE = 1024
+
+
+## @brief Finds the offset of the last cross-reference section of a PDF
+## @param stream Seekable binary stream of the PDF file
+## @return Offset stored after the last "startxref" keyword
+## @throws ValueError if the keyword cannot be found
+def find_startxref(stream) -> int:
+    stream.seek(0, 2)
+    size = stream.tell()
+    stream.seek(max(0, size - STARTXREF_TAIL_SIZE))
+    tail = stream.read()
+    match = None
+    for match in re.finditer(rb"startxref\s+(\d+)", tail):
+        pass
+    if match is None:
+        raise ValueError("startxref not found in PDF file")
+    return int(match.group(1))
+
+
+## @brief Writes an incremental update with a new information dictionary
+##
+## Must be called with @p out_stream positioned right after an unchanged copy
+## of the original file. Writes a single new object holding @p info, a classic
+## cross-reference section for that object and a trailer whose /Prev points
+## to the original cross-reference section.
+## @param reader PdfReader opened on the original PDF
+## @param out_stream Binary stream the update is appended to
+## @param info DictionaryObject used as the new document information dictionary
+## @param signed_length Length of the original file copied to @p out_stream
+## @param prev_xref Offset of the original cross-reference section (see find_startxref)
+## @return None
+def write_info_update(reader: PdfReader, out_stream, info: DictionaryObject,
+                      signed_length: int, prev_xref: int) -> None:
+    info_id = next_object_number(reader)
+    write_objects_update(reader, out_stream, {info_id: serialize_object(info)}, signed_length, prev_xref,
+                         IndirectObject(info_id, 0, reader))
+
+
+## @brief Writes an incremental update adding or replacing objects
+##
+## Must be called with @p out_stream positioned right after an unchanged copy
+## of the original file. Objects numbered from next_object_number() on are
+## added; lower numbers replace the existing objects, keeping their generation.
+## @param reader PdfReader opened on the original PDF
+## @param out_stream Binary stream the update is appended to
+## @param objects Dictionary object number -> serialized object (without "obj" and "endobj")
+## @param original_length Length of the original file copied to @p out_stream
+## @param prev_xref Offset of the original cross-reference section (see find_startxref)
+## @param info IndirectObject of the information dictionary, defaults to the original one
+## @return None
+def write_objects_update(reader: PdfReader, out_stream, objects: dict, original_length: int, prev_xref: int,
+                         info: IndirectObject | None = None) -> None:
+    update = bytearray(b"\n")
+    offsets = {}
+    generations = {}
+    for idnum in sorted(objects):
+        offsets[idnum] = original_length + len(update)
+        generations[idnum] = _generation(reader, idnum)
+        update += f"{idnum} {generations[idnum]} obj\n".encode()
+        update += objects[idnum]
+        update += b"\nendobj\n"
+
+    xref_offset = original_length + len(update)
+    update += b"xref\n"
+    numbers = sorted(offsets)
+    first = 0
+    # One subsection per run of consecutive object numbers
+    for index in range(1, len(numbers) + 1):
+        if index == len(numbers) or numbers[index] != numbers[index - 1] + 1:
+            update += f"{numbers[first]} {index - first}\n".encode()
+            for idnum in numbers[first:index]:
+                update += f"{offsets[idnum]:010d} {generations[idnum]:05d} n \n".encode()
+            first = index
+
+    trailer = DictionaryObject()
+    trailer[NameObject("/Size")] = NumberObject(max(next_object_number(reader), numbers[-1] + 1))
+    trailer[NameObject("/Root")] = reader.trailer.raw_get("/Root")
+    if info is None and "/Info" in reader.trailer:
+        info = reader.trailer.raw_get("/Info")
+    if info is not None:
+        trailer[NameObject("/Info")] = info
+    trailer[NameObject("/Prev")] = NumberObject(prev_xref)
+    if "/ID" in reader.trailer:
+        trailer[NameObject("/ID")] = reader.trailer.raw_get("/ID")
+    update += b"trailer\n"
+    update += serialize_object(trailer)
+    update += f"\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+
+    out_stream.write(bytes(update))
+
+
+## @brief Returns the first unused object number of a PDF
+## @param reader PdfReader of the document
+## @return Value of the trailer's /Size entry
+def next_object_number(reader: PdfReader) -> int:
+    if "/Size" in reader.trailer:
+        return int(reader.trailer["/Size"])
+    # PyPDF2 does not copy /Size from cross-reference streams into the trailer
+    numbers = [idnum for entries in reader.xref.values() for idnum in entries]
+    numbers.extend(reader.xref_objStm)
+    return max(numbers, default=0) + 1
+
+
+## @brief Returns the generation number of an existing object
+## @param reader PdfReader of the document
+## @param idnum Object number
+## @return Generation number, 0 for new objects and objects in object streams
+def _generation(reader: PdfReader, idnum: int) -> int:
+    for generation, entries in reader.xref.items():
+        if idnum in entries:
+            return generation
+    return 0
+
+
+## @brief Read-only view of the first bytes of a stream
+##
+## Lets a PdfReader parse the signed revision of a file as if the bytes after
+## the signed range did not exist.
+class _PrefixStream:
+    ## @brief Wraps a stream
+    ## @param stream Seekable binary stream
+    ## @param length Number of bytes visible through the view
+    def __init__(self, stream, length: int):
+        self._stream = stream
+        self._length = length
+        self._position = 0
+
+    def read(self, size=-1):
+        end = self._length if size is None or size < 0 else min(self._length, self._position + size)
+        if end <= self._position:
+            return b""
+        self._stream.seek(self._position)
+        data = self._stream.read(end - self._position)
+        self._position += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        base = (0, self._position, self._length)[whence]
+        self._position = max(0, base + offset)
+        return self._position
+
+    def tell(self):
+        return self._position
+
+
+## @brief Returns the object locations of a parsed revision
+## @param reader PdfReader of the revision
+## @return Dictionary object number -> (generation, offset) or ("stream", stream number, index)
+def _object_locations(reader: PdfReader) -> dict:
+    locations = {}
+    for generation, entries in reader.xref.items():
+        for idnum, offset in entries.items():
+            locations[idnum] = (generation, offset)
+    for idnum, (stream_id, index) in reader.xref_objStm.items():
+        locations[idnum] = ("stream", stream_id, index)
+    return locations
+
+
+## @brief Checks that nothing but the information dictionary follows the signed range
+##
+## The signed revision (the first @p signed_length bytes) is parsed on its own
+## and its cross-reference table compared with the one of the whole file:
+## exactly one update section may follow the signed range, and it may only
+## add the new information dictionary. Pointing an existing object to other
+## bytes, even bytes inside the signed range, counts as a change.
+## @param reader PdfReader opened on the signed file
+## @param stream Seekable binary stream of the signed file
+## @param signed_length Length of the signed byte range
+## @return None if the file is unmodified, otherwise a message describing the change
+def find_changes_after(reader: PdfReader, stream, signed_length: int) -> str | None:
+    if find_startxref(stream) < signed_length:
+        return "Cross-reference section does not follow the signed range"
+    signed_xref = find_startxref(_PrefixStream(stream, signed_length))
+    if reader.trailer.get("/Prev") != signed_xref:
+        return "More than one update section follows the signed range"
+
+    try:
+        signed_reader = PdfReader(_PrefixStream(stream, signed_length))
+    except Exception as e:
+        return f"Signed revision cannot be read: {e}"
+    info = reader.trailer.raw_get("/Info")
+    info_id = info.idnum if isinstance(info, IndirectObject) else None
+    if info_id in signed_reader.xref_objStm or any(info_id in entries for entries in signed_reader.xref.values()):
+        return f"Object {info_id} 0 R was replaced after signing"
+    root, signed_root = reader.trailer.raw_get("/Root"), signed_reader.trailer.raw_get("/Root")
+    if (root.idnum, root.generation) != (signed_root.idnum, signed_root.generation):
+        return "Document catalog was replaced after signing"
+
+    signed_locations = _object_locations(signed_reader)
+    for idnum, location in _object_locations(reader).items():
+        if idnum == info_id:
+            continue
+        if idnum not in signed_locations:
+            return f"Object {idnum} was added after signing"
+        if location != signed_locations[idnum]:
+            return f"Object {idnum} was replaced after signing"
+    return None
+
+
+## @brief Serializes a PDF object to bytes
+## @param obj PyPDF2 generic object
+## @return PDF syntax of the object
+def serialize_object(obj) -> bytes:
+    buffer = BytesIO()
+    obj.write_to_stream(buffer, None)
+    return buffer.getvalue()
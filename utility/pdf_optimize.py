@@ -0,0 +1,267 @@
+## @file pdf_optimize.py
+## @brief Size-optimized rewriting of PDF documents
+##
+## Rewrites a document as a compact PDF 1.5 file:
+##  - only objects reachable from the trailer are kept, renumbered from 1
+##  - streams without a filter are compressed with FlateDecode (XMP metadata
+##    excepted, so it stays readable by non-PDF tools)
+##  - identical objects (fonts embedded once per page, shared images, ...)
+##    are merged; objects referring to merged objects are compared again
+##    until nothing changes
+##  - objects other than streams are packed into compressed object streams,
+##    indexed by a compressed cross-reference stream
+##
+## Only resources are merged: streams (images, embedded fonts, ...), arrays
+## and plain values, and dictionaries typed as resources (fonts, graphics
+## states, ...). Other dictionaries, such as page tree nodes, annotations,
+## form fields, outline items, structure elements and optional content
+## groups, are identified by their reference and stay distinct.
+
+import hashlib
+import zlib
+from io import BytesIO
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, EncodedStreamObject, IndirectObject, NameObject, NullObject, \
+    StreamObject
+
+from constants import OBJECT_STREAM_MAX_OBJECTS, OPTIMIZE_COMPRESSION_LEVEL
+
+## @brief Dictionary types that may be merged with identical objects
+_MERGEABLE_TYPES = ("/Font", "/FontDescriptor", "/Encoding", "/CMap", "/ExtGState", "/Pattern", "/Shading",
+                    "/XObject", "/Halftone", "/Group")
+
+## @brief Stream types written uncompressed
+_UNCOMPRESSED_STREAM_TYPES = ("/Metadata",)
+
+## @brief Stream dictionary keys rewritten from the stream data
+_STREAM_LENGTH_KEYS = ("/Length",)
+
+
+## @brief Serializes an object, writing references through a renumbering function
+## @param obj PyPDF2 generic object
+## @param number Function mapping an IndirectObject to the written object number, or None for null
+## @param out bytearray receiving the serialization
+def _serialize(obj, number, out: bytearray) -> None:
+    if isinstance(obj, IndirectObject):
+        target = number(obj)
+        out += b"null" if target is None else f"{target} 0 R".encode()
+    elif isinstance(obj, StreamObject):
+        data = obj._data
+        out += b"<<"
+        for key, value in dict.items(obj):
+            if key in _STREAM_LENGTH_KEYS:
+                continue
+            out += key.encode() + b" "
+            _serialize(value, number, out)
+            out += b"\n"
+        out += f"/Length {len(data)}>>\nstream\n".encode()
+        out += data
+        out += b"\nendstream"
+    elif isinstance(obj, DictionaryObject):
+        out += b"<<"
+        for key, value in dict.items(obj):
+            out += key.encode() + b" "
+            _serialize(value, number, out)
+            out += b"\n"
+        out += b">>"
+    elif isinstance(obj, ArrayObject):
+        out += b"["
+        for index, item in enumerate(list.__iter__(obj)):
+            if index:
+                out += b" "
+            _serialize(item, number, out)
+        out += b"]"
+    else:
+        buffer = BytesIO()
+        obj.write_to_stream(buffer, None)
+        out += buffer.getvalue()
+
+
+## @brief Checks whether an object may be replaced by an identical one
+## @param obj PyPDF2 generic object
+## @return True for streams, non-dictionary objects and dictionaries of a type in _MERGEABLE_TYPES
+def _is_mergeable(obj) -> bool:
+    if isinstance(obj, StreamObject) or not isinstance(obj, DictionaryObject):
+        return True
+    return obj.get("/Type") in _MERGEABLE_TYPES
+
+
+## @brief Returns the direct references of an object
+## @param obj PyPDF2 generic object
+## @return Generator of IndirectObject
+def _references(obj):
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, IndirectObject):
+            yield item
+        elif isinstance(item, DictionaryObject):
+            stack.extend(value for key, value in dict.items(item)
+                         if not (isinstance(item, StreamObject) and key in _STREAM_LENGTH_KEYS))
+        elif isinstance(item, ArrayObject):
+            stack.extend(list.__iter__(item))
+
+
+## @brief Compresses a stream that has no filter
+## @param obj StreamObject of the reader (left unchanged)
+## @return Compressed copy of the stream, or @p obj itself if it is not compressed
+def _compress_stream(obj: StreamObject) -> StreamObject:
+    if "/Filter" in obj or obj.get("/Type") in _UNCOMPRESSED_STREAM_TYPES:
+        return obj
+    compressed = zlib.compress(obj._data, OPTIMIZE_COMPRESSION_LEVEL)
+    if len(compressed) >= len(obj._data):
+        return obj
+    copy = EncodedStreamObject()
+    copy.update((key, value) for key, value in dict.items(obj) if key != "/DecodeParms")
+    copy[NameObject("/Filter")] = NameObject("/FlateDecode")
+    copy._data = compressed
+    return copy
+
+
+## @brief Rewrites a document in a size-optimized form
+## @param reader PdfReader of the document (not encrypted)
+## @return Bytes of the optimized PDF file
+def optimize_pdf(reader: PdfReader) -> bytes:
+    trailer = reader.trailer
+    roots = [trailer.raw_get(key) for key in ("/Root", "/Info") if key in trailer]
+
+    # Load every reachable object
+    objects = {}
+    stack = [ref for ref in roots if isinstance(ref, IndirectObject)]
+    while stack:
+        ref = stack.pop()
+        key = (ref.idnum, ref.generation)
+        if key in objects:
+            continue
+        obj = ref.get_object()
+        if obj is None or isinstance(obj, NullObject):
+            objects[key] = None
+            continue
+        if isinstance(obj, StreamObject):
+            obj = _compress_stream(obj)
+        objects[key] = obj
+        stack.extend(_references(obj))
+
+    # Merge identical objects until references stop changing; while comparing,
+    # references are written as the load order of the referenced representative
+    representative = {key: key for key in objects}
+    ordinals = {key: index for index, key in enumerate(objects)}
+
+    def find(key):
+        while representative[key] != key:
+            key = representative[key]
+        return key
+
+    def canonical_number(ref):
+        key = (ref.idnum, ref.generation)
+        return None if objects.get(key) is None else ordinals[find(key)]
+
+    mergeable = [key for key, obj in objects.items() if obj is not None and _is_mergeable(obj)]
+    changed = True
+    while changed:
+        changed = False
+        seen = {}
+        for key in mergeable:
+            if find(key) != key:
+                continue
+            out = bytearray()
+            _serialize(objects[key], canonical_number, out)
+            digest = hashlib.sha256(out).digest()
+            other = seen.setdefault(digest, key)
+            if other != key:
+                representative[key] = other
+                changed = True
+
+    # Number the objects left reachable in the order they are found
+    numbers = {}
+    order = []
+    stack = [ref for ref in reversed(roots) if isinstance(ref, IndirectObject)]
+    while stack:
+        ref = stack.pop()
+        key = (ref.idnum, ref.generation)
+        if objects.get(key) is None:
+            continue
+        key = find(key)
+        if key in numbers:
+            continue
+        numbers[key] = len(numbers) + 1
+        order.append(key)
+        stack.extend(reversed(list(_references(objects[key]))))
+
+    def number(ref):
+        key = (ref.idnum, ref.generation)
+        return None if objects.get(key) is None else numbers[find(key)]
+
+    return _write(reader, objects, order, numbers, number)
+
+
+## @brief Writes the optimized file
+## @param reader PdfReader of the original document
+## @param objects Dictionary (idnum, generation) -> object
+## @param order Keys of the objects to write, in object number order
+## @param numbers Dictionary key -> new object number
+## @param number Function mapping an IndirectObject to its new object number
+## @return Bytes of the PDF file
+def _write(reader: PdfReader, objects: dict, order: list, numbers: dict, number) -> bytes:
+    # Object and cross-reference streams need PDF 1.5
+    version = reader.pdf_header[5:8] if reader.pdf_header.startswith("%PDF-") else "1.5"
+    out = bytearray(f"%PDF-{max(version, '1.5')}\n%".encode() + b"\xe2\xe3\xcf\xd3\n")
+    # Cross-reference entries: number -> (type, field 2, field 3)
+    entries = {0: (0, 0, 65535)}
+
+    packed = []
+    for key in order:
+        obj = objects[key]
+        if isinstance(obj, StreamObject):
+            entries[numbers[key]] = (1, len(out), 0)
+            out += f"{numbers[key]} 0 obj\n".encode()
+            _serialize(obj, number, out)
+            out += b"\nendobj\n"
+        else:
+            packed.append(key)
+
+    next_number = len(order) + 1
+    for start in range(0, len(packed), OBJECT_STREAM_MAX_OBJECTS):
+        group = packed[start:start + OBJECT_STREAM_MAX_OBJECTS]
+        stream_number = next_number
+        next_number += 1
+        offsets = []
+        body = bytearray()
+        for index, key in enumerate(group):
+            offsets.append(f"{numbers[key]} {len(body)}")
+            _serialize(objects[key], number, body)
+            body += b"\n"
+            entries[numbers[key]] = (2, stream_number, index)
+        header = (" ".join(offsets) + "\n").encode()
+        data = zlib.compress(bytes(header + body), OPTIMIZE_COMPRESSION_LEVEL)
+        entries[stream_number] = (1, len(out), 0)
+        out += f"{stream_number} 0 obj\n<</Type /ObjStm /N {len(group)} /First {len(header)} " \
+               f"/Filter /FlateDecode /Length {len(data)}>>\nstream\n".encode()
+        out += data
+        out += b"\nendstream\nendobj\n"
+
+    xref_number = next_number
+    size = xref_number + 1
+    xref_offset = len(out)
+    entries[xref_number] = (1, xref_offset, 0)
+    width = max(4, (max(offset for kind, offset, _ in entries.values()).bit_length() + 7) // 8)
+    rows = bytearray()
+    for entry_number in range(size):
+        kind, field2, field3 = entries.get(entry_number, (0, 0, 0))
+        rows += kind.to_bytes(1, "big") + field2.to_bytes(width, "big") + field3.to_bytes(2, "big")
+    data = zlib.compress(bytes(rows), OPTIMIZE_COMPRESSION_LEVEL)
+
+    trailer = reader.trailer
+    extra = bytearray()
+    for key in ("/Root", "/Info", "/ID"):
+        if key in trailer:
+            extra += key.encode() + b" "
+            _serialize(trailer.raw_get(key), number, extra)
+            extra += b" "
+    out += f"{xref_number} 0 obj\n<</Type /XRef /Size {size} /W [1 {width} 2] ".encode()
+    out += extra
+    out += f"/Filter /FlateDecode /Length {len(data)}>>\nstream\n".encode()
+    out += data
+    out += f"\nendstream\nendobj\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    return bytes(out)
@@ -1,18 +1,43 @@
 ## @file pdf_sign.py
 ## @brief PDF signing and verification functionality
 ##
-## Provides functions to sign PDF files with RSA signatures and verify
-## the authenticity of signed documents.
+## Provides functions to sign PDF files with RSA, ECDSA P-256 or Ed25519
+## signatures and verify the authenticity of signed documents.
 
 import base64
 import hashlib
+import logging
 import os
+import shutil
+import sqlite3
+from datetime import datetime
+from io import BytesIO
 
-from Cryptodome.Cipher import AES
-from Cryptodome.Hash import SHA256
-from Cryptodome.PublicKey import RSA
-from Cryptodome.Signature import pkcs1_15
-from PyPDF2 import PdfReader, PdfWriter
+from PyPDF2 import PdfReader
+from PyPDF2.generic import DictionaryObject, NameObject, NumberObject, TextStringObject
+
+from constants import DEFAULT_DIGEST_PROFILE, DIGEST_PROFILE_TEXT, DIGEST_PROFILE_FULL, DIGEST_PROFILE_PAGES, \
+    DIGEST_CHUNK_SIZE, KEY_TYPE_RSA, LOGGER_GLOBAL_NAME, OPTIMIZE_ON_SIGN, \
+    VISIBLE_STAMP_ON_SIGN, DIGEST_MEMO_ENABLED
+from utility.crypto_backend import get_hash_backend, import_key, get_key_type, verify_digest, \
+    SIGNATURE_ALGORITHMS
+from utility.atomic_writer import atomic_write
+from utility.key_container import unpack_private_key, read_public_key, key_fingerprint
+from utility.signer import as_signer
+from utility.signature_registry import get_default_registry, signature_registry_enabled
+from utility.trust_store import get_default_trust_store, TrustError
+from utility.timestamp import get_default_timestamp_client, encode_token, decode_token, verify_token, \
+    load_tsa_public_key, TimestampError
+from utility.digest_profiles import update_digest, parse_page_ranges, format_page_ranges, get_page_count
+from utility.read_ahead import read_ahead
+from utility.pdf_optimize import optimize_pdf
+from utility.profiler import phase
+from utility.pdf_incremental import find_startxref, write_info_update, find_changes_after
+from utility.parse_index import RecordingStream, parse_index_enabled, get_default_parse_index
+from utility.digest_memo import get_default_digest_memo
+from utility.signature_stamp import add_signature_stamp, get_stamp_appearance
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
 
 
 ## @brief Exception raised when private key decryption fails
@@ -23,75 +48,334 @@ class DecryptionError(Exception):
 ## @brief Decrypt a private key using a PIN
 ## @param private_key_filepath Path to the encrypted private key file
 ## @param pin User PIN for decryption
-## @return Decrypted RSA key object
+## @return Decrypted RSA or ECC key object
 ## @throws DecryptionError if PIN is incorrect or decryption fails
-def decrypt_private_key(private_key_filepath: str, pin: str) -> RSA.RsaKey:
+def decrypt_private_key(private_key_filepath: str, pin: str):
    try:
       with open(private_key_filepath, "rb") as f:
          data = f.read()
-      nonce = data[:16]
-      tag = data[16:32]
-      ciphertext = data[32:]
-
-      hashed_pin = hashlib.sha256(pin.encode()).digest()
-      cipher = AES.new(hashed_pin, AES.MODE_GCM, nonce=nonce)
-      return RSA.import_key(cipher.decrypt_and_verify(ciphertext, tag))
+      return import_key(unpack_private_key(data, pin))
    except ValueError:
       raise DecryptionError
 
 
 
 ## @brief Signs a PDF file using a private key
-## @param decrypted_private_key The decrypted RSA private key
+##
+## The signature is embedded as an incremental update appended to an unchanged
+## copy of the original file, together with the digest profile used, so the
+## verifier can recompute exactly the same digest. With @p optimize the
+## document is first rewritten by optimize_pdf and the optimized bytes are
+## signed instead, unless the rewrite is not smaller. With @p visible_stamp a
+## signature stamp is added to the last page (see signature_stamp.py) before
+## the digest is computed, so the signature covers it.
+## @param decrypted_private_key The decrypted RSA or ECC private key, or a DocumentSigner
+##        (preferred when signing several files with the same key)
 ## @param pdf_filepath Path to the PDF file to be signed
-## @return None
-def sign_pdf_file(decrypted_private_key: RSA.RsaKey, pdf_filepath: str) -> None:
-    reader = PdfReader(pdf_filepath)
-    writer = PdfWriter()
+## @param digest_profile Digest profile deciding which parts of the document are hashed
+## @param pages Page range specification used by the "pages" digest profile
+## @param output_dir Directory for the signed file, defaults to the directory of the input file
+## @param fsync_batch Optional FsyncBatch; the signed file then appears at its path on the batch's next commit
+## @param on_commit Optional callback(error) called once the signed file is in place
+## @param registry SignatureRegistry the signature is recorded in once the file is in place,
+##        defaults to the registry at SIGNATURE_REGISTRY_PATH if SIGNATURE_REGISTRY_ENV is set
+## @param timestamp_client TimestampClient timestamping the signature value, defaults to the
+##        TSA named by TSA_URL_ENV (no timestamp if it is not set)
+## @param progress Optional callback receiving the percentage of the file read (0-100)
+## @param optimize Whether to sign a size-optimized rewrite of the document
+## @param visible_stamp Whether to add a visible signature stamp to the last page
+## @param digest_memo DigestMemo the digest is looked up in and recorded in (for the input and the
+##        signed file), defaults to the shared one (if DIGEST_MEMO_ENABLED)
+## @return Path to the signed PDF file
+## @throws TimestampError if timestamping is enabled and no valid token could be obtained
+def sign_pdf_file(decrypted_private_key, pdf_filepath: str,
+                  digest_profile: str = DEFAULT_DIGEST_PROFILE, pages: str | None = None,
+                  output_dir: str | None = None, fsync_batch=None, on_commit=None, registry=None,
+                  timestamp_client=None, progress=None, optimize: bool = OPTIMIZE_ON_SIGN,
+                  visible_stamp: bool = VISIBLE_STAMP_ON_SIGN, digest_memo=None) -> str:
+    signer = as_signer(decrypted_private_key)
+    dir_path, filename = os.path.split(pdf_filepath)
+    signed_pdf_filepath = os.path.join(output_dir or dir_path, f"SIGNED_{filename}")
 
-    if "/Signature" in reader.metadata:
-      raise ValueError("PDF already has a signature.")
+    with open(pdf_filepath, "rb") as src:
+        with phase("parse"):
+            reader = PdfReader(src)
 
-    for page in reader.pages:
-        writer.add_page(page)
+            if reader.is_encrypted:
+                raise ValueError("Encrypted PDF files cannot be signed.")
+            if reader.metadata is not None and "/Signature" in reader.metadata:
+                raise ValueError("PDF already has a signature.")
 
-    pdf_bytes = b"".join([page.extract_text().encode() for page in reader.pages if page.extract_text()])
-    hash_obj = SHA256.new(pdf_bytes)
+        if optimize:
+            with phase("optimize"):
+                optimized = optimize_pdf(reader)
+            original_size = os.fstat(src.fileno()).st_size
+            if len(optimized) < original_size:
+                logger.info(f"Optimized {pdf_filepath}: {original_size} -> {len(optimized)} bytes")
+                # The optimized bytes take the place of the original file from here on
+                src = BytesIO(optimized)
+                reader = PdfReader(src)
 
-    signature = pkcs1_15.new(decrypted_private_key).sign(hash_obj)
+        if visible_stamp:
+            with phase("stamp"):
+                stamped = BytesIO()
+                add_signature_stamp(reader, src, stamped, get_stamp_appearance(signer))
+                # The stamped document is what gets signed
+                src = stamped
+                reader = PdfReader(src)
 
-    writer.add_metadata({"/Signature": base64.b64encode(signature).decode()})
+        if digest_profile == DIGEST_PROFILE_PAGES:
+            pages = format_page_ranges(parse_page_ranges(pages or "", get_page_count(reader)))
+        else:
+            pages = None
 
-    dir_path, filename = os.path.split(pdf_filepath)
-    signed_pdf_filename = f"SIGNED_{filename}"
-    with open(os.path.join(dir_path, signed_pdf_filename), "wb") as f:
-        writer.write(f)
+        signed_length = src.seek(0, os.SEEK_END)
+        prev_xref = find_startxref(src)
+        if digest_memo is None and DIGEST_MEMO_ENABLED:
+            digest_memo = get_default_digest_memo()
+        with phase("digest"):
+            # Optimized or stamped documents are in memory and never found in the memo
+            digest = digest_memo.lookup(src, digest_profile, pages, signed_length) if digest_memo is not None else None
+            if digest is None:
+                digest = update_digest(get_hash_backend().new(), reader, src, digest_profile, pages, signed_length,
+                                       progress).digest()
+                if digest_memo is not None:
+                    digest_memo.record(src, digest_profile, pages, signed_length, digest)
+
+        with phase("sign"):
+            signature = signer.sign(digest)
+        if timestamp_client is None:
+            timestamp_client = get_default_timestamp_client()
+        with phase("timestamp"):
+            timestamp_token = timestamp_client.timestamp(signature) if timestamp_client is not None else None
+
+        info = DictionaryObject()
+        if reader.metadata is not None:
+            info.update(dict.items(reader.metadata))
+        info[NameObject("/Signature")] = TextStringObject(base64.b64encode(signature).decode())
+        info[NameObject("/SignatureAlgorithm")] = TextStringObject(signer.algorithm)
+        info[NameObject("/SignatureProfile")] = TextStringObject(digest_profile)
+        info[NameObject("/SignedLength")] = NumberObject(signed_length)
+        if pages:
+            info[NameObject("/SignaturePages")] = TextStringObject(pages)
+        if timestamp_token is not None:
+            info[NameObject("/SignatureTimestamp")] = TextStringObject(encode_token(timestamp_token))
+
+        use_registry = registry is not None or signature_registry_enabled()
+        # The "full" digest already is the document hash; otherwise it is
+        # computed from the bytes being copied anyway
+        document_hash = digest if digest_profile == DIGEST_PROFILE_FULL else None
+        copy_hash = hashlib.sha256() if use_registry and document_hash is None else None
+        entry = {}
+
+        def committed(error):
+            if error is None and use_registry:
+                # Best effort: a registry that cannot be opened or written never fails the signing
+                try:
+                    (registry or get_default_registry()).record(
+                        document_sha256=(document_hash or copy_hash.digest()).hex(), signed_digest=digest.hex(),
+                        digest_profile=digest_profile, signer_fingerprint=signer.fingerprint,
+                        signature_algorithm=signer.algorithm, input_path=pdf_filepath,
+                        output_path=signed_pdf_filepath, output_size=entry["size"],
+                    )
+                except (sqlite3.Error, OSError) as e:
+                    logger.error(f"Recording {signed_pdf_filepath} in the signature registry failed: {e}")
+            if error is None and digest_memo is not None:
+                # The signed range of the new file has the same digest, so verifying it skips hashing
+                digest_memo.record_file(signed_pdf_filepath, digest_profile, pages, signed_length, digest)
+            if on_commit is not None:
+                on_commit(error)
+
+        with phase("write"), atomic_write(signed_pdf_filepath, batch=fsync_batch, on_commit=committed) as f:
+            src.seek(0)
+            if copy_hash is None:
+                shutil.copyfileobj(src, f, DIGEST_CHUNK_SIZE)
+            else:
+                def hash_and_write(chunk):
+                    copy_hash.update(chunk)
+                    f.write(chunk)
+
+                # The digest profile did not read the file bytes, so progress is reported here
+                read_ahead(src, signed_length, hash_and_write, progress)
+            write_info_update(reader, f, info, signed_length, prev_xref)
+            entry["size"] = f.tell()
+
+    return signed_pdf_filepath
 
 ## @brief Verifies the signature of a signed PDF file
+##
+## See verify_pdf_stream for the checks made. With a parse index, a file
+## verified before and unchanged since is checked from its index entry
+## without being parsed (see parse_index.py). Otherwise a digest memoized
+## while the unchanged file was signed or verified before is used instead of
+## hashing it again (see digest_memo.py).
 ## @param pdf_filepath Path to the signed PDF file
 ## @param public_key_filepath Path to the public key file
+## @param trust_store Optional TrustStore, defaults to the one at TRUST_STORE_PATH
+## @param progress Optional callback receiving the percentage of the signed byte range hashed (0-100)
+## @param parse_index Optional ParseIndex, defaults to the one at PARSE_INDEX_DIR_PATH if PARSE_INDEX_ENV is set
+## @param digest_memo Optional DigestMemo, defaults to the shared one (if DIGEST_MEMO_ENABLED); not used
+##        with a parse index, whose entries must cover the digested bytes
 ## @return Tuple (is_valid, message) where is_valid is a boolean indicating if the signature is valid
-def verify_pdf_signature(pdf_filepath: str, public_key_filepath: str) -> tuple[bool, str]:
+def verify_pdf_signature(pdf_filepath: str, public_key_filepath: str, trust_store=None,
+                         progress=None, parse_index=None, digest_memo=None) -> tuple[bool, str]:
    try:
-      with open(public_key_filepath, "rb") as f:
-         public_key = RSA.import_key(f.read())
+      public_key = import_key(read_public_key(public_key_filepath))
+      if parse_index is None and parse_index_enabled():
+         parse_index = get_default_parse_index()
+      with open(pdf_filepath, "rb") as stream:
+         if parse_index is None:
+            if digest_memo is None and DIGEST_MEMO_ENABLED:
+               digest_memo = get_default_digest_memo()
+            return verify_pdf_stream(stream, public_key, trust_store, progress, digest_memo=digest_memo)
+         return _verify_indexed(pdf_filepath, stream, public_key, parse_index, trust_store, progress)
+   except ValueError as ve:
+      return False, f"Invalid signature: {str(ve)}"
+   except FileNotFoundError as fnf:
+      return False, f"File not found: {str(fnf)}"
+   except Exception as e:
+      return False, f"Verification failed: {str(e)}"
 
-      reader = PdfReader(pdf_filepath)
-      metadata = reader.metadata
 
-      if "/Signature" not in metadata:
+## @brief Verifies a signed PDF file using its parse index entry, or fully while recording a new entry
+## @param pdf_filepath Path to the signed PDF file
+## @param stream Stream of the open file
+## @param public_key Imported public key of the signer
+## @param parse_index ParseIndex
+## @param trust_store Optional TrustStore
+## @param progress Optional progress callback
+## @return Tuple (is_valid, message)
+def _verify_indexed(pdf_filepath: str, stream, public_key, parse_index, trust_store=None,
+                    progress=None) -> tuple[bool, str]:
+   entry = parse_index.lookup(pdf_filepath, stream, progress)
+   if entry is not None:
+      logger.info(f"Verifying {pdf_filepath} from its parse index entry")
+      try:
+         _check_algorithm(entry["algorithm"], public_key)
+         return check_signature(public_key, bytes.fromhex(entry["digest"]), base64.b64decode(entry["signature"]),
+                                entry["timestamp"], trust_store)
+      except Exception as e:
+         return _failure(e)
+
+   recorder = RecordingStream(stream)
+   details = {}
+   result = verify_pdf_stream(recorder, public_key, trust_store, progress, details)
+   if result[0]:
+      parse_index.store(pdf_filepath, stream, recorder.ranges(), details)
+   else:
+      parse_index.discard(pdf_filepath)
+   return result
+
+
+## @brief Verifies the signature of a signed PDF read from a stream
+##
+## Documents signed before digest profiles were introduced carry no profile
+## entry and are verified with the "text" profile. An embedded timestamp token
+## must match the signature; its TSA signature is checked when the TSA public
+## key is configured (TSA_PUBLIC_KEY_ENV). The signer key is then checked
+## against the trust store at the timestamp's time if the TSA signature was
+## verified, otherwise now.
+## @param stream Seekable binary stream of the signed PDF (a file, an archive member, ...)
+## @param public_key Imported public key of the signer
+## @param trust_store Optional TrustStore, defaults to the one at TRUST_STORE_PATH
+## @param progress Optional callback receiving the percentage of the signed byte range hashed (0-100)
+## @param details Optional dictionary receiving the digest and the signature entries once the digest is computed
+## @param digest_memo Optional DigestMemo the digest is looked up in and recorded in; only for
+##        streams reading a file directly (not archive members or wrappers forwarding fileno())
+## @return Tuple (is_valid, message) where is_valid is a boolean indicating if the signature is valid
+def verify_pdf_stream(stream, public_key, trust_store=None, progress=None, details=None,
+                      digest_memo=None) -> tuple[bool, str]:
+   try:
+      with phase("parse"):
+         reader = PdfReader(stream)
+         metadata = reader.metadata
+
+      if metadata is None or "/Signature" not in metadata:
          return False, "No signature found in the PDF"
 
       signature = base64.b64decode(metadata["/Signature"])
+      algorithm = str(metadata.get("/SignatureAlgorithm", SIGNATURE_ALGORITHMS[KEY_TYPE_RSA]))
+      _check_algorithm(algorithm, public_key)
+      digest_profile = str(metadata.get("/SignatureProfile", DIGEST_PROFILE_TEXT))
+      pages = metadata.get("/SignaturePages")
+      signed_length = metadata.get("/SignedLength")
+      timestamp = metadata.get("/SignatureTimestamp")
 
-      pdf_bytes = b"".join([page.extract_text().encode() for page in reader.pages if page.extract_text()])
-      hash_obj = SHA256.new(pdf_bytes)
+      if signed_length is not None:
+         signed_length = int(signed_length)
+         with phase("find changes"):
+            change = find_changes_after(reader, stream, signed_length)
+         if change:
+            return False, f"Document modified after signing: {change}"
+      elif digest_profile == DIGEST_PROFILE_FULL:
+         return False, "Invalid signature: signed byte range missing"
 
-      pkcs1_15.new(public_key).verify(hash_obj, signature)
-      return True, "Signature verified successfully"
-   except ValueError as ve:
-      return False, f"Invalid signature: {str(ve)}"
-   except FileNotFoundError as fnf:
-      return False, f"File not found: {str(fnf)}"
+      pages = str(pages) if pages else None
+      with phase("digest"):
+         digest = digest_memo.lookup(stream, digest_profile, pages, signed_length) if digest_memo is not None else None
+         if digest is None:
+            digest = update_digest(get_hash_backend().new(), reader, stream, digest_profile, pages, signed_length,
+                                   progress).digest()
+            if digest_memo is not None:
+               digest_memo.record(stream, digest_profile, pages, signed_length, digest)
+
+      timestamp = str(timestamp) if timestamp is not None else None
+      if details is not None:
+         details.update(digest=digest.hex(), signature=base64.b64encode(signature).decode(), algorithm=algorithm,
+                        profile=digest_profile, signed_length=signed_length, timestamp=timestamp)
+      return check_signature(public_key, digest, signature, timestamp, trust_store)
    except Exception as e:
-      return False, f"Verification failed: {str(e)}"
+      return _failure(e)
+
+
+## @brief Checks a signature over a document digest, its timestamp and the trust in the signer
+## @param public_key Imported public key of the signer
+## @param digest Document digest
+## @param signature Signature value
+## @param timestamp Encoded timestamp token, or None
+## @param trust_store Optional TrustStore, defaults to the one at TRUST_STORE_PATH
+## @return Tuple (True, message)
+## @throws ValueError if the signature is invalid
+## @throws TimestampError if the timestamp does not match or verify
+## @throws TrustError if the signer key is not trusted
+def check_signature(public_key, digest: bytes, signature: bytes, timestamp: str | None,
+                    trust_store=None) -> tuple[bool, str]:
+   trust_store = trust_store or get_default_trust_store()
+   with phase("verify"):
+      verify_digest(public_key, digest, signature)
+   if timestamp is None:
+      trust_store.check(key_fingerprint(public_key).hex())
+      return True, "Signature verified successfully"
+
+   tsa_public_key = load_tsa_public_key()
+   tst_info = verify_token(decode_token(timestamp), signature, tsa_public_key)
+   if tsa_public_key is None:
+      # Anyone can write an unverified token with any time, so trust is checked as of now
+      trust_store.check(key_fingerprint(public_key).hex())
+   else:
+      signed_at = datetime.fromisoformat(tst_info["gen_time"].replace("Z", "+00:00")).timestamp()
+      trust_store.check(key_fingerprint(public_key).hex(), signed_at)
+   trust = "verified" if tsa_public_key is not None else "TSA key not configured"
+   return True, f"Signature verified successfully (timestamp {tst_info['gen_time']}, {trust})"
+
+
+## @brief Checks that a document was signed with the algorithm of a public key
+## @param algorithm Signature algorithm recorded in the document
+## @param public_key Imported public key of the signer
+## @throws ValueError if the algorithms differ
+def _check_algorithm(algorithm: str, public_key) -> None:
+   if algorithm != SIGNATURE_ALGORITHMS[get_key_type(public_key)]:
+      raise ValueError(f"document signed with {algorithm}, public key does not match")
+
+
+## @brief Maps a verification error to a result
+## @param error Exception raised while verifying
+## @return Tuple (False, message)
+def _failure(error: Exception) -> tuple[bool, str]:
+   if isinstance(error, TrustError):
+      return False, f"Untrusted signer: {str(error)}"
+   if isinstance(error, TimestampError):
+      return False, f"Invalid timestamp: {str(error)}"
+   if isinstance(error, ValueError):
+      return False, f"Invalid signature: {str(error)}"
+   return False, f"Verification failed: {str(error)}"
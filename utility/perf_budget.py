@@ -0,0 +1,261 @@
+## @file perf_budget.py
+## @brief Memory and latency budgets of signing, verification, key decryption and key scans
+##
+## Runs the scenarios declared in PERF_BUDGETS_PATH on generated fixtures and
+## fails when one of them exceeds its budget:
+##  - max_seconds   median wall time of the operation over "repeat" runs
+##  - max_alloc_mb  peak Python allocations of one run, measured with tracemalloc
+##  - max_rss_mb    peak resident set size of the process running the scenario
+##
+## Every scenario runs in a fresh process, so imports and earlier scenarios
+## do not blur its memory figures; fixtures are generated once, beforehand.
+## Budgets are kept in the checked-in file, so a change that makes
+## pdf_sign.py or key handling slower or hungrier fails this run before release.
+##
+## Run with: python utility/perf_budget.py [--budgets FILE] [--only SCENARIO ...] [--report FILE]
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import psutil
+from PyPDF2 import PdfWriter
+from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+from constants import LOGGER_GLOBAL_NAME, PERF_BUDGETS_PATH, TSA_URL_ENV, DEFAULT_DIGEST_PROFILE, \
+    PRIVATE_KEY_EXTENSION
+from utility.key_container import read_headers
+from utility.digest_memo import DigestMemo
+from utility.keygen import generate_keypair, encrypt_private_key
+from utility.pdf_sign import decrypt_private_key, sign_pdf_file, verify_pdf_signature
+from utility.signature_registry import SignatureRegistry
+from utility.signer import DocumentSigner
+from utility.trust_store import TrustStore
+from utility.usb_handler import search_usb_for_private_key
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+## @brief Budget keys and the measured metric each of them limits
+BUDGET_METRICS = {"max_seconds": "seconds", "max_alloc_mb": "alloc_mb", "max_rss_mb": "rss_mb"}
+
+
+## @brief Writes a PDF with one line of text per page
+## @param filepath Path of the PDF to write
+## @param pages Number of pages
+def _write_document(filepath: str, pages: int) -> None:
+    writer = PdfWriter()
+    font = writer._add_object(DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    }))
+    resources = DictionaryObject({NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})})
+    for index in range(pages):
+        writer.add_blank_page(595, 842)
+        content = DecodedStreamObject()
+        content.set_data(f"BT /F1 12 Tf 72 770 Td (Performance budget fixture, page {index + 1}) Tj ET".encode())
+        page = writer.pages[index]
+        page[NameObject("/Resources")] = resources
+        page[NameObject("/Contents")] = writer._add_object(content)
+    with open(filepath, "wb") as f:
+        writer.write(f)
+
+
+## @brief Generates the fixtures the scenarios of a budget file need
+## @param directory Directory the fixtures are written to
+## @param config Parsed budget file
+## @return Dictionary of fixture paths and parameters passed to every scenario
+def make_fixtures(directory: str, config: dict) -> dict:
+    pin = str(config.get("pin", "1234"))
+    private_key, public_key = generate_keypair(config.get("key_type"))
+    private_key_filepath = os.path.join(directory, f"signer{PRIVATE_KEY_EXTENSION}")
+    with open(private_key_filepath, "wb") as f:
+        f.write(encrypt_private_key(private_key, pin))
+    public_key_filepath = os.path.join(directory, "signer.pem")
+    with open(public_key_filepath, "wb") as f:
+        f.write(public_key)
+    fixtures = {"directory": directory, "pin": pin, "private_key": private_key_filepath,
+                "public_key": public_key_filepath, "documents": {}, "signed": {}, "key_dirs": {}}
+
+    signer = None
+    for name, scenario in config["scenarios"].items():
+        operation = scenario["operation"]
+        if operation in ("sign", "verify"):
+            pages = int(scenario["pages"])
+            document = fixtures["documents"].get(pages)
+            if document is None:
+                document = os.path.join(directory, f"document_{pages}.pdf")
+                _write_document(document, pages)
+                fixtures["documents"][pages] = document
+            if operation == "verify":
+                profile = scenario.get("profile", DEFAULT_DIGEST_PROFILE)
+                key = f"{pages}:{profile}"
+                if key not in fixtures["signed"]:
+                    signer = signer or DocumentSigner(decrypt_private_key(private_key_filepath, pin))
+                    output_dir = os.path.join(directory, f"signed_{pages}_{profile}")
+                    os.makedirs(output_dir, exist_ok=True)
+                    fixtures["signed"][key] = sign_pdf_file(signer, document, profile, scenario.get("page_range"),
+                                                            output_dir=output_dir,
+                                                            registry=SignatureRegistry(":memory:"))
+        elif operation == "key_scan":
+            count = int(scenario["key_files"])
+            if count not in fixtures["key_dirs"]:
+                with open(private_key_filepath, "rb") as f:
+                    container = f.read()
+                key_dir = os.path.join(directory, f"drive_{count}")
+                for index in range(count):
+                    # Spread over nested directories like keys kept per user and per year
+                    subdir = os.path.join(key_dir, f"user{index % 16}", f"{2000 + index % 7}")
+                    os.makedirs(subdir, exist_ok=True)
+                    with open(os.path.join(subdir, f"key{index}{PRIVATE_KEY_EXTENSION}"), "wb") as f:
+                        f.write(container)
+                    with open(os.path.join(subdir, f"notes{index}.txt"), "w") as f:
+                        f.write("not a key")
+                fixtures["key_dirs"][count] = key_dir
+        elif operation != "decrypt":
+            raise ValueError(f"Unknown operation in scenario {name}: {operation}")
+    return fixtures
+
+
+## @brief Prepares a scenario's operation; the preparation itself is not measured
+## @param scenario Scenario dictionary of the budget file
+## @param fixtures Dictionary returned by make_fixtures
+## @return Callable running the operation once
+def _prepare(scenario: dict, fixtures: dict):
+    operation = scenario["operation"]
+    # A memo keeping no files, so every run hashes the document again
+    no_memo = DigestMemo(max_files=0)
+    if operation == "sign":
+        signer = DocumentSigner(decrypt_private_key(fixtures["private_key"], fixtures["pin"]))
+        document = fixtures["documents"][int(scenario["pages"])]
+        output_dir = tempfile.mkdtemp(dir=fixtures["directory"])
+        registry = SignatureRegistry(":memory:")
+        return lambda: sign_pdf_file(signer, document, scenario.get("profile", DEFAULT_DIGEST_PROFILE),
+                                     scenario.get("page_range"), output_dir=output_dir, registry=registry,
+                                     digest_memo=no_memo)
+    if operation == "verify":
+        signed = fixtures["signed"][f"{scenario['pages']}:{scenario.get('profile', DEFAULT_DIGEST_PROFILE)}"]
+        trust_store = TrustStore(os.path.join(fixtures["directory"], "trust_store.json"))
+
+        def verify():
+            is_valid, message = verify_pdf_signature(signed, fixtures["public_key"], trust_store, digest_memo=no_memo)
+            if not is_valid:
+                raise RuntimeError(f"Fixture failed verification: {message}")
+        return verify
+    if operation == "decrypt":
+        return lambda: decrypt_private_key(fixtures["private_key"], fixtures["pin"])
+    key_dir = fixtures["key_dirs"][int(scenario["key_files"])]
+    return lambda: read_headers(search_usb_for_private_key(key_dir))
+
+
+## @brief Returns the peak resident set size of the current process
+## @return Peak RSS in bytes
+def _peak_rss() -> int:
+    info = psutil.Process().memory_info()
+    if hasattr(info, "peak_wset"):
+        return info.peak_wset
+    if sys.platform.startswith("linux"):
+        # ru_maxrss survives exec, so a spawned worker would report its parent's peak
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    import resource
+    # Bytes on macOS
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+## @brief Measures one scenario; runs in a fresh worker process
+## @param scenario Scenario dictionary of the budget file
+## @param fixtures Dictionary returned by make_fixtures
+## @param repeat Number of timed runs
+## @return Dictionary of the measured metrics
+def _measure(scenario: dict, fixtures: dict, repeat: int) -> dict:
+    run = _prepare(scenario, fixtures)
+    # One untimed run loads the lazily imported modules and fills caches
+    run()
+    timings = []
+    for _ in range(max(1, repeat)):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    rss = _peak_rss()
+
+    # Last, so tracing overhead neither slows the timed runs nor counts in the RSS peak
+    tracemalloc.start()
+    try:
+        run()
+        alloc = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {"seconds": round(statistics.median(timings), 4), "alloc_mb": round(alloc / 2 ** 20, 2),
+            "rss_mb": round(rss / 2 ** 20, 2)}
+
+
+## @brief Runs the scenarios of a budget file and checks them against their budgets
+## @param budgets_filepath Path to the budget file
+## @param only Names of the scenarios to run, None for all
+## @return List of result dictionaries (scenario, measured metrics, budget, exceeded budget keys)
+def run_budgets(budgets_filepath: str = PERF_BUDGETS_PATH, only: list[str] | None = None) -> list[dict]:
+    with open(budgets_filepath, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    if only:
+        unknown = set(only) - set(config["scenarios"])
+        if unknown:
+            raise ValueError(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+        config["scenarios"] = {name: config["scenarios"][name] for name in only}
+    # A configured timestamp authority would add network latency to every signature
+    os.environ.pop(TSA_URL_ENV, None)
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="pades-perf-") as directory:
+        fixtures = make_fixtures(directory, config)
+        for name, scenario in config["scenarios"].items():
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                metrics = pool.submit(_measure, scenario, fixtures, int(config.get("repeat", 3))).result()
+            budget = {key: scenario[key] for key in BUDGET_METRICS if key in scenario}
+            exceeded = [key for key, limit in budget.items() if metrics[BUDGET_METRICS[key]] > limit]
+            results.append({"scenario": name, **metrics, "budget": budget, "exceeded": exceeded})
+            logger.info(f"Performance budget {name}: {metrics}{' exceeded ' + str(exceeded) if exceeded else ''}")
+    return results
+
+
+## @brief Formats results as a table
+## @param results List returned by run_budgets
+## @return Table text
+def format_results(results: list[dict]) -> str:
+    lines = [f"{'scenario':<28} {'seconds':>16} {'alloc_mb':>16} {'rss_mb':>16}  result"]
+    for result in results:
+        cells = []
+        for key, metric in BUDGET_METRICS.items():
+            limit = result["budget"].get(key)
+            cell = f"{result[metric]:g}" + (f" / {limit:g}" if limit is not None else "")
+            cells.append(f"{cell:>16}")
+        status = "EXCEEDED " + ", ".join(result["exceeded"]) if result["exceeded"] else "ok"
+        lines.append(f"{result['scenario']:<28} {' '.join(cells)}  {status}")
+    return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Check memory and latency budgets of signing and verification")
+    parser.add_argument("--budgets", default=PERF_BUDGETS_PATH, help="budget file (default: perf_budgets.json)")
+    parser.add_argument("--only", nargs="+", metavar="SCENARIO", help="run only these scenarios")
+    parser.add_argument("--report", help="file the results are written to as JSON")
+    args = parser.parse_args()
+
+    budget_results = run_budgets(args.budgets, args.only)
+    print(format_results(budget_results))
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as report_file:
+            json.dump(budget_results, report_file, indent=2)
+    sys.exit(1 if any(result["exceeded"] for result in budget_results) else 0)
@@ -0,0 +1,367 @@
+## @file pkcs11_token.py
+## @brief Signing with keys kept on PKCS#11 tokens (smart cards, HSMs)
+##
+## TokenSigner signs digests on a token, so the private key never leaves it.
+## It logs in once, when it is created: PKCS#11 logins belong to the
+## application, so the further sessions it opens for concurrent signatures
+## share that login. Sessions are pooled and kept open between documents;
+## load_token_signer() caches signers, so a batch or a GUI session pays for
+## loading the module and logging in once.
+##
+## The signature formats are those of the file-based keys, so documents
+## signed on a token are verified with the token key's public key as usual:
+##  - RSA: CKM_RSA_PKCS over the DER DigestInfo of the SHA-256 digest
+##  - ECDSA P-256: CKM_ECDSA over the digest, (r, s) re-encoded as DER
+##  - Ed25519: CKM_EDDSA over the digest
+##
+## Needs the optional python-pkcs11 package and the token's PKCS#11 module
+## (named by PKCS11_MODULE_ENV). See local_token.py for a SoftHSM stand-in.
+
+import hashlib
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+from Cryptodome.PublicKey import ECC, RSA
+from Cryptodome.Util.asn1 import DerSequence
+
+from constants import LOGGER_GLOBAL_NAME, KEY_TYPE_RSA, KEY_TYPE_ECDSA_P256, KEY_TYPE_ED25519, PKCS11_MODULE_ENV, \
+    PKCS11_TOKEN_ENV, PKCS11_KEY_ENV, PKCS11_SESSION_POOL_SIZE, PKCS11_SIGNER_CACHE_SIZE
+from utility.crypto_backend import SIGNATURE_ALGORITHMS
+from utility.key_container import key_fingerprint
+from utility.signer import DocumentSigner
+
+try:
+    import pkcs11
+    from pkcs11 import Attribute, KeyType, Mechanism, ObjectClass
+    from pkcs11.exceptions import PKCS11Error, PinIncorrect, PinInvalid, PinLenRange, PinLocked, \
+        AttributeTypeInvalid, NoSuchKey, NoSuchToken, MultipleObjectsReturned
+except ImportError:
+    pkcs11 = None
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+## @brief DER prefix of the DigestInfo of a SHA-256 digest (PKCS #1 v1.5)
+_SHA256_DIGEST_INFO = bytes.fromhex("3031300d060960864801650304020105000420")
+## @brief DER encoding of the P-256 curve OID, as found in CKA_EC_PARAMS
+EC_PARAMS_P256 = bytes.fromhex("06082a8648ce3d030107")
+## @brief DER encodings of Ed25519 in CKA_EC_PARAMS: the curve OID and the PrintableString "edwards25519"
+EC_PARAMS_ED25519 = (bytes.fromhex("06032b6570"), b"\x13\x0cedwards25519")
+## @brief DER prefixes of SubjectPublicKeyInfo structures, followed by the public point
+_P256_SPKI_PREFIX = bytes.fromhex("3059301306072a8648ce3d020106082a8648ce3d030107034200")
+_ED25519_SPKI_PREFIX = bytes.fromhex("302a300506032b6570032100")
+
+_libraries = {}
+_libraries_lock = threading.Lock()
+_token_signer_cache: OrderedDict = OrderedDict()
+_token_signer_cache_lock = threading.Lock()
+_token_signer_build_lock = threading.Lock()
+## @brief Per-process salt so the signer cache never holds the PIN
+_CACHE_SALT = os.urandom(16)
+
+
+## @brief Exception raised when a token cannot be used for signing
+class TokenError(Exception):
+    pass
+
+
+## @brief Returns the PKCS#11 module configured by PKCS11_MODULE_ENV
+## @return Path to the module, or None if token signing is not configured
+def get_pkcs11_module_path() -> str | None:
+    return os.getenv(PKCS11_MODULE_ENV) or None
+
+
+## @brief Returns whether token signing is available
+## @return True if python-pkcs11 is installed and a PKCS#11 module is configured
+def token_signing_available() -> bool:
+    return pkcs11 is not None and get_pkcs11_module_path() is not None
+
+
+## @brief Loads a PKCS#11 module once per process
+## @param module_path Path to the PKCS#11 module
+## @return pkcs11.lib
+## @throws TokenError if python-pkcs11 is not installed or the module cannot be loaded
+def load_pkcs11_library(module_path: str):
+    if pkcs11 is None:
+        raise TokenError("PKCS#11 token support needs the python-pkcs11 package")
+    with _libraries_lock:
+        library, pid = _libraries.get(module_path, (None, None))
+        try:
+            if library is None:
+                library = pkcs11.lib(module_path)
+            elif pid != os.getpid():
+                # A forked child must initialize the module again before using it
+                library.reinitialize()
+        except (OSError, RuntimeError, PKCS11Error) as e:
+            raise TokenError(f"PKCS#11 module {module_path} cannot be loaded: {e}")
+        _libraries[module_path] = (library, os.getpid())
+        return library
+
+
+## @brief Unwraps a CKA_EC_POINT value, which tokens store with or without a DER OCTET STRING around it
+## @param point Attribute value
+## @param length Length of the bare point
+## @return Bare point
+def _bare_point(point: bytes, length: int) -> bytes:
+    if len(point) == length + 2 and point[0] == 0x04 and point[1] == length:
+        return point[2:]
+    return point
+
+
+## @brief Converts a token public key into a pycryptodomex key
+## @param public_key pkcs11 public key object
+## @return Tuple (key type, pycryptodomex public key)
+## @throws TokenError if the key type is not supported
+def _import_public_key(public_key) -> tuple[str, object]:
+    key_type = public_key.key_type
+    if key_type == KeyType.RSA:
+        modulus = int.from_bytes(public_key[Attribute.MODULUS], "big")
+        exponent = int.from_bytes(public_key[Attribute.PUBLIC_EXPONENT], "big")
+        return KEY_TYPE_RSA, RSA.construct((modulus, exponent))
+    params = public_key[Attribute.EC_PARAMS]
+    if key_type == KeyType.EC and params == EC_PARAMS_P256:
+        point = _bare_point(public_key[Attribute.EC_POINT], 65)
+        return KEY_TYPE_ECDSA_P256, ECC.import_key(_P256_SPKI_PREFIX + point)
+    if key_type == KeyType.EC_EDWARDS and params in EC_PARAMS_ED25519:
+        point = _bare_point(public_key[Attribute.EC_POINT], 32)
+        return KEY_TYPE_ED25519, ECC.import_key(_ED25519_SPKI_PREFIX + point)
+    raise TokenError(f"Unsupported token key type: {key_type.name} ({params.hex()})")
+
+
+## @brief Signer using a private key kept on a PKCS#11 token
+##
+## Usable wherever a DocumentSigner is; sign() may be called by several
+## threads at once, each signature running on its own pooled session.
+class TokenSigner(DocumentSigner):
+    ## @brief Logs in to the token and finds the key
+    ## @param token_label Label of the token
+    ## @param pin User PIN of the token
+    ## @param key_label Label of the private key, None if the token holds a single private key
+    ## @param module_path Path to the PKCS#11 module, defaults to the one named by PKCS11_MODULE_ENV
+    ## @param sessions Maximum number of sessions opened for concurrent signatures
+    ## @throws TokenError if the token, the key or a signing mechanism for it cannot be found
+    ## @throws DecryptionError if the PIN is incorrect
+    def __init__(self, token_label: str, pin: str, key_label: str | None = None, module_path: str | None = None,
+                 sessions: int = PKCS11_SESSION_POOL_SIZE):
+        from utility.pdf_sign import DecryptionError
+
+        module_path = module_path or get_pkcs11_module_path()
+        if not module_path:
+            raise TokenError(f"No PKCS#11 module configured (set {PKCS11_MODULE_ENV})")
+        library = load_pkcs11_library(module_path)
+        try:
+            self._token = library.get_token(token_label=token_label)
+        except NoSuchToken:
+            raise TokenError(f"Token not found: {token_label}")
+        self.token_label = token_label
+        self.key_label = key_label
+        ## @brief No private key object: the key stays on the token
+        self.private_key = None
+
+        try:
+            login_session = self._token.open(user_pin=pin)
+        except (PinIncorrect, PinInvalid, PinLenRange):
+            raise DecryptionError
+        except PinLocked:
+            raise TokenError(f"The PIN of token {token_label} is locked")
+        try:
+            private_key = self._find_key(login_session, ObjectClass.PRIVATE_KEY)
+            self.key_type, self._public_key = _import_public_key(self._find_key(login_session, ObjectClass.PUBLIC_KEY))
+            try:
+                # Keys demanding the PIN for every signature cannot share one login
+                self._always_authenticate = bool(private_key[Attribute.ALWAYS_AUTHENTICATE])
+            except AttributeTypeInvalid:
+                self._always_authenticate = False
+        except BaseException:
+            login_session.close()
+            raise
+        mechanism = {KEY_TYPE_RSA: Mechanism.RSA_PKCS, KEY_TYPE_ECDSA_P256: Mechanism.ECDSA,
+                     KEY_TYPE_ED25519: Mechanism.EDDSA}[self.key_type]
+        if mechanism not in self._token.slot.get_mechanisms():
+            login_session.close()
+            raise TokenError(f"Token {token_label} does not support {mechanism.name} for {self.key_type} keys")
+        self._sign_options = {"mechanism": mechanism}
+        if self._always_authenticate:
+            self._sign_options["pin"] = pin
+        self.algorithm = SIGNATURE_ALGORITHMS[self.key_type]
+        self.fingerprint = key_fingerprint(self._public_key).hex()
+
+        self._max_sessions = max(1, sessions)
+        self._login_session = login_session
+        self._sessions = [login_session]
+        self._idle = queue.LifoQueue()
+        self._idle.put((login_session, private_key))
+        self._sessions_lock = threading.Lock()
+        self._closed = False
+        logger.info(f"Token signer ready: token {token_label}, key {key_label or '(single key)'}, {self.algorithm}")
+
+    ## @brief Returns the public key matching the token's private key
+    ## @return pycryptodomex public key
+    def public_key(self):
+        return self._public_key
+
+    ## @brief Signs a SHA-256 digest on the token
+    ## @param digest SHA-256 digest of the document
+    ## @return Signature bytes
+    ## @throws TokenError if the token fails to sign
+    def sign(self, digest: bytes) -> bytes:
+        session, private_key = self._acquire()
+        try:
+            if self.key_type == KEY_TYPE_RSA:
+                return private_key.sign(_SHA256_DIGEST_INFO + digest, **self._sign_options)
+            signature = private_key.sign(digest, **self._sign_options)
+            if self.key_type == KEY_TYPE_ECDSA_P256:
+                half = len(signature) // 2
+                signature = DerSequence([int.from_bytes(signature[:half], "big"),
+                                         int.from_bytes(signature[half:], "big")]).encode()
+            return signature
+        except PKCS11Error as e:
+            # The session may be unusable (token removed, session closed by the module)
+            self._drop(session)
+            session = None
+            raise TokenError(f"Token {self.token_label} failed to sign: {type(e).__name__} {e}")
+        finally:
+            if session is not None:
+                self._idle.put((session, private_key))
+
+    ## @brief Closes the sessions, logging out of the token
+    ## @return None
+    def close(self) -> None:
+        with self._sessions_lock:
+            if self._closed:
+                return
+            self._closed = True
+            sessions, self._sessions = self._sessions, []
+        # Closing the login session logs every session out, so it goes last
+        for session in sorted(sessions, key=lambda s: s is self._login_session):
+            try:
+                session.close()
+            except PKCS11Error as e:
+                logger.warning(f"Closing a session of token {self.token_label} failed: {e}")
+
+    ## @brief Takes an idle session, opening another one if all are busy and the pool is not full
+    ## @return Tuple (session, private key object of that session)
+    def _acquire(self) -> tuple:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._sessions_lock:
+            if self._closed:
+                raise TokenError(f"Token signer of {self.token_label} is closed")
+            opened = len(self._sessions) < self._max_sessions
+            if opened:
+                # Shares the login of the first session
+                session = self._token.open()
+                self._sessions.append(session)
+        if opened:
+            try:
+                return session, self._find_key(session, ObjectClass.PRIVATE_KEY)
+            except BaseException:
+                # The session never reaches the idle queue, so it must not count against the pool
+                self._drop(session)
+                raise
+        return self._idle.get()
+
+    ## @brief Removes a failed session from the pool
+    ## @param session Session to close
+    def _drop(self, session) -> None:
+        with self._sessions_lock:
+            if session in self._sessions:
+                self._sessions.remove(session)
+        # A failed login session stays open: closing it would log the other sessions out
+        if session is not self._login_session:
+            try:
+                session.close()
+            except PKCS11Error:
+                pass
+
+    ## @brief Finds the signing key (or its public key) in a session
+    ## @param session pkcs11 session
+    ## @param object_class ObjectClass.PRIVATE_KEY or ObjectClass.PUBLIC_KEY
+    ## @return pkcs11 key object
+    ## @throws TokenError if there is no such key or the label is ambiguous
+    def _find_key(self, session, object_class):
+        try:
+            return session.get_key(object_class=object_class, label=self.key_label)
+        except NoSuchKey:
+            kind = "private key" if object_class == ObjectClass.PRIVATE_KEY else "public key"
+            label = f" {self.key_label}" if self.key_label else ""
+            raise TokenError(f"No {kind}{label} on token {self.token_label}")
+        except MultipleObjectsReturned:
+            raise TokenError(f"Several keys match on token {self.token_label}, select one by its label")
+
+
+## @brief Returns a cached signer for a key on a token
+##
+## Signers are cached by module, token, key label and PIN, so their sessions
+## and login are reused by every document signed with the same key.
+## @param token_label Label of the token, defaults to the one named by PKCS11_TOKEN_ENV
+## @param pin User PIN of the token
+## @param key_label Label of the private key, defaults to the one named by PKCS11_KEY_ENV
+## @param module_path Path to the PKCS#11 module, defaults to the one named by PKCS11_MODULE_ENV
+## @return TokenSigner
+## @throws TokenError if the token cannot be used
+## @throws DecryptionError if the PIN is incorrect
+def load_token_signer(token_label: str | None, pin: str, key_label: str | None = None,
+                      module_path: str | None = None) -> TokenSigner:
+    token_label = token_label or os.getenv(PKCS11_TOKEN_ENV)
+    if not token_label:
+        raise TokenError(f"No token selected (set {PKCS11_TOKEN_ENV})")
+    key_label = key_label or os.getenv(PKCS11_KEY_ENV) or None
+    module_path = module_path or get_pkcs11_module_path()
+    cache_key = (module_path, token_label, key_label, hashlib.sha256(_CACHE_SALT + pin.encode()).digest())
+    with _token_signer_cache_lock:
+        signer = _token_signer_cache.get(cache_key)
+        if signer is not None:
+            _token_signer_cache.move_to_end(cache_key)
+            return signer
+
+    # One signer is built at a time: the login belongs to the whole process, so a
+    # second signer for the same token could neither log in nor be closed without
+    # logging the first one out
+    with _token_signer_build_lock:
+        with _token_signer_cache_lock:
+            signer = _token_signer_cache.get(cache_key)
+            if signer is not None:
+                # Built by another thread while this one waited
+                _token_signer_cache.move_to_end(cache_key)
+                return signer
+        signer = TokenSigner(token_label, pin, key_label, module_path)
+        evicted = []
+        with _token_signer_cache_lock:
+            _token_signer_cache[cache_key] = signer
+            while len(_token_signer_cache) > PKCS11_SIGNER_CACHE_SIZE:
+                evicted.append(_token_signer_cache.popitem(last=False)[1])
+    for old_signer in evicted:
+        old_signer.close()
+    return signer
+
+
+## @brief Closes all cached token signers
+## @return None
+def close_token_signers() -> None:
+    with _token_signer_cache_lock:
+        signers = list(_token_signer_cache.values())
+        _token_signer_cache.clear()
+    for signer in signers:
+        signer.close()
+
+
+## @brief Forgets the token signers inherited through fork
+##
+## PKCS#11 sessions must not be used in a forked child, nor closed there (that
+## would log the parent out), so the child only drops its references. Loaded
+## modules are initialized again on their first use in the child.
+def _reset_after_fork() -> None:
+    global _token_signer_cache, _token_signer_cache_lock, _token_signer_build_lock, _libraries_lock
+    _token_signer_cache = OrderedDict()
+    _token_signer_cache_lock = threading.Lock()
+    _token_signer_build_lock = threading.Lock()
+    _libraries_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
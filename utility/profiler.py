@@ -0,0 +1,169 @@
+## @file profiler.py
+## @brief On-demand sampling profiler for signing and verification jobs
+##
+## When profiling is on (PROFILER_ENV set to a non-empty value other than "0",
+## or switched on at runtime from the GUI), every job runs under a sampling
+## profiler: a daemon thread reads the job thread's stack every
+## PROFILER_SAMPLE_INTERVAL seconds, so the job itself is not instrumented
+## and its overhead stays low. Each job writes two files to PROFILES_DIR_PATH:
+##  - <time>_<job>.collapsed   one "frame;frame;frame count" line per stack,
+##                             ready for flamegraph.pl or speedscope
+##  - <time>_<job>.phases.txt  wall and CPU time of each phase of the job
+##
+## Phases are marked with phase(); outside a profiled job it does nothing.
+
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+from constants import LOGGER_GLOBAL_NAME, PROFILER_ENV, PROFILER_SAMPLE_INTERVAL, PROFILES_DIR_PATH
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+_enabled_override = None
+_active = threading.local()
+
+
+## @brief Returns whether jobs are profiled
+## @return True if switched on at runtime, or by PROFILER_ENV when not switched at runtime
+def profiling_enabled() -> bool:
+    if _enabled_override is not None:
+        return _enabled_override
+    return os.getenv(PROFILER_ENV, "") not in ("", "0")
+
+
+## @brief Switches profiling on or off at runtime, overriding PROFILER_ENV
+## @param enabled True to profile the following jobs
+def set_profiling_enabled(enabled: bool) -> None:
+    global _enabled_override
+    _enabled_override = enabled
+    logger.info(f"Profiling {'enabled' if enabled else 'disabled'}, output in {PROFILES_DIR_PATH}")
+
+
+## @brief Formats a frame for a collapsed stack line
+## @param frame Python frame
+## @return "function (file:line)"
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+## @brief Sampling profiler of one thread
+class SamplingProfiler:
+    ## @brief Creates the (not yet started) profiler
+    ## @param name Job name used in the output file names
+    ## @param thread_id Identifier of the thread to sample, defaults to the calling thread
+    ## @param interval Seconds between samples
+    def __init__(self, name: str, thread_id: int | None = None, interval: float = PROFILER_SAMPLE_INTERVAL):
+        self.name = name
+        self.thread_id = threading.get_ident() if thread_id is None else thread_id
+        self.interval = interval
+        self.stacks: Counter[str] = Counter()
+        ## @brief List of (phase name, wall seconds, CPU seconds)
+        self.phases: list[tuple[str, float, float]] = []
+        self._phase = None
+        self._stop = threading.Event()
+        self._sampler = None
+        self._started_at = None
+        self._wall_start = 0.0
+        self._cpu_start = 0.0
+
+    ## @brief Starts sampling
+    def start(self) -> None:
+        self._started_at = datetime.now()
+        self._wall_start = time.perf_counter()
+        self._cpu_start = time.thread_time() if self.thread_id == threading.get_ident() else 0.0
+        self._sampler = threading.Thread(target=self._sample_loop, name=f"profiler-{self.name}", daemon=True)
+        self._sampler.start()
+
+    ## @brief Stops sampling and writes the output files
+    ## @return Path to the collapsed stack file
+    def stop(self) -> str:
+        wall = time.perf_counter() - self._wall_start
+        cpu = time.thread_time() - self._cpu_start if self.thread_id == threading.get_ident() else 0.0
+        self._stop.set()
+        self._sampler.join()
+        self.phases.append(("total", wall, cpu))
+        return self._write()
+
+    ## @brief Measures a phase of the job; samples taken meanwhile are rooted at the phase name
+    ##
+    ## Must be called on the profiled thread, which is where its CPU time is measured.
+    ## @param name Phase name
+    @contextmanager
+    def phase(self, name: str):
+        outer = self._phase
+        self._phase = name if outer is None else f"{outer};{name}"
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield
+        finally:
+            self.phases.append((self._phase, time.perf_counter() - wall_start, time.thread_time() - cpu_start))
+            self._phase = outer
+
+    ## @brief Sampler thread loop
+    def _sample_loop(self) -> None:
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.reverse()
+            phase = self._phase
+            root = [self.name] if phase is None else [self.name, phase]
+            self.stacks[";".join(root + labels)] += 1
+
+    ## @brief Writes the collapsed stacks and the phase splits
+    ## @return Path to the collapsed stack file
+    def _write(self) -> str:
+        os.makedirs(PROFILES_DIR_PATH, exist_ok=True)
+        base = os.path.join(PROFILES_DIR_PATH, f"{self._started_at.strftime('%Y_%m_%d_%H_%M_%S_%f')}_{self.name}")
+        with open(f"{base}.collapsed", "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(f"{base}.phases.txt", "w", encoding="utf-8") as f:
+            f.write(f"# {self.name}: {sum(self.stacks.values())} samples every {self.interval * 1000:g} ms\n")
+            f.write(f"{'phase':<40} {'wall_s':>10} {'cpu_s':>10}\n")
+            for name, wall, cpu in self.phases:
+                f.write(f"{name:<40} {wall:>10.4f} {cpu:>10.4f}\n")
+        logger.info(f"Profile of {self.name} written to {base}.collapsed")
+        return f"{base}.collapsed"
+
+
+## @brief Runs a job under the sampling profiler if profiling is enabled
+##
+## Phases marked with phase() on the same thread are recorded in the job's profile.
+## @param name Job name used in the output file names
+## @return Context manager yielding the SamplingProfiler, or None when profiling is off
+@contextmanager
+def profile_job(name: str):
+    if not profiling_enabled() or getattr(_active, "profiler", None) is not None:
+        yield None
+        return
+    profiler = SamplingProfiler(name)
+    profiler.start()
+    _active.profiler = profiler
+    try:
+        yield profiler
+    finally:
+        _active.profiler = None
+        try:
+            profiler.stop()
+        except OSError as e:
+            logger.error(f"Writing the profile of {name} failed: {e}")
+
+
+## @brief Marks a phase of the job profiled on the calling thread
+## @param name Phase name
+## @return Context manager; does nothing outside a profiled job
+def phase(name: str):
+    profiler = getattr(_active, "profiler", None)
+    return nullcontext() if profiler is None else profiler.phase(name)
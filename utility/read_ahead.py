@@ -0,0 +1,85 @@
+## @file read_ahead.py
+## @brief Double-buffered read-ahead for hashing and copying byte ranges
+##
+## A reader thread fills a small ring of reusable buffers with readinto()
+## while the calling thread consumes the previous ones. hashlib releases the
+## GIL while hashing large buffers and file reads release it while waiting
+## for the disk, so reading and hashing overlap and throughput reaches
+## whichever of the two is slower.
+
+import queue
+import threading
+
+from constants import DIGEST_CHUNK_SIZE, READ_AHEAD_BUFFERS
+
+
+## @brief Feeds a byte range of a stream to a consumer, reading ahead on a background thread
+##
+## The consumer receives memoryviews into reused buffers; it must not keep
+## them after returning.
+## @param stream Seekable binary stream, read from its current position
+## @param length Number of bytes to read, None to read until the end of the stream
+## @param consume Callable receiving each chunk as a memoryview
+## @param progress Optional callback receiving the completed percentage (0-100) whenever it changes
+## @param chunk_size Size of each buffer
+## @param buffers Number of buffers in flight
+## @return Number of bytes consumed (less than @p length if the stream ended early)
+def read_ahead(stream, length: int | None, consume, progress=None, chunk_size: int = DIGEST_CHUNK_SIZE,
+               buffers: int = READ_AHEAD_BUFFERS) -> int:
+    if length is None:
+        start = stream.tell()
+        total = stream.seek(0, 2) - start
+        stream.seek(start)
+    else:
+        total = length
+    if total <= 0:
+        return 0
+
+    free = queue.Queue()
+    for _ in range(max(1, buffers)):
+        free.put(bytearray(chunk_size))
+    filled = queue.Queue()
+    stopped = threading.Event()
+
+    def reader():
+        remaining = total
+        try:
+            while remaining > 0 and not stopped.is_set():
+                buffer = free.get()
+                if stopped.is_set():
+                    break
+                count = stream.readinto(memoryview(buffer)[:min(chunk_size, remaining)])
+                if not count:
+                    break
+                remaining -= count
+                filled.put((buffer, count))
+        except BaseException as e:
+            filled.put((None, e))
+            return
+        filled.put((None, None))
+
+    thread = threading.Thread(target=reader, name="read-ahead", daemon=True)
+    thread.start()
+    consumed = 0
+    last_percent = -1
+    try:
+        while True:
+            buffer, count = filled.get()
+            if buffer is None:
+                if count is not None:
+                    raise count
+                break
+            consume(memoryview(buffer)[:count])
+            consumed += count
+            free.put(buffer)
+            if progress is not None:
+                percent = consumed * 100 // total
+                if percent != last_percent:
+                    last_percent = percent
+                    progress(percent)
+    finally:
+        stopped.set()
+        # Wake the reader if it waits for a free buffer
+        free.put(bytearray(0))
+        thread.join()
+    return consumed
@@ -0,0 +1,216 @@
+## @file signature_registry.py
+## @brief Registry of signed documents
+##
+## Signatures made by sign_pdf_file can be recorded in an embedded SQLite
+## database: the SHA-256 of the original document, the signed digest and its
+## profile, the signer's public key fingerprint, the time of signing and the
+## output file. Indexes on the document hash and on the signer make "was this
+## document signed, by whom, when" a single index lookup.
+##
+## sign_pdf_file records in the registry at SIGNATURE_REGISTRY_PATH when
+## SIGNATURE_REGISTRY_ENV is set to a non-empty value other than "0", or in
+## a SignatureRegistry passed to it.
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import NamedTuple
+
+from PyPDF2 import PdfReader
+
+from constants import SIGNATURE_REGISTRY_PATH, SIGNATURE_REGISTRY_ENV, DIGEST_CHUNK_SIZE
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS signatures (
+    id INTEGER PRIMARY KEY,
+    document_sha256 TEXT NOT NULL,
+    signed_digest TEXT NOT NULL,
+    digest_profile TEXT NOT NULL,
+    signer_fingerprint TEXT NOT NULL,
+    signature_algorithm TEXT NOT NULL,
+    signed_at REAL NOT NULL,
+    input_path TEXT NOT NULL,
+    output_path TEXT NOT NULL,
+    output_size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS signatures_document ON signatures (document_sha256);
+CREATE INDEX IF NOT EXISTS signatures_signer ON signatures (signer_fingerprint, signed_at);
+"""
+
+_COLUMNS = ("id, document_sha256, signed_digest, digest_profile, signer_fingerprint, signature_algorithm, "
+            "signed_at, input_path, output_path, output_size")
+
+_default_registry = None
+_default_registry_lock = threading.Lock()
+
+
+## @brief One recorded signature
+class SignatureRecord(NamedTuple):
+    ## @brief Row id
+    id: int
+    ## @brief SHA-256 of the original (unsigned) document, hex
+    document_sha256: str
+    ## @brief Digest that was signed, hex
+    signed_digest: str
+    ## @brief Digest profile of the signature
+    digest_profile: str
+    ## @brief SHA-256 fingerprint of the signer's public key, hex
+    signer_fingerprint: str
+    ## @brief Signature algorithm
+    signature_algorithm: str
+    ## @brief Time of signing (seconds since the epoch)
+    signed_at: float
+    ## @brief Path to the original document
+    input_path: str
+    ## @brief Path to the signed document
+    output_path: str
+    ## @brief Size of the signed document in bytes
+    output_size: int
+
+
+## @brief Computes the hash a document is registered under
+##
+## For a signed document only the signed original part (/SignedLength bytes)
+## is hashed, so a signed file and its original map to the same entry.
+## @param filepath Path to an original or signed PDF file
+## @return SHA-256 of the original document, hex
+def document_hash(filepath: str) -> str:
+    with open(filepath, "rb") as f:
+        length = None
+        try:
+            metadata = PdfReader(f).metadata
+            if metadata is not None and "/SignedLength" in metadata:
+                length = int(metadata["/SignedLength"])
+        except Exception:
+            pass
+        f.seek(0)
+        hash_obj = hashlib.sha256()
+        remaining = length
+        while remaining is None or remaining > 0:
+            chunk = f.read(DIGEST_CHUNK_SIZE if remaining is None else min(DIGEST_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            hash_obj.update(chunk)
+            if remaining is not None:
+                remaining -= len(chunk)
+    return hash_obj.hexdigest()
+
+
+## @brief SQLite backed registry of signed documents
+##
+## One connection is shared by all threads and serialized with a lock; the
+## database runs in WAL mode so readers in other processes are not blocked.
+class SignatureRegistry:
+    ## @brief Opens (and creates if needed) the registry database
+    ## @param db_path Path to the database file
+    def __init__(self, db_path: str = SIGNATURE_REGISTRY_PATH):
+        self.db_path = db_path
+        if db_path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._connection = sqlite3.connect(db_path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(_SCHEMA)
+
+    ## @brief Records a signature
+    ## @param document_sha256 SHA-256 of the original document, hex
+    ## @param signed_digest Digest that was signed, hex
+    ## @param digest_profile Digest profile of the signature
+    ## @param signer_fingerprint SHA-256 fingerprint of the signer's public key, hex
+    ## @param signature_algorithm Signature algorithm
+    ## @param input_path Path to the original document
+    ## @param output_path Path to the signed document
+    ## @param output_size Size of the signed document in bytes
+    ## @param signed_at Time of signing, defaults to now
+    ## @return Row id of the new record
+    def record(self, document_sha256: str, signed_digest: str, digest_profile: str, signer_fingerprint: str,
+               signature_algorithm: str, input_path: str, output_path: str, output_size: int,
+               signed_at: float | None = None) -> int:
+        row = (document_sha256, signed_digest, digest_profile, signer_fingerprint, signature_algorithm,
+               time.time() if signed_at is None else signed_at, os.path.abspath(input_path),
+               os.path.abspath(output_path), output_size)
+        with self._lock, self._connection:
+            cursor = self._connection.execute(
+                "INSERT INTO signatures (document_sha256, signed_digest, digest_profile, signer_fingerprint, "
+                "signature_algorithm, signed_at, input_path, output_path, output_size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+            return cursor.lastrowid
+
+    ## @brief Returns every signature of a document
+    ## @param document_sha256 SHA-256 of the original document, hex
+    ## @return List of SignatureRecord, oldest first
+    def find_by_document(self, document_sha256: str) -> list[SignatureRecord]:
+        return self._query(f"SELECT {_COLUMNS} FROM signatures WHERE document_sha256 = ? ORDER BY signed_at",
+                           (document_sha256,))
+
+    ## @brief Returns every signature of the document stored in a file
+    ## @param filepath Path to an original or signed PDF file
+    ## @return List of SignatureRecord, oldest first
+    def find_by_file(self, filepath: str) -> list[SignatureRecord]:
+        return self.find_by_document(document_hash(filepath))
+
+    ## @brief Returns the signatures made with a key
+    ## @param signer_fingerprint SHA-256 fingerprint of the signer's public key, hex
+    ## @param since Optional start of the time range (seconds since the epoch)
+    ## @param until Optional end of the time range (seconds since the epoch, exclusive)
+    ## @param limit Optional maximum number of records
+    ## @return List of SignatureRecord, oldest first
+    def find_by_signer(self, signer_fingerprint: str, since: float | None = None, until: float | None = None,
+                       limit: int | None = None) -> list[SignatureRecord]:
+        sql = f"SELECT {_COLUMNS} FROM signatures WHERE signer_fingerprint = ? AND signed_at >= ? AND signed_at < ? " \
+              f"ORDER BY signed_at LIMIT ?"
+        return self._query(sql, (signer_fingerprint, float("-inf") if since is None else since,
+                                 float("inf") if until is None else until, -1 if limit is None else limit))
+
+    ## @brief Counts the signatures made with a key
+    ## @param signer_fingerprint SHA-256 fingerprint of the signer's public key, hex
+    ## @return Number of signatures
+    def count_by_signer(self, signer_fingerprint: str) -> int:
+        with self._lock:
+            return self._connection.execute(
+                "SELECT COUNT(*) FROM signatures WHERE signer_fingerprint = ?", (signer_fingerprint,)).fetchone()[0]
+
+    ## @brief Closes the database
+    ## @return None
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    ## @brief Runs a query returning signature records
+    def _query(self, sql: str, parameters: tuple) -> list[SignatureRecord]:
+        with self._lock:
+            rows = self._connection.execute(sql, parameters).fetchall()
+        return [SignatureRecord(*row) for row in rows]
+
+
+## @brief Returns whether signatures are recorded in the default registry
+## @return True if SIGNATURE_REGISTRY_ENV is set to a non-empty value other than "0"
+def signature_registry_enabled() -> bool:
+    return os.getenv(SIGNATURE_REGISTRY_ENV, "") not in ("", "0")
+
+
+## @brief Returns the registry at SIGNATURE_REGISTRY_PATH, opening it on first use
+## @return SignatureRegistry
+def get_default_registry() -> SignatureRegistry:
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = SignatureRegistry()
+        return _default_registry
+
+
+## @brief Drops the inherited default registry in a forked child
+##
+## SQLite connections must not be used across fork(); the child opens its own on first use.
+def _reset_after_fork() -> None:
+    global _default_registry, _default_registry_lock
+    _default_registry = None
+    _default_registry_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
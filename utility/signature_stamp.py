@@ -0,0 +1,342 @@
+## @file signature_stamp.py
+## @brief Visible signature stamps with appearances shared across a batch
+##
+## A stamp is a Stamp annotation on the last page of a document showing a
+## logo, the signer's key fingerprint, the signing date and the signature
+## algorithm. It is added as an incremental update before the document is
+## signed, so the signature covers it.
+##
+## Everything the stamp draws only depends on the signer, the day and the
+## logo, so its objects (the form XObject holding the drawing, the logo image
+## with its soft mask and the font) are built and serialized once per signer
+## and day and kept in an LRU cache. Stamping a document only renumbers those
+## bytes and writes the per-document objects: the annotation and the last
+## page (or its /Annots array). A batch thus decodes the logo and compresses
+## the drawing once instead of once per document.
+##
+## The text uses the standard Helvetica font, which every viewer provides, so
+## no font program has to be embedded.
+
+import logging
+import math
+import os
+import shutil
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+from datetime import date
+
+from PyPDF2 import PdfReader
+from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, NameObject
+
+from constants import LOGGER_GLOBAL_NAME, DIGEST_CHUNK_SIZE, STAMP_WIDTH, STAMP_HEIGHT, STAMP_MARGIN, STAMP_FONT, \
+    STAMP_FONT_SIZE, STAMP_LOGO_MAX_PIXELS, STAMP_CACHE_SIZE, STAMP_LOGO_PATH
+from utility.digest_profiles import get_page_count, iter_pages
+from utility.pdf_incremental import find_startxref, next_object_number, serialize_object, write_objects_update
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+## @brief PNG file signature
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+## @brief Samples per pixel of the supported PNG color types (grayscale, RGB, grayscale + alpha, RGBA)
+_PNG_CHANNELS = {0: 1, 2: 3, 4: 2, 6: 4}
+## @brief Annotation flags of the stamp: Print and Locked
+_STAMP_FLAGS = 4 | 128
+## @brief Padding between the stamp border and its content in points
+_PADDING = 6
+
+_appearance_cache: OrderedDict = OrderedDict()
+_appearance_cache_lock = threading.Lock()
+
+
+## @brief Reverses the filter of one PNG scanline in place
+## @param filter_type PNG filter type (0-4)
+## @param row Filtered scanline, replaced by the reconstructed one
+## @param previous Reconstructed previous scanline (zeros for the first one)
+## @param bpp Bytes per pixel
+def _unfilter(filter_type: int, row: bytearray, previous: bytearray, bpp: int) -> None:
+    if filter_type == 0:
+        return
+    if filter_type == 2:
+        for i in range(len(row)):
+            row[i] = (row[i] + previous[i]) & 0xFF
+        return
+    for i in range(len(row)):
+        left = row[i - bpp] if i >= bpp else 0
+        if filter_type == 1:
+            predictor = left
+        elif filter_type == 3:
+            predictor = (left + previous[i]) >> 1
+        elif filter_type == 4:
+            up = previous[i]
+            upper_left = previous[i - bpp] if i >= bpp else 0
+            estimate = left + up - upper_left
+            distance_left, distance_up, distance_upper_left = \
+                abs(estimate - left), abs(estimate - up), abs(estimate - upper_left)
+            if distance_left <= distance_up and distance_left <= distance_upper_left:
+                predictor = left
+            elif distance_up <= distance_upper_left:
+                predictor = up
+            else:
+                predictor = upper_left
+        else:
+            raise ValueError(f"unknown PNG filter type {filter_type}")
+        row[i] = (row[i] + predictor) & 0xFF
+
+
+## @brief Reads an 8-bit, non-interlaced PNG image and scales it down to fit a square
+## @param filepath Path to the PNG file
+## @param max_pixels Maximum width and height of the result
+## @return Tuple (width, height, channels, pixel bytes)
+## @throws ValueError if the file is not a PNG image of a supported kind
+def _read_png(filepath: str, max_pixels: int) -> tuple[int, int, int, bytes]:
+    with open(filepath, "rb") as f:
+        data = f.read()
+    if not data.startswith(_PNG_SIGNATURE):
+        raise ValueError("not a PNG file")
+    header = None
+    compressed = []
+    position = len(_PNG_SIGNATURE)
+    while position + 8 <= len(data):
+        length, kind = struct.unpack(">I4s", data[position:position + 8])
+        body = data[position + 8:position + 8 + length]
+        position += length + 12
+        if kind == b"IHDR":
+            header = struct.unpack(">IIBBBBB", body)
+        elif kind == b"IDAT":
+            compressed.append(body)
+        elif kind == b"IEND":
+            break
+    if header is None:
+        raise ValueError("PNG header missing")
+    width, height, bit_depth, color_type, _, _, interlace = header
+    channels = _PNG_CHANNELS.get(color_type)
+    if bit_depth != 8 or channels is None or interlace:
+        raise ValueError(f"unsupported PNG format (bit depth {bit_depth}, color type {color_type}, "
+                         f"interlace {interlace})")
+
+    raw = zlib.decompress(b"".join(compressed))
+    stride = width * channels
+    if len(raw) < height * (stride + 1):
+        raise ValueError("PNG image data truncated")
+    # Nearest-neighbour downscaling keeps every step-th pixel of every step-th row
+    step = max(1, math.ceil(max(width, height) / max_pixels))
+    scaled_width = math.ceil(width / step)
+    pixels = bytearray()
+    previous = bytearray(stride)
+    for y in range(height):
+        offset = y * (stride + 1)
+        row = bytearray(raw[offset + 1:offset + 1 + stride])
+        _unfilter(raw[offset], row, previous, channels)
+        previous = row
+        if y % step == 0:
+            if step == 1:
+                pixels += row
+            else:
+                scaled = bytearray(scaled_width * channels)
+                for channel in range(channels):
+                    scaled[channel::channels] = row[channel::step * channels]
+                pixels += scaled
+    return scaled_width, math.ceil(height / step), channels, bytes(pixels)
+
+
+## @brief Escapes text for a PDF literal string
+## @param text Text (Latin-1 characters)
+## @return Escaped bytes, without the enclosing parentheses
+def _pdf_string(text: str) -> bytes:
+    return text.encode("latin-1", "replace").replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+
+## @brief Objects drawing the stamp of one signer on one day, serialized once
+##
+## The objects are kept as (dictionary template, stream data) pairs; the
+## templates refer to each other as {0}, {1}, ... (their positions in the
+## list) and are given object numbers by render().
+class StampAppearance:
+    ## @brief Builds the appearance
+    ## @param signer DocumentSigner the stamp names
+    ## @param day Signing date shown on the stamp
+    ## @param logo_filepath Path to the PNG logo, or None for a stamp without a logo
+    def __init__(self, signer, day: date, logo_filepath: str | None = STAMP_LOGO_PATH):
+        self.width = STAMP_WIDTH
+        self.height = STAMP_HEIGHT
+        ## @brief Text lines drawn on the stamp
+        self.lines = [
+            "Digitally signed",
+            "Key: " + " ".join(signer.fingerprint[i:i + 4] for i in range(0, 16, 4)).upper(),
+            f"Date: {day.isoformat()}",
+            f"Algorithm: {signer.algorithm}",
+        ]
+        self._objects = [(f"<</Type /Font /Subtype /Type1 /BaseFont /{STAMP_FONT} /Encoding /WinAnsiEncoding>>",
+                          None)]
+        resources = "/Font <</F1 {0} 0 R>>"
+        text_left = _PADDING
+        drawing = [b"q 0.16 0.29 0.55 RG 0.75 w",
+                   f"0.5 0.5 {self.width - 1} {self.height - 1} re S".encode()]
+
+        logo = self._load_logo(logo_filepath)
+        if logo is not None:
+            width, height, channels, pixels = logo
+            color_space = "/DeviceRGB" if channels >= 3 else "/DeviceGray"
+            color_channels = 3 if channels >= 3 else 1
+            mask = ""
+            if channels in (2, 4):
+                # PDF images carry no alpha: it becomes a separate soft mask image
+                color = bytearray(width * height * color_channels)
+                for channel in range(color_channels):
+                    color[channel::color_channels] = pixels[channel::channels]
+                self._objects.append(self._image(width, height, "/DeviceGray", pixels[channels - 1::channels]))
+                mask = f" /SMask {{{len(self._objects) - 1}}} 0 R"
+                pixels = bytes(color)
+            header, data = self._image(width, height, color_space, pixels)
+            self._objects.append((header[:-2] + mask + ">>", data))
+            resources += f" /XObject <</Im1 {{{len(self._objects) - 1}}} 0 R>>"
+            size = self.height - 2 * _PADDING
+            scale = size / max(width, height)
+            drawing.append(f"q {width * scale:.2f} 0 0 {height * scale:.2f} {_PADDING} {_PADDING} cm /Im1 Do Q"
+                           .encode())
+            text_left += size + _PADDING
+
+        leading = (self.height - 2 * _PADDING) / len(self.lines)
+        drawing.append(f"BT /F1 {STAMP_FONT_SIZE} Tf 0 g {leading:.2f} TL "
+                       f"{text_left} {self.height - _PADDING - leading + 2:.2f} Td".encode())
+        for index, line in enumerate(self.lines):
+            drawing.append((b"T* " if index else b"") + b"(" + _pdf_string(line) + b") Tj")
+        drawing.append(b"ET Q")
+        content = zlib.compress(b"\n".join(drawing), 9)
+        self._objects.append((f"<</Type /XObject /Subtype /Form /BBox [0 0 {self.width} {self.height}] "
+                              f"/Resources <<{resources}>> /Filter /FlateDecode /Length {len(content)}>>", content))
+        ## @brief Position of the form XObject in the object list
+        self.form_index = len(self._objects) - 1
+
+    ## @brief Number of objects render() returns
+    def __len__(self) -> int:
+        return len(self._objects)
+
+    ## @brief Serializes the objects with consecutive object numbers
+    ## @param first Object number of the first object
+    ## @return Dictionary object number -> serialized object
+    def render(self, first: int) -> dict:
+        numbers = range(first, first + len(self._objects))
+        objects = {}
+        for number, (header, data) in zip(numbers, self._objects):
+            serialized = header.format(*numbers).encode()
+            if data is not None:
+                serialized += b"\nstream\n" + data + b"\nendstream"
+            objects[number] = serialized
+        return objects
+
+    ## @brief Serializes an image XObject
+    ## @return Tuple (dictionary template, compressed pixel data)
+    @staticmethod
+    def _image(width: int, height: int, color_space: str, pixels: bytes) -> tuple[str, bytes]:
+        data = zlib.compress(pixels, 9)
+        return (f"<</Type /XObject /Subtype /Image /Width {width} /Height {height} /ColorSpace {color_space} "
+                f"/BitsPerComponent 8 /Filter /FlateDecode /Length {len(data)}>>", data)
+
+    ## @brief Decodes the logo, if there is a usable one
+    ## @param logo_filepath Path to the PNG logo, or None
+    ## @return Tuple (width, height, channels, pixel bytes), or None
+    @staticmethod
+    def _load_logo(logo_filepath: str | None):
+        if not logo_filepath:
+            return None
+        try:
+            return _read_png(logo_filepath, STAMP_LOGO_MAX_PIXELS)
+        except (OSError, ValueError, zlib.error, struct.error) as e:
+            logger.warning(f"Stamp logo {logo_filepath} cannot be used, stamping without it: {e}")
+            return None
+
+
+## @brief Returns the stamp appearance of a signer, building it on first use
+## @param signer DocumentSigner the stamp names
+## @param day Signing date shown on the stamp, defaults to today
+## @param logo_filepath Path to the PNG logo, or None for a stamp without a logo
+## @return StampAppearance shared by all documents stamped for the same signer, day and logo
+def get_stamp_appearance(signer, day: date | None = None,
+                         logo_filepath: str | None = STAMP_LOGO_PATH) -> StampAppearance:
+    day = day or date.today()
+    try:
+        logo_mtime = os.stat(logo_filepath).st_mtime_ns if logo_filepath else None
+    except OSError:
+        logo_mtime = None
+    cache_key = (signer.fingerprint, signer.algorithm, day, logo_filepath, logo_mtime)
+    with _appearance_cache_lock:
+        appearance = _appearance_cache.get(cache_key)
+        if appearance is not None:
+            _appearance_cache.move_to_end(cache_key)
+            return appearance
+        # Built under the lock, so concurrent workers of a batch wait for one build instead of racing
+        appearance = StampAppearance(signer, day, logo_filepath)
+        _appearance_cache[cache_key] = appearance
+        while len(_appearance_cache) > STAMP_CACHE_SIZE:
+            _appearance_cache.popitem(last=False)
+    logger.info(f"Signature stamp appearance built for key {signer.fingerprint[:16]} ({day.isoformat()})")
+    return appearance
+
+
+## @brief Removes all cached stamp appearances
+## @return None
+def clear_stamp_cache() -> None:
+    with _appearance_cache_lock:
+        _appearance_cache.clear()
+
+
+## @brief Returns the visible area of a page, inheriting it from the page tree if needed
+## @param page Page dictionary
+## @return List [left, bottom, right, top]
+def _page_box(page) -> list[float]:
+    for key in ("/CropBox", "/MediaBox"):
+        node = page
+        while node is not None:
+            if key in node:
+                box = [float(value) for value in node[key]]
+                return [min(box[0], box[2]), min(box[1], box[3]), max(box[0], box[2]), max(box[1], box[3])]
+            node = node.get("/Parent")
+            node = node.get_object() if node is not None else None
+    # Letter size, the default of the PDF specification's examples
+    return [0.0, 0.0, 612.0, 792.0]
+
+
+## @brief Copies a document and appends an incremental update stamping its last page
+## @param reader PdfReader opened on @p stream
+## @param stream Seekable binary stream of the document
+## @param out_stream Binary stream receiving the stamped document
+## @param appearance StampAppearance to draw (see get_stamp_appearance)
+## @return None
+## @throws ValueError if the document has no pages
+def add_signature_stamp(reader: PdfReader, stream, out_stream, appearance: StampAppearance) -> None:
+    page_count = get_page_count(reader)
+    if page_count == 0:
+        raise ValueError("The document has no pages to stamp.")
+    _, page, _ = next(iter_pages(reader, [page_count - 1]))
+    page_ref = page.indirect_reference
+
+    first = next_object_number(reader)
+    objects = appearance.render(first)
+    annotation_number = first + len(appearance)
+    left, bottom, right, top = _page_box(page)
+    x = max(left, right - STAMP_MARGIN - appearance.width)
+    y = min(bottom + STAMP_MARGIN, top - appearance.height)
+    annotation = (f"<</Type /Annot /Subtype /Stamp /F {_STAMP_FLAGS} "
+                  f"/Rect [{x:g} {y:g} {x + appearance.width:g} {y + appearance.height:g}] "
+                  f"/P {page_ref.idnum} {page_ref.generation} R "
+                  f"/AP <</N {first + appearance.form_index} 0 R>> /Contents (").encode()
+    annotation += _pdf_string(", ".join(appearance.lines)) + b")>>"
+    objects[annotation_number] = annotation
+
+    annotation_ref = IndirectObject(annotation_number, 0, reader)
+    annots = page.raw_get("/Annots") if "/Annots" in page else None
+    if isinstance(annots, IndirectObject):
+        # An indirect /Annots array is rewritten instead of the page
+        objects[annots.idnum] = serialize_object(ArrayObject([*annots.get_object(), annotation_ref]))
+    else:
+        stamped_page = DictionaryObject(dict.items(page))
+        stamped_page[NameObject("/Annots")] = ArrayObject([*(annots or []), annotation_ref])
+        objects[page_ref.idnum] = serialize_object(stamped_page)
+
+    prev_xref = find_startxref(stream)
+    stream.seek(0)
+    shutil.copyfileobj(stream, out_stream, DIGEST_CHUNK_SIZE)
+    write_objects_update(reader, out_stream, objects, stream.tell(), prev_xref)
@@ -0,0 +1,136 @@
+## @file signer.py
+## @brief Persistent, thread-safe document signer objects
+##
+## Decrypting the private key file and converting the key into the signature
+## backend's own key object is done once per key. The resulting signer keeps
+## the backend key object, with its precomputed CRT parameters and, for the
+## OpenSSL based backend, its cached Montgomery contexts and blinding state,
+## and can be shared by any number of signing threads.
+
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from constants import LOGGER_GLOBAL_NAME, SIGNER_CACHE_SIZE
+from utility.crypto_backend import get_signature_backend, get_key_type, SIGNATURE_ALGORITHMS
+from utility.key_container import key_fingerprint
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+## @brief Per-process salt so the signer cache never holds the PIN-derived AES key
+_CACHE_SALT = os.urandom(16)
+
+_signer_cache: OrderedDict = OrderedDict()
+_signer_cache_lock = threading.Lock()
+
+
+## @brief Signer holding a decrypted private key ready for repeated use
+##
+## sign() only reads the backend key object, so one instance may be used by
+## several threads at once. RSA blinding stays enabled in both backends.
+class DocumentSigner:
+    ## @brief Prepares the key for signing
+    ## @param private_key Decrypted pycryptodomex RSA or ECC private key
+    ## @param backend Signature backend, defaults to the selected one
+    def __init__(self, private_key, backend=None):
+        ## @brief The decrypted pycryptodomex private key
+        self.private_key = private_key
+        ## @brief Key type of the private key (one of KEY_TYPES)
+        self.key_type = get_key_type(private_key)
+        ## @brief Signature algorithm recorded in signed documents
+        self.algorithm = SIGNATURE_ALGORITHMS[self.key_type]
+        ## @brief SHA-256 fingerprint of the public key, as a hex string
+        self.fingerprint = key_fingerprint(private_key).hex()
+
+        # Both backends precompute the CRT parameters (dP, dQ, qInv) of RSA
+        # keys when the key object is created, so this happens once here
+        self._backend = backend or get_signature_backend()
+        self._key = self._backend.load_key(private_key)
+        # First operation lets the backend build its per-key caches
+        # (Montgomery contexts, blinding factors) outside of the timed path
+        self.sign(bytes(32))
+
+    ## @brief Returns the public key matching the private key
+    ## @return pycryptodomex public key
+    def public_key(self):
+        return self.private_key.public_key()
+
+    ## @brief Signs a SHA-256 digest
+    ## @param digest SHA-256 digest of the document
+    ## @return Signature bytes
+    def sign(self, digest: bytes) -> bytes:
+        return self._backend.sign(self._key, self.key_type, digest)
+
+
+## @brief Returns a DocumentSigner for a key or an existing signer
+## @param key_or_signer DocumentSigner or decrypted pycryptodomex private key
+## @return DocumentSigner
+def as_signer(key_or_signer) -> DocumentSigner:
+    if isinstance(key_or_signer, DocumentSigner):
+        return key_or_signer
+    return DocumentSigner(key_or_signer)
+
+
+## @brief Returns a cached signer for an encrypted private key file
+##
+## Signers are cached by file identity (path, size, modification time) and
+## PIN, so repeated signing with the same key skips decryption and key setup.
+## @param private_key_filepath Path to the encrypted private key file
+## @param pin User PIN for decryption
+## @return DocumentSigner
+## @throws DecryptionError if PIN is incorrect or decryption fails
+def load_signer(private_key_filepath, pin: str) -> DocumentSigner:
+    from utility.pdf_sign import decrypt_private_key
+
+    stat = os.stat(private_key_filepath)
+    cache_key = (
+        os.path.realpath(private_key_filepath),
+        stat.st_size,
+        stat.st_mtime_ns,
+        hashlib.sha256(_CACHE_SALT + pin.encode()).digest(),
+    )
+    with _signer_cache_lock:
+        signer = _signer_cache.get(cache_key)
+        if signer is not None:
+            _signer_cache.move_to_end(cache_key)
+            return signer
+
+    signer = DocumentSigner(decrypt_private_key(private_key_filepath=private_key_filepath, pin=pin))
+    with _signer_cache_lock:
+        _signer_cache[cache_key] = signer
+        while len(_signer_cache) > SIGNER_CACHE_SIZE:
+            _signer_cache.popitem(last=False)
+    logger.info(f"Private key loaded into signer cache: {private_key_filepath}")
+    return signer
+
+
+## @brief Removes all cached signers (e.g. when the USB drive is removed)
+## @return None
+def clear_signer_cache() -> None:
+    with _signer_cache_lock:
+        _signer_cache.clear()
+
+
+## @brief Signs several PDF files concurrently with one shared signer
+## @param signer DocumentSigner or decrypted private key
+## @param pdf_filepaths Paths to the PDF files to sign
+## @param max_workers Number of signing threads, defaults to the CPU count
+## @param kwargs Extra arguments passed to sign_pdf_file (e.g. digest_profile)
+## @return List of (pdf_filepath, signed_filepath or None, error or None) in input order
+def sign_pdf_files(signer, pdf_filepaths, max_workers: int | None = None, **kwargs) -> list[tuple]:
+    from utility.pdf_sign import sign_pdf_file
+
+    signer = as_signer(signer)
+
+    def _sign(pdf_filepath):
+        try:
+            return pdf_filepath, sign_pdf_file(decrypted_private_key=signer, pdf_filepath=pdf_filepath, **kwargs), None
+        except Exception as e:
+            logger.error(f"Signing {pdf_filepath} failed: {e}")
+            return pdf_filepath, None, e
+
+    with ThreadPoolExecutor(max_workers=max_workers or os.cpu_count()) as executor:
+        return list(executor.map(_sign, pdf_filepaths))
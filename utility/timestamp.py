@@ -0,0 +1,272 @@
+## @file timestamp.py
+## @brief Trusted timestamps for signature values
+##
+## Follows the RFC 3161 model: the client sends the SHA-256 message imprint
+## of the signature value and a nonce, the timestamp authority (TSA) returns a
+## signed token binding the imprint to its time, serial number and policy.
+## Requests and tokens are JSON instead of DER so the exchange needs no ASN.1
+## library, and several requests travel in one HTTP request: concurrent
+## signing threads share a batch, and up to TSA_MAX_IN_FLIGHT batches are in
+## flight on their own keep-alive connections, so N signatures cost about one
+## round-trip instead of N.
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.client import HTTPConnection, HTTPSConnection
+from urllib.parse import urlsplit
+
+from constants import LOGGER_GLOBAL_NAME, TSA_URL_ENV, TSA_PUBLIC_KEY_ENV, TSA_BATCH_SIZE, TSA_BATCH_DELAY, \
+    TSA_MAX_IN_FLIGHT, TSA_TIMEOUT
+from utility.crypto_backend import import_key, verify_digest
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+## @brief Content type of batch timestamp requests and responses
+CONTENT_TYPE = "application/x-pades-timestamp-batch+json"
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+## @brief Exception raised when a timestamp cannot be obtained or does not verify
+class TimestampError(Exception):
+    pass
+
+
+## @brief Returns the canonical bytes of a token's timestamp info (the signed part)
+## @param tst_info Timestamp info dictionary
+## @return UTF-8 JSON with sorted keys and no whitespace
+def canonical_tst_info(tst_info: dict) -> bytes:
+    return json.dumps(tst_info, sort_keys=True, separators=(",", ":")).encode()
+
+
+## @brief Encodes a token for embedding in a PDF
+## @param token Token dictionary
+## @return Base64 text
+def encode_token(token: dict) -> str:
+    return base64.b64encode(canonical_tst_info(token)).decode()
+
+
+## @brief Decodes an embedded token
+## @param encoded Base64 text
+## @return Token dictionary
+def decode_token(encoded: str) -> dict:
+    return json.loads(base64.b64decode(encoded))
+
+
+## @brief Checks a token against the data it timestamps
+## @param token Token dictionary
+## @param data Timestamped data (the signature value)
+## @param tsa_public_key Optional pycryptodomex public key of the TSA; without it only the imprint is checked
+## @return Timestamp info dictionary
+## @throws TimestampError if the token does not match the data or its TSA signature is invalid
+def verify_token(token: dict, data: bytes, tsa_public_key=None) -> dict:
+    tst_info = token["tst_info"]
+    if tst_info.get("hash_algorithm") != "sha256" or \
+            tst_info.get("message_imprint") != hashlib.sha256(data).hexdigest():
+        raise TimestampError("Timestamp token does not match the signature")
+    if tsa_public_key is not None:
+        try:
+            verify_digest(tsa_public_key, hashlib.sha256(canonical_tst_info(tst_info)).digest(),
+                          base64.b64decode(token["signature"]))
+        except ValueError:
+            raise TimestampError("Timestamp token signature is invalid")
+    return tst_info
+
+
+## @brief Loads the TSA public key named by TSA_PUBLIC_KEY_ENV
+## @return pycryptodomex public key, or None if the variable is not set
+def load_tsa_public_key():
+    filepath = os.getenv(TSA_PUBLIC_KEY_ENV)
+    if not filepath:
+        return None
+    with open(filepath, "rb") as f:
+        return import_key(f.read())
+
+
+## @brief Batching, pipelining timestamp client
+##
+## timestamp() may be called from any number of threads. Each call waits for
+## its token; calls made close together are sent to the TSA in one batch.
+class TimestampClient:
+    ## @brief Creates the client and its sender threads
+    ## @param url TSA endpoint (http or https)
+    ## @param batch_size Maximum number of requests per batch
+    ## @param batch_delay Seconds a request waits for others to join its batch
+    ## @param max_in_flight Maximum number of batches in flight (one connection each)
+    ## @param timeout Seconds to wait for a response
+    def __init__(self, url: str, batch_size: int = TSA_BATCH_SIZE, batch_delay: float = TSA_BATCH_DELAY,
+                 max_in_flight: int = TSA_MAX_IN_FLIGHT, timeout: float = TSA_TIMEOUT):
+        self.url = url
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.timeout = timeout
+        parts = urlsplit(url)
+        self._connection_class = HTTPSConnection if parts.scheme == "https" else HTTPConnection
+        self._netloc = parts.netloc
+        self._path = parts.path or "/"
+
+        self._pending: list[tuple[str, int, float, Future]] = []
+        self._condition = threading.Condition()
+        self._closed = False
+        self._stats_lock = threading.Lock()
+        self._tokens = 0
+        self._batches = 0
+        self._total_latency = 0.0
+        self._total_round_trip = 0.0
+        self._senders = [threading.Thread(target=self._send_loop, name=f"tsa-sender-{i}", daemon=True)
+                         for i in range(max_in_flight)]
+        for sender in self._senders:
+            sender.start()
+
+    ## @brief Timestamps data, waiting for the token
+    ##
+    ## Waits at most the batch delay plus twice the request timeout (connecting
+    ## and reading each may take the full timeout).
+    ## @param data Data to timestamp (the signature value)
+    ## @return Token dictionary
+    ## @throws TimestampError if the TSA fails, does not answer in time or returns a token that does not match
+    def timestamp(self, data: bytes) -> dict:
+        future = self.submit(data)
+        try:
+            return future.result(timeout=self.batch_delay + 2 * self.timeout)
+        except FutureTimeoutError:
+            raise TimestampError(f"No timestamp from {self.url} within {2 * self.timeout:.0f} s")
+
+    ## @brief Queues data for timestamping without waiting
+    ## @param data Data to timestamp
+    ## @return Future resolving to the token dictionary
+    def submit(self, data: bytes) -> Future:
+        future = Future()
+        imprint = hashlib.sha256(data).hexdigest()
+        with self._condition:
+            if self._closed:
+                raise TimestampError("Timestamp client is closed")
+            self._pending.append((imprint, secrets.randbits(63), time.perf_counter(), future))
+            self._condition.notify()
+        return future
+
+    ## @brief Returns timing statistics
+    ## @return Dictionary with the number of tokens and batches and the average latency,
+    ##         round-trip time and batch size
+    def stats(self) -> dict:
+        with self._stats_lock:
+            return {
+                "tokens": self._tokens,
+                "batches": self._batches,
+                "avg_latency": self._total_latency / self._tokens if self._tokens else 0.0,
+                "avg_round_trip": self._total_round_trip / self._batches if self._batches else 0.0,
+                "avg_batch_size": self._tokens / self._batches if self._batches else 0.0,
+            }
+
+    ## @brief Sends the pending requests and stops the sender threads
+    ## @return None
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for sender in self._senders:
+            sender.join()
+
+    ## @brief Sender thread loop: collects a batch and sends it
+    def _send_loop(self) -> None:
+        connection = None
+        while True:
+            with self._condition:
+                while not self._pending and not self._closed:
+                    self._condition.wait()
+                if not self._pending:
+                    break
+                # Wait for the batch to fill up, at most batch_delay after its oldest request
+                deadline = self._pending[0][2] + self.batch_delay
+                while len(self._pending) < self.batch_size and not self._closed:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+
+            try:
+                if connection is None:
+                    connection = self._connection_class(self._netloc, timeout=self.timeout)
+                tokens, round_trip = self._exchange(connection, batch)
+            except Exception as e:
+                # Any failure (network, HTTP protocol, malformed reply) fails this batch only;
+                # the sender keeps serving later batches on a new connection
+                if connection is not None:
+                    connection.close()
+                connection = None
+                logger.error(f"Timestamp request to {self.url} failed: {e!r}")
+                for _, _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e if isinstance(e, TimestampError) else TimestampError(str(e)))
+                continue
+
+            finished = time.perf_counter()
+            with self._stats_lock:
+                self._batches += 1
+                self._tokens += len(batch)
+                self._total_round_trip += round_trip
+                self._total_latency += sum(finished - submitted for _, _, submitted, _ in batch)
+            for (_, _, _, future), token in zip(batch, tokens):
+                if not future.done():
+                    future.set_result(token)
+        if connection is not None:
+            connection.close()
+
+    ## @brief Sends one batch over a keep-alive connection
+    ## @param connection HTTP connection
+    ## @param batch List of pending requests
+    ## @return Tuple (list of tokens in request order, round-trip seconds)
+    def _exchange(self, connection, batch) -> tuple[list[dict], float]:
+        body = json.dumps({"requests": [{"message_imprint": imprint, "hash_algorithm": "sha256", "nonce": nonce}
+                                        for imprint, nonce, _, _ in batch]}).encode()
+        start = time.perf_counter()
+        connection.request("POST", self._path, body=body, headers={"Content-Type": CONTENT_TYPE})
+        response = connection.getresponse()
+        payload = response.read()
+        round_trip = time.perf_counter() - start
+        if response.status != 200:
+            raise TimestampError(f"TSA answered {response.status} {response.reason}")
+
+        tokens = json.loads(payload)["tokens"]
+        if len(tokens) != len(batch):
+            raise TimestampError("TSA returned a wrong number of tokens")
+        for (imprint, nonce, _, _), token in zip(batch, tokens):
+            tst_info = token["tst_info"]
+            if tst_info["message_imprint"] != imprint or tst_info["nonce"] != nonce:
+                raise TimestampError("TSA returned a token for another request")
+        return tokens, round_trip
+
+
+## @brief Returns the client for the TSA named by TSA_URL_ENV, creating it on first use
+## @return TimestampClient, or None if timestamping is not configured
+def get_default_timestamp_client() -> TimestampClient | None:
+    global _default_client
+    url = os.getenv(TSA_URL_ENV)
+    if not url:
+        return None
+    with _default_client_lock:
+        if _default_client is None or _default_client.url != url:
+            _default_client = TimestampClient(url)
+        return _default_client
+
+
+## @brief Drops the inherited default client in a forked child
+##
+## Its batching thread and connections do not exist in the child; a new client is created on first use.
+def _reset_after_fork() -> None:
+    global _default_client, _default_client_lock
+    _default_client = None
+    _default_client_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,211 @@
+## @file trust_store.py
+## @brief Trust store of signer keys with validity windows and revocations
+##
+## The trust store is a JSON file next to the public keys (TRUST_STORE_PATH):
+##
+##     {
+##       "require_listed": false,
+##       "keys": {"<fingerprint>": {"label": "...", "not_before": "2026-01-01T00:00:00Z",
+##                                 "not_after": "2027-01-01T00:00:00Z"}},
+##       "revoked": {"<fingerprint>": {"reason": "...", "revoked_at": "2026-06-01T00:00:00Z"}}
+##     }
+##
+## Fingerprints are SHA-256 hashes of the DER encoded public key (hex). The
+## file is parsed once into in-memory hash tables, so each check is O(1). The
+## file is stat()ed at most once per TRUST_STORE_CHECK_INTERVAL and re-parsed
+## only when it changed. Without a trust store file every key is trusted.
+
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from constants import LOGGER_GLOBAL_NAME, TRUST_STORE_PATH, TRUST_STORE_CHECK_INTERVAL
+from utility.atomic_writer import atomic_write
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+_default_trust_store = None
+_default_trust_store_lock = threading.Lock()
+
+
+## @brief Exception raised when a signer key is not trusted
+class TrustError(Exception):
+    pass
+
+
+## @brief Parses an ISO 8601 time
+## @param value Time such as "2026-01-01T00:00:00Z", or None
+## @return Seconds since the epoch, or None
+def _parse_time(value) -> float | None:
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+## @brief Formats a time as ISO 8601 UTC
+## @param timestamp Seconds since the epoch
+## @return Time such as "2026-01-01T00:00:00Z"
+def _format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+## @brief In-memory, hot-reloaded view of the trust store file
+class TrustStore:
+    ## @brief Creates the trust store; the file is read on first use
+    ## @param filepath Path to the trust store file
+    ## @param check_interval Minimum seconds between checks of the file for changes
+    def __init__(self, filepath: str = TRUST_STORE_PATH, check_interval: float = TRUST_STORE_CHECK_INTERVAL):
+        self.filepath = filepath
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._signature = None
+        self._next_check = 0.0
+        self._loaded = False
+        self._error = None
+        self._data = {}
+        self._require_listed = False
+        self._windows: dict[str, tuple[float | None, float | None]] = {}
+        self._revoked: dict[str, float | None] = {}
+
+    ## @brief Checks that a key may be trusted for a signature made at a given time
+    ## @param fingerprint SHA-256 fingerprint of the signer's public key, hex
+    ## @param at Signing time (seconds since the epoch), defaults to now
+    ## @throws TrustError if the key is revoked, outside its validity window or not listed
+    def check(self, fingerprint: str, at: float | None = None) -> None:
+        self._refresh()
+        at = time.time() if at is None else at
+        if self._error is not None:
+            raise TrustError(f"Trust store cannot be read: {self._error}")
+        if fingerprint in self._revoked:
+            revoked_at = self._revoked[fingerprint]
+            if revoked_at is None or at >= revoked_at:
+                raise TrustError(f"Signer key {fingerprint[:16]} is revoked")
+        window = self._windows.get(fingerprint)
+        if window is None:
+            if self._require_listed:
+                raise TrustError(f"Signer key {fingerprint[:16]} is not in the trust store")
+            return
+        not_before, not_after = window
+        if not_before is not None and at < not_before:
+            raise TrustError(f"Signer key {fingerprint[:16]} is not valid before {_format_time(not_before)}")
+        if not_after is not None and at >= not_after:
+            raise TrustError(f"Signer key {fingerprint[:16]} expired at {_format_time(not_after)}")
+
+    ## @brief Adds or replaces a key with its validity window
+    ## @param fingerprint SHA-256 fingerprint of the public key, hex
+    ## @param label Human readable name of the key
+    ## @param not_before Start of validity (seconds since the epoch), or None
+    ## @param not_after End of validity (seconds since the epoch), or None
+    def add_key(self, fingerprint: str, label: str = "", not_before: float | None = None,
+                not_after: float | None = None) -> None:
+        entry = {"label": label}
+        if not_before is not None:
+            entry["not_before"] = _format_time(not_before)
+        if not_after is not None:
+            entry["not_after"] = _format_time(not_after)
+        self._update(lambda data: data.setdefault("keys", {}).__setitem__(fingerprint, entry))
+
+    ## @brief Revokes a key
+    ## @param fingerprint SHA-256 fingerprint of the public key, hex
+    ## @param reason Reason of the revocation
+    ## @param revoked_at Time from which signatures are rejected, defaults to now;
+    ##        None rejects every signature of the key
+    def revoke(self, fingerprint: str, reason: str = "", revoked_at: float | None = ...) -> None:
+        entry = {"reason": reason}
+        if revoked_at is ...:
+            revoked_at = time.time()
+        if revoked_at is not None:
+            entry["revoked_at"] = _format_time(revoked_at)
+        self._update(lambda data: data.setdefault("revoked", {}).__setitem__(fingerprint, entry))
+
+    ## @brief Applies a change to the file and reloads it
+    ## @param change Function modifying the parsed file content in place
+    def _update(self, change) -> None:
+        with self._lock:
+            self._next_check = 0.0
+        self._refresh()
+        with self._lock:
+            data = json.loads(json.dumps(self._data))
+            change(data)
+            os.makedirs(os.path.dirname(os.path.abspath(self.filepath)), exist_ok=True)
+            with atomic_write(self.filepath) as f:
+                f.write(json.dumps(data, indent=2, sort_keys=True).encode())
+            self._next_check = 0.0
+        self._refresh()
+
+    ## @brief Reloads the file if it changed, at most once per check interval
+    def _refresh(self) -> None:
+        now = time.monotonic()
+        if self._loaded and now < self._next_check:
+            return
+        with self._lock:
+            if self._loaded and now < self._next_check:
+                return
+            self._next_check = now + self.check_interval
+            try:
+                stat = os.stat(self.filepath)
+                signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            except FileNotFoundError:
+                signature = None
+            if self._loaded and signature == self._signature:
+                return
+            self._load(signature)
+
+    ## @brief Parses the file into the in-memory tables
+    ## @param signature (mtime, size, inode) of the file, or None if it does not exist
+    def _load(self, signature) -> None:
+        try:
+            data = {}
+            if signature is not None:
+                with open(self.filepath, "rb") as f:
+                    data = json.load(f)
+            windows = {fingerprint: (_parse_time(entry.get("not_before")), _parse_time(entry.get("not_after")))
+                       for fingerprint, entry in data.get("keys", {}).items()}
+            revoked = {fingerprint: _parse_time(entry.get("revoked_at"))
+                       for fingerprint, entry in data.get("revoked", {}).items()}
+        except (OSError, ValueError, AttributeError) as e:
+            logger.error(f"Trust store {self.filepath} cannot be read: {e}")
+            # Keep the last good content; refuse everything if there is none
+            if not self._loaded or self._error is not None:
+                self._error = str(e)
+            self._signature = signature
+            self._loaded = True
+            return
+
+        self._data = data
+        self._require_listed = bool(data.get("require_listed", False))
+        self._windows = windows
+        self._revoked = revoked
+        self._signature = signature
+        self._error = None
+        self._loaded = True
+        logger.info(f"Trust store loaded: {len(windows)} key(s), {len(revoked)} revoked")
+
+
+## @brief Returns the trust store at TRUST_STORE_PATH, creating it on first use
+## @return TrustStore
+def get_default_trust_store() -> TrustStore:
+    global _default_trust_store
+    with _default_trust_store_lock:
+        if _default_trust_store is None:
+            _default_trust_store = TrustStore()
+        return _default_trust_store
+
+
+## @brief Drops the inherited default trust store in a forked child
+##
+## Its lock may have been held by another thread at fork(); the child loads its own on first use.
+def _reset_after_fork() -> None:
+    global _default_trust_store, _default_trust_store_lock
+    _default_trust_store = None
+    _default_trust_store_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
@@ -5,6 +5,7 @@
 
 import logging
 import os
+import sys
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -15,13 +16,23 @@ if os.name == "nt":
     import win32api
     import win32file
 
-from constants import LOGGER_GLOBAL_NAME
+if sys.platform.startswith("linux"):
+    from utility.linux_devices import LinuxRemovableDevices
+
+from constants import LOGGER_GLOBAL_NAME, PRIVATE_KEY_EXTENSION, PUBLIC_KEY_EXTENSION, LEGACY_PUBLIC_KEY_EXTENSION
 
 logger = logging.getLogger(LOGGER_GLOBAL_NAME)
 
+# Read once; CUSTOM_FILEPATH simulates a USB drive for development
+load_dotenv()
+
+## @brief Cached removable drive list (Linux only), created on first use
+_linux_devices = None
+
 ## @brief Checks for USB storage devices connected to the system
 ## @return Tuple (bool, list|None) - True if USB devices found, with a list of device details
 def check_for_usb_device() -> tuple[bool, list | None]:
+    global _linux_devices
     usb_disks = []
 
     if os.name == "nt":
@@ -39,8 +50,16 @@ def check_for_usb_device() -> tuple[bool, list | None]:
                     "device": device,
                     "name": volume_name
                 })
-    else: # TESTING PURPOSES ONLY FOR UNIX-BASED SYSTEMS
-        load_dotenv()
+    elif sys.platform.startswith("linux"):
+        if _linux_devices is None:
+            _linux_devices = LinuxRemovableDevices()
+        usb_disks.extend(_linux_devices.devices())
+        if os.getenv('CUSTOM_FILEPATH'): # TESTING PURPOSES ONLY
+            usb_disks.append({
+                "device": os.getenv('CUSTOM_FILEPATH'),
+                "name": "USB SIMULATON"
+            })
+    else: # TESTING PURPOSES ONLY FOR OTHER UNIX-BASED SYSTEMS
         usb_disks.append({
             "device": os.getenv('CUSTOM_FILEPATH'),
             "name": "USB SIMULATON"
@@ -53,21 +72,24 @@ def check_for_usb_device() -> tuple[bool, list | None]:
         return False, None
 
 ## @brief Search a USB drive for private key files (.key extension)
+##
+## Use key_container.read_headers() to identify the keys found without decrypting them.
 ## @param usb_path Path to the USB drive to search
 ## @return List of paths to key files found
 def search_usb_for_private_key(usb_path) -> list:
     key_files_found = []
 
-    for path in Path(usb_path).rglob('*.key'):
+    for path in Path(usb_path).rglob(f'*{PRIVATE_KEY_EXTENSION}'):
         key_files_found.append(path)
     return key_files_found
 
-## @brief Search local machine for public key files (.pem extension)
+## @brief Search local machine for public key files (.pub containers and plain .pem keys)
 ## @param local_machine_path Path on local machine to search
 ## @return List of paths to public key files found
 def search_local_machine_for_public_key(local_machine_path) -> list:
     key_files_found = []
 
-    for path in Path(local_machine_path).rglob('*.pem'):
-        key_files_found.append(path)
+    for extension in (PUBLIC_KEY_EXTENSION, LEGACY_PUBLIC_KEY_EXTENSION):
+        for path in Path(local_machine_path).rglob(f'*{extension}'):
+            key_files_found.append(path)
     return key_files_found
@@ -0,0 +1,279 @@
+## @file warm_pool.py
+## @brief Pool of warm worker processes for signing and verification
+##
+## A new process pays for importing PyPDF2 and Cryptodome and for parsing the
+## keys before its first job, which for one-page documents costs more than
+## the signing itself. The workers of this pool are forked from the process
+## that created it, with the heavy modules already imported and the key
+## objects (and the signer's prepared key) already loaded, and they stay up
+## between jobs. A worker is replaced, again by forking, after
+## WARM_POOL_MAX_JOBS jobs or once its RSS exceeds WARM_POOL_MAX_RSS_MB, so a
+## leak in a job cannot grow without bound.
+##
+## Where fork is not available (Windows), workers are spawned instead and load
+## the modules and keys once each at start.
+
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import psutil
+from Cryptodome.PublicKey import ECC
+
+from constants import LOGGER_GLOBAL_NAME, WARM_POOL_MAX_JOBS, WARM_POOL_MAX_RSS_MB
+from utility.crypto_backend import import_key
+from utility.key_container import read_public_key
+from utility.pdf_sign import sign_pdf_file, verify_pdf_stream
+from utility.signer import DocumentSigner
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+## @brief Set to the key state of a forked worker before fork, so it is inherited instead of pickled
+_inherited_state = None
+
+
+## @brief Exception raised in the caller when a worker process dies during a job
+class WorkerDiedError(Exception):
+    pass
+
+
+## @brief Keys a worker process works with
+class _WorkerState:
+    ## @brief Prepares the keys
+    ## @param private_key Decrypted private key, PEM bytes of it (spawned workers) or None
+    ## @param public_key Imported public key, PEM bytes of it (spawned workers) or None
+    def __init__(self, private_key=None, public_key=None):
+        if isinstance(private_key, bytes):
+            private_key = import_key(private_key)
+        if isinstance(public_key, bytes):
+            public_key = import_key(public_key)
+        self.signer = DocumentSigner(private_key) if private_key is not None else None
+        self.public_key = public_key
+
+    ## @brief Signs a PDF file
+    ## @param pdf_filepath Path to the PDF file
+    ## @param kwargs Further arguments of sign_pdf_file (picklable ones only)
+    ## @return Path to the signed PDF file
+    def sign(self, pdf_filepath: str, **kwargs) -> str:
+        if self.signer is None:
+            raise ValueError("The worker pool has no private key")
+        return sign_pdf_file(self.signer, pdf_filepath, **kwargs)
+
+    ## @brief Verifies a signed PDF file
+    ## @param pdf_filepath Path to the signed PDF file
+    ## @return Tuple (is_valid, message) as returned by verify_pdf_signature
+    def verify(self, pdf_filepath: str) -> tuple[bool, str]:
+        if self.public_key is None:
+            raise ValueError("The worker pool has no public key")
+        try:
+            with open(pdf_filepath, "rb") as stream:
+                return verify_pdf_stream(stream, self.public_key)
+        except FileNotFoundError as fnf:
+            return False, f"File not found: {str(fnf)}"
+
+
+## @brief Exports a key for a spawned worker
+## @param key pycryptodomex RSA or ECC key, or None
+## @return PEM bytes, or None
+def _export_key(key) -> bytes | None:
+    if key is None:
+        return None
+    if isinstance(key, ECC.EccKey):
+        return key.export_key(format="PEM").encode()
+    return key.export_key()
+
+
+## @brief Main loop of a worker process
+## @param connection Pipe end receiving (operation, args, kwargs) and sending replies
+## @param keys Tuple (private key PEM, public key PEM) for spawned workers, None for forked
+##        workers, which use the _WorkerState inherited through fork
+## @param max_jobs Number of jobs after which the worker exits
+## @param max_rss Resident set size in bytes after which the worker exits
+def _worker_main(connection, keys, max_jobs: int, max_rss: int) -> None:
+    state = _inherited_state if keys is None else _WorkerState(*keys)
+    process = psutil.Process()
+    jobs = 0
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            return
+        if message is None:
+            return
+        operation, args, kwargs = message
+        try:
+            reply = (True, getattr(state, operation)(*args, **kwargs))
+        except Exception as e:
+            reply = (False, e)
+        jobs += 1
+        retire = jobs >= max_jobs or process.memory_info().rss > max_rss
+        try:
+            connection.send((reply, retire))
+        except Exception as e:
+            # The result or the exception cannot be pickled
+            connection.send(((False, RuntimeError(f"{type(e).__name__}: {e}")), retire))
+        if retire:
+            return
+
+
+## @brief One worker process and the parent's end of its pipe
+class _Worker:
+    ## @brief Starts the worker process
+    ## @param pool WarmWorkerPool the worker belongs to
+    def __init__(self, pool):
+        global _inherited_state
+        self.connection, child_connection = pool._context.Pipe()
+        self.process = pool._context.Process(target=_worker_main, name="warm-worker", daemon=True,
+                                             args=(child_connection, pool._spawn_keys, pool.max_jobs,
+                                                   pool.max_rss_mb * 2 ** 20))
+        with pool._fork_lock:
+            _inherited_state = pool._state
+            try:
+                self.process.start()
+            finally:
+                _inherited_state = None
+        child_connection.close()
+
+    ## @brief Stops the worker process
+    def stop(self) -> None:
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=5)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.connection.close()
+
+
+## @brief Pool of pre-forked worker processes with the keys loaded
+class WarmWorkerPool:
+    ## @brief Loads the keys and forks the workers
+    ## @param private_key Decrypted private key used by sign(), or None for a verification-only pool
+    ## @param public_key_filepath Path to the public key file used by verify(), or None for a signing-only pool
+    ## @param workers Number of worker processes, defaults to the CPU count
+    ## @param max_jobs Number of jobs after which a worker is replaced
+    ## @param max_rss_mb Resident set size (in MB) after which a worker is replaced
+    def __init__(self, private_key=None, public_key_filepath: str | None = None, workers: int | None = None,
+                 max_jobs: int = WARM_POOL_MAX_JOBS, max_rss_mb: int = WARM_POOL_MAX_RSS_MB):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        ## @brief Number of workers replaced so far
+        self.recycled = 0
+        public_key = import_key(read_public_key(public_key_filepath)) if public_key_filepath else None
+        self._context = multiprocessing.get_context("fork" if os.name != "nt" else "spawn")
+        if self._context.get_start_method() == "fork":
+            self._state = _WorkerState(private_key, public_key)
+            self._spawn_keys = None
+        else:
+            # Spawned workers cannot inherit key objects and RSA keys cannot be pickled
+            self._state = None
+            self._spawn_keys = (_export_key(private_key), _export_key(public_key))
+        self._fork_lock = threading.Lock()
+        self._idle = queue.Queue()
+        for _ in range(self.workers):
+            self._idle.put(_Worker(self))
+        self._dispatcher = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="warm-pool")
+        self._closed = False
+        logger.info(f"Warm worker pool started with {self.workers} {self._context.get_start_method()}ed worker(s)")
+
+    ## @brief Signs a PDF file in a worker
+    ## @param pdf_filepath Path to the PDF file
+    ## @param kwargs Further arguments of sign_pdf_file (picklable ones: digest_profile, pages, output_dir, ...)
+    ## @return Future of the path to the signed PDF file
+    def sign(self, pdf_filepath: str, **kwargs):
+        return self._submit("sign", (pdf_filepath,), kwargs)
+
+    ## @brief Verifies a signed PDF file in a worker
+    ## @param pdf_filepath Path to the signed PDF file
+    ## @return Future of the tuple (is_valid, message)
+    def verify(self, pdf_filepath: str):
+        return self._submit("verify", (pdf_filepath,), {})
+
+    ## @brief Signs several PDF files
+    ## @param pdf_filepaths Paths to the PDF files to sign
+    ## @param kwargs Further arguments of sign_pdf_file
+    ## @return List of (pdf_filepath, signed_filepath or None, error or None) in input order
+    def sign_files(self, pdf_filepaths, **kwargs) -> list[tuple]:
+        futures = [(pdf_filepath, self.sign(pdf_filepath, **kwargs)) for pdf_filepath in pdf_filepaths]
+        results = []
+        for pdf_filepath, future in futures:
+            try:
+                results.append((pdf_filepath, future.result(), None))
+            except Exception as e:
+                logger.error(f"Signing {pdf_filepath} failed: {e}")
+                results.append((pdf_filepath, None, e))
+        return results
+
+    ## @brief Verifies several signed PDF files
+    ## @param pdf_filepaths Paths to the signed PDF files
+    ## @return List of (pdf_filepath, is_valid, message) in input order
+    def verify_files(self, pdf_filepaths) -> list[tuple]:
+        futures = [(pdf_filepath, self.verify(pdf_filepath)) for pdf_filepath in pdf_filepaths]
+        results = []
+        for pdf_filepath, future in futures:
+            try:
+                results.append((pdf_filepath, *future.result()))
+            except Exception as e:
+                results.append((pdf_filepath, False, f"Verification failed: {str(e)}"))
+        return results
+
+    ## @brief Stops the workers
+    ## @return None
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        self._dispatcher.shutdown(wait=True)
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                break
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    ## @brief Queues a job for the next idle worker
+    ## @return Future of the job's result
+    def _submit(self, operation: str, args: tuple, kwargs: dict):
+        if self._closed:
+            raise RuntimeError("The worker pool is closed")
+        return self._dispatcher.submit(self._run, operation, args, kwargs)
+
+    ## @brief Runs a job on an idle worker and replaces the worker if it retires
+    ## @return Result of the job
+    ## @throws The job's exception, or WorkerDiedError if the worker died
+    def _run(self, operation: str, args: tuple, kwargs: dict):
+        worker = self._idle.get()
+        try:
+            worker.connection.send((operation, args, kwargs))
+            (succeeded, value), retire = worker.connection.recv()
+        except (EOFError, OSError) as e:
+            worker.process.join(timeout=5)
+            self._replace(worker)
+            raise WorkerDiedError(f"Worker process died (exit code {worker.process.exitcode}): {e}")
+        if retire:
+            worker.process.join(timeout=5)
+            self._replace(worker)
+        else:
+            self._idle.put(worker)
+        if not succeeded:
+            raise value
+        return value
+
+    ## @brief Replaces a worker that exited with a freshly forked one
+    ## @param worker Exited worker
+    def _replace(self, worker: _Worker) -> None:
+        worker.connection.close()
+        self.recycled += 1
+        logger.info(f"Warm worker {worker.process.pid} replaced (exit code {worker.process.exitcode})")
+        self._idle.put(_Worker(self))
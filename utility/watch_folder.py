@@ -0,0 +1,476 @@
+## @file watch_folder.py
+## @brief Watch-folder mode for unattended PDF signing
+##
+## Watches a drop folder for new PDF files, signs each one through a bounded
+## pool of worker threads sharing one DocumentSigner and writes the signed
+## files to an output folder. Files are picked up only once their writer has
+## closed them (inotify IN_CLOSE_WRITE / IN_MOVED_TO on Linux, a stable size
+## and modification time elsewhere). Signed files are written atomically and
+## flushed to disk in group commits; a file is journaled as processed only
+## after its commit, so restarts neither lose nor re-sign files.
+
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import queue
+import select
+import shutil
+import struct
+import threading
+import time
+from collections import deque
+from functools import partial
+
+from constants import LOGGER_GLOBAL_NAME, DEFAULT_DIGEST_PROFILE, WATCH_QUEUE_SIZE, WATCH_POLL_INTERVAL, \
+    WATCH_STATS_INTERVAL, WATCH_JOURNAL_FILENAME, OPTIMIZE_ON_SIGN, \
+    VISIBLE_STAMP_ON_SIGN
+from utility.atomic_writer import FsyncBatch
+from utility.pdf_sign import sign_pdf_file
+from utility.signer import as_signer
+
+logger = logging.getLogger(LOGGER_GLOBAL_NAME)
+
+## @brief inotify event: file opened for writing was closed
+IN_CLOSE_WRITE = 0x00000008
+## @brief inotify event: file moved into the watched directory
+IN_MOVED_TO = 0x00000080
+## @brief inotify event: kernel event queue overflowed
+IN_Q_OVERFLOW = 0x00004000
+## @brief inotify_init1 flag: close the descriptor on exec
+IN_CLOEXEC = 0o2000000
+
+## @brief Layout of struct inotify_event without the trailing name
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+## @brief Checks if a file name should be signed
+## @param filename File name without directory
+## @return True for visible, not yet signed PDF files
+def is_pdf_candidate(filename: str) -> bool:
+    return filename.lower().endswith(".pdf") and not filename.startswith((".", "SIGNED_"))
+
+
+## @brief Watches a directory with Linux inotify
+class InotifyWatcher:
+    ## @brief Starts watching a directory
+    ## @param directory Directory to watch
+    ## @throws OSError if inotify is not available
+    def __init__(self, directory: str):
+        libc_name = ctypes.util.find_library("c")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            os.close(self._fd)
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {directory}")
+        self.directory = directory
+
+    ## @brief Waits for completely written files
+    ## @param timeout Maximum wait in seconds
+    ## @return List of file names, or None if events were lost and the directory must be rescanned
+    def wait(self, timeout: float) -> list[str] | None:
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return []
+        data = os.read(self._fd, 64 * 1024)
+        names = []
+        offset = 0
+        while offset < len(data):
+            _, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+            offset += _INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                return None
+            if name:
+                names.append(os.fsdecode(name))
+        return names
+
+    ## @brief Stops watching
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+## @brief Watches a directory by polling, for systems without inotify
+##
+## A file is reported once its size and modification time did not change
+## between two consecutive polls.
+class PollingWatcher:
+    ## @brief Starts watching a directory
+    ## @param directory Directory to watch
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._pending: dict[str, tuple[int, int]] = {}
+        self._reported: dict[str, tuple[int, int]] = {}
+
+    ## @brief Waits one poll interval and returns files that stopped changing
+    ## @param timeout Poll interval in seconds
+    ## @return List of file names
+    def wait(self, timeout: float) -> list[str]:
+        time.sleep(timeout)
+        stable = []
+        current = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file() or not is_pdf_candidate(entry.name):
+                    continue
+                stat = entry.stat()
+                current[entry.name] = (stat.st_size, stat.st_mtime_ns)
+                if self._pending.get(entry.name) == current[entry.name] \
+                        and self._reported.get(entry.name) != current[entry.name]:
+                    stable.append(entry.name)
+                    self._reported[entry.name] = current[entry.name]
+        self._pending = current
+        self._reported = {name: value for name, value in self._reported.items() if name in current}
+        return stable
+
+    ## @brief Stops watching
+    def close(self) -> None:
+        pass
+
+
+## @brief Append-only journal of processed files
+##
+## Each line is a JSON record keyed by file name, size and modification
+## time, so a signed file is processed again only if it is replaced. Files
+## whose signing failed are retried.
+class SigningJournal:
+    ## @brief Opens (and loads) the journal
+    ## @param journal_filepath Path to the journal file
+    def __init__(self, journal_filepath: str):
+        self._lock = threading.Lock()
+        self._done: set[str] = set()
+        if os.path.exists(journal_filepath):
+            with open(journal_filepath, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        if entry.get("error") is None:
+                            self._done.add(entry["key"])
+                    except (ValueError, KeyError, AttributeError):
+                        logger.warning(f"Skipping damaged journal line in {journal_filepath}")
+        self._file = open(journal_filepath, "a", encoding="utf-8")
+
+    ## @brief Builds the journal key of a file
+    ## @param filepath Path to the file
+    ## @return Key string, or None if the file no longer exists
+    @staticmethod
+    def file_key(filepath: str) -> str | None:
+        try:
+            stat = os.stat(filepath)
+        except FileNotFoundError:
+            return None
+        return f"{os.path.basename(filepath)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    ## @brief Checks if a file key was already signed
+    ##
+    ## Failed files are journaled too, but not counted as processed, so they
+    ## are signed again after a restart or once the file changes.
+    ## @param key Key returned by file_key()
+    ## @return True if the key is journaled as signed
+    def contains(self, key: str) -> bool:
+        with self._lock:
+            return key in self._done
+
+    ## @brief Records a processed file
+    ## @param key Key returned by file_key()
+    ## @param source Path to the input file
+    ## @param output Path to the signed file, None on failure
+    ## @param error Error message on failure
+    def record(self, key: str, source: str, output: str | None, error: str | None = None) -> None:
+        entry = {
+            "key": key,
+            "source": source,
+            "output": output,
+            "status": "failed" if error else "signed",
+            "error": error,
+            "time": time.time(),
+        }
+        with self._lock:
+            if error is None:
+                self._done.add(key)
+            self._file.write(json.dumps(entry) + "\n")
+            self._file.flush()
+
+    ## @brief Closes the journal file
+    def close(self) -> None:
+        with self._lock:
+            self._file.close()
+
+
+## @brief Throughput and queue statistics of the watch-folder signer
+class WatchFolderStats:
+    ## @brief Number of seconds covered by the recent throughput figure
+    WINDOW = 60.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        self._recent = deque()
+        self.signed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.max_queue_depth = 0
+        self.total_sign_time = 0.0
+
+    ## @brief Records a finished signing job
+    ## @param seconds Time the job took
+    ## @param success True if the file was signed
+    def job_finished(self, seconds: float, success: bool) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if success:
+                self.signed += 1
+                self.total_sign_time += seconds
+                self._recent.append(now)
+            else:
+                self.failed += 1
+            while self._recent and self._recent[0] < now - self.WINDOW:
+                self._recent.popleft()
+
+    ## @brief Records a file skipped because the journal already has it
+    def job_skipped(self) -> None:
+        with self._lock:
+            self.skipped += 1
+
+    ## @brief Records the current queue depth
+    ## @param depth Number of queued files
+    def queue_depth(self, depth: int) -> None:
+        with self._lock:
+            self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    ## @brief Returns a snapshot of the statistics
+    ## @param depth Current queue depth
+    ## @return Dictionary of statistics
+    def snapshot(self, depth: int) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and self._recent[0] < now - self.WINDOW:
+                self._recent.popleft()
+            elapsed = max(now - self._started, 1e-9)
+            return {
+                "signed": self.signed,
+                "failed": self.failed,
+                "skipped": self.skipped,
+                "queue_depth": depth,
+                "max_queue_depth": self.max_queue_depth,
+                "throughput_total": self.signed / elapsed,
+                "throughput_recent": len(self._recent) / min(elapsed, self.WINDOW),
+                "avg_sign_time": self.total_sign_time / self.signed if self.signed else 0.0,
+            }
+
+
+## @brief Signs every PDF dropped into a folder
+class WatchFolderSigner:
+    ## @brief Prepares the watch-folder signer
+    ## @param input_dir Folder watched for new PDF files
+    ## @param output_dir Folder receiving the signed PDF files
+    ## @param signer DocumentSigner or decrypted private key
+    ## @param workers Number of signing threads
+    ## @param queue_size Maximum number of files waiting for a worker
+    ## @param processed_dir Optional folder the original files are moved to after signing
+    ## @param digest_profile Digest profile used for signing
+    ## @param journal_filepath Path to the journal, defaults to a file in @p output_dir
+    ## @param timestamp_client Optional TimestampClient; concurrent workers share its batches
+    ## @param optimize Whether to sign size-optimized rewrites of the documents
+    ## @param visible_stamp Whether to add a visible signature stamp to the documents; all
+    ##        workers share one stamp appearance
+    def __init__(self, input_dir: str, output_dir: str, signer, workers: int = 2,
+                 queue_size: int = WATCH_QUEUE_SIZE, processed_dir: str | None = None,
+                 digest_profile: str = DEFAULT_DIGEST_PROFILE, journal_filepath: str | None = None,
+                 timestamp_client=None, optimize: bool = OPTIMIZE_ON_SIGN,
+                 visible_stamp: bool = VISIBLE_STAMP_ON_SIGN):
+        self.input_dir = os.path.abspath(input_dir)
+        self.output_dir = os.path.abspath(output_dir)
+        self.processed_dir = processed_dir
+        self.digest_profile = digest_profile
+        self.signer = as_signer(signer)
+        self.stats = WatchFolderStats()
+        self.timestamp_client = timestamp_client
+        self.optimize = optimize
+        self.visible_stamp = visible_stamp
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        if processed_dir:
+            os.makedirs(processed_dir, exist_ok=True)
+        self.journal = SigningJournal(journal_filepath or os.path.join(self.output_dir, WATCH_JOURNAL_FILENAME))
+        self.fsync_batch = FsyncBatch()
+
+        self._queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._queued: set[str] = set()
+        self._queued_lock = threading.Lock()
+        # Files found by a directory scan: name -> (size, mtime_ns, monotonic time of the check)
+        self._settling: dict[str, tuple[int, int, float]] = {}
+        self._stop = threading.Event()
+        self._workers = [threading.Thread(target=self._worker, name=f"watch-signer-{i}", daemon=True)
+                         for i in range(workers)]
+
+    ## @brief Runs until stop() is called
+    ##
+    ## Files already present in the input folder are processed first, once
+    ## they stopped changing.
+    def run(self) -> None:
+        try:
+            watcher = InotifyWatcher(self.input_dir)
+            logger.info(f"Watching {self.input_dir} with inotify")
+        except (OSError, AttributeError):
+            watcher = PollingWatcher(self.input_dir)
+            logger.info(f"Watching {self.input_dir} by polling every {WATCH_POLL_INTERVAL} s")
+
+        for worker in self._workers:
+            worker.start()
+
+        self._scan_existing()
+        last_stats = time.monotonic()
+        try:
+            while not self._stop.is_set():
+                names = watcher.wait(WATCH_POLL_INTERVAL)
+                if names is None:
+                    logger.warning("inotify queue overflowed, rescanning input folder")
+                    self._scan_existing()
+                else:
+                    for name in names:
+                        self._enqueue(name)
+                self._enqueue_settled()
+                if time.monotonic() - last_stats >= WATCH_STATS_INTERVAL:
+                    self._log_stats()
+                    last_stats = time.monotonic()
+        finally:
+            watcher.close()
+            for _ in self._workers:
+                self._queue.put(None)
+            for worker in self._workers:
+                worker.join()
+            self.fsync_batch.close()
+            self._log_stats()
+            self.journal.close()
+
+    ## @brief Asks run() to finish after the queued files are signed
+    def stop(self) -> None:
+        self._stop.set()
+
+    ## @brief Starts watching every PDF already present in the input folder
+    ##
+    ## No close event tells whether these files are complete (one may still be
+    ## copied in), so they are queued by _enqueue_settled once their size and
+    ## modification time stayed the same for WATCH_POLL_INTERVAL.
+    def _scan_existing(self) -> None:
+        now = time.monotonic()
+        for name in sorted(os.listdir(self.input_dir)):
+            if not is_pdf_candidate(name):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.input_dir, name))
+            except FileNotFoundError:
+                continue
+            self._settling[name] = (stat.st_size, stat.st_mtime_ns, now)
+
+    ## @brief Queues the scanned files that stopped changing
+    def _enqueue_settled(self) -> None:
+        now = time.monotonic()
+        for name, (size, mtime_ns, checked) in sorted(self._settling.items()):
+            if now - checked < WATCH_POLL_INTERVAL:
+                continue
+            try:
+                stat = os.stat(os.path.join(self.input_dir, name))
+            except FileNotFoundError:
+                del self._settling[name]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) == (size, mtime_ns):
+                del self._settling[name]
+                self._enqueue(name)
+            else:
+                self._settling[name] = (stat.st_size, stat.st_mtime_ns, now)
+
+    ## @brief Queues a file unless it is not a PDF, already queued or already journaled
+    ##
+    ## Blocks while the queue is full, so a burst of files cannot exhaust memory.
+    ## @param name File name inside the input folder
+    def _enqueue(self, name: str) -> None:
+        if not is_pdf_candidate(name):
+            return
+        filepath = os.path.join(self.input_dir, name)
+        key = SigningJournal.file_key(filepath)
+        if key is None:
+            return
+        if self.journal.contains(key):
+            self.stats.job_skipped()
+            return
+        with self._queued_lock:
+            if key in self._queued:
+                return
+            self._queued.add(key)
+        self._queue.put((key, filepath))
+        self.stats.queue_depth(self._queue.qsize())
+
+    ## @brief Worker thread signing queued files
+    def _worker(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            key, filepath = item
+            start = time.perf_counter()
+            try:
+                sign_pdf_file(decrypted_private_key=self.signer, pdf_filepath=filepath,
+                              digest_profile=self.digest_profile, output_dir=self.output_dir,
+                              fsync_batch=self.fsync_batch, timestamp_client=self.timestamp_client,
+                              optimize=self.optimize, visible_stamp=self.visible_stamp,
+                              on_commit=partial(self._job_committed, key, filepath, start))
+            except Exception as e:
+                self._job_failed(key, filepath, start, e)
+
+    ## @brief Journals a signed file once its group commit has put it in place
+    ## @param key Journal key of the input file
+    ## @param filepath Path to the input file
+    ## @param start perf_counter() value when the job started
+    ## @param error Exception raised by the commit, or None
+    def _job_committed(self, key: str, filepath: str, start: float, error) -> None:
+        if error is not None:
+            self._job_failed(key, filepath, start, error)
+            return
+        output = os.path.join(self.output_dir, f"SIGNED_{os.path.basename(filepath)}")
+        try:
+            if self.processed_dir:
+                shutil.move(filepath, os.path.join(self.processed_dir, os.path.basename(filepath)))
+        except OSError as e:
+            logger.warning(f"Watch folder: could not move {filepath} to {self.processed_dir}: {e}")
+        logger.info(f"Watch folder: signed {filepath} -> {output}")
+        self.journal.record(key, filepath, output)
+        self.stats.job_finished(time.perf_counter() - start, success=True)
+        with self._queued_lock:
+            self._queued.discard(key)
+
+    ## @brief Journals a file that could not be signed
+    ## @param key Journal key of the input file
+    ## @param filepath Path to the input file
+    ## @param start perf_counter() value when the job started
+    ## @param error Exception describing the failure
+    def _job_failed(self, key: str, filepath: str, start: float, error) -> None:
+        logger.error(f"Watch folder: signing {filepath} failed: {error}")
+        self.journal.record(key, filepath, None, str(error))
+        self.stats.job_finished(time.perf_counter() - start, success=False)
+        with self._queued_lock:
+            self._queued.discard(key)
+
+    ## @brief Logs the current statistics
+    def _log_stats(self) -> None:
+        stats = self.stats.snapshot(self._queue.qsize())
+        logger.info(
+            f"Watch folder stats: signed={stats['signed']} failed={stats['failed']} skipped={stats['skipped']} "
+            f"queue={stats['queue_depth']} (max {stats['max_queue_depth']}) "
+            f"throughput={stats['throughput_recent']:.2f}/s recent, {stats['throughput_total']:.2f}/s total, "
+            f"avg sign time={stats['avg_sign_time'] * 1000:.1f} ms"
+        )
+        if self.timestamp_client is not None:
+            timestamp_stats = self.timestamp_client.stats()
+            logger.info(
+                f"Timestamp stats: tokens={timestamp_stats['tokens']} batches={timestamp_stats['batches']} "
+                f"avg batch size={timestamp_stats['avg_batch_size']:.1f} "
+                f"avg latency={timestamp_stats['avg_latency'] * 1000:.1f} ms "
+                f"avg round-trip={timestamp_stats['avg_round_trip'] * 1000:.1f} ms"
+            )
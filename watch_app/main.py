@@ -0,0 +1,94 @@
+## @file main.py
+## @brief Main entry point for the PAdES application (watch folder)
+##
+## This file initializes the logger and signs every PDF dropped into a
+## folder without user interaction, with an encrypted key file or a key kept
+## on a PKCS#11 token. The PIN is read from the PADES_PIN environment variable
+## or prompted for once at startup.
+
+import argparse
+import getpass
+import signal
+import sys
+import os
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import DIGEST_PROFILES, DEFAULT_DIGEST_PROFILE, WATCH_QUEUE_SIZE, WATCH_PIN_ENV, TSA_URL_ENV, OPTIMIZE_ON_SIGN, \
+    VISIBLE_STAMP_ON_SIGN, PKCS11_TOKEN_ENV, PKCS11_KEY_ENV
+from logger.logger import initialize_logger
+from utility.pdf_sign import DecryptionError
+from utility.signer import load_signer
+from utility.pkcs11_token import TokenError, load_token_signer
+from utility.timestamp import TimestampClient
+from utility.watch_folder import WatchFolderSigner
+
+logger = initialize_logger()
+
+## @brief Parses command line arguments
+## @return Parsed arguments
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Sign every PDF dropped into a folder")
+    parser.add_argument("input_dir", help="folder watched for new PDF files")
+    parser.add_argument("output_dir", help="folder receiving the signed PDF files")
+    key_group = parser.add_mutually_exclusive_group(required=os.getenv(PKCS11_TOKEN_ENV) is None)
+    key_group.add_argument("--key", help="path to the encrypted private key file")
+    key_group.add_argument("--token", default=os.getenv(PKCS11_TOKEN_ENV),
+                           help=f"label of the PKCS#11 token holding the key (default: {PKCS11_TOKEN_ENV})")
+    parser.add_argument("--token-key", default=os.getenv(PKCS11_KEY_ENV),
+                        help=f"label of the key on the token (default: {PKCS11_KEY_ENV})")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="number of signing threads")
+    parser.add_argument("--queue-size", type=int, default=WATCH_QUEUE_SIZE, help="maximum number of queued files")
+    parser.add_argument("--processed-dir", help="folder the original files are moved to after signing")
+    parser.add_argument("--profile", choices=DIGEST_PROFILES, default=DEFAULT_DIGEST_PROFILE, help="digest profile")
+    parser.add_argument("--optimize", action="store_true", default=OPTIMIZE_ON_SIGN,
+                        help="sign size-optimized rewrites of the documents")
+    parser.add_argument("--stamp", action="store_true", default=VISIBLE_STAMP_ON_SIGN,
+                        help="add a visible signature stamp to the last page of the documents")
+    parser.add_argument("--tsa", default=os.getenv(TSA_URL_ENV), help="timestamp authority URL (default: no timestamps)")
+    return parser.parse_args()
+
+## @brief Main function to start the watch-folder signer
+## @return Exit code
+def main() -> int:
+    args = parse_args()
+    logger.info('Watch folder application started')
+
+    pin = os.getenv(WATCH_PIN_ENV) or getpass.getpass("PIN: ")
+    try:
+        if args.key:
+            signer = load_signer(private_key_filepath=args.key, pin=pin)
+        else:
+            signer = load_token_signer(args.token, pin, args.token_key)
+    except DecryptionError:
+        logger.error("Given PIN does not match the private key")
+        return 1
+    except TokenError as e:
+        logger.error(f"Token cannot be used: {e}")
+        return 1
+
+    timestamp_client = TimestampClient(args.tsa) if args.tsa else None
+    watch_signer = WatchFolderSigner(
+        input_dir=args.input_dir,
+        output_dir=args.output_dir,
+        signer=signer,
+        workers=args.workers,
+        queue_size=args.queue_size,
+        processed_dir=args.processed_dir,
+        digest_profile=args.profile,
+        timestamp_client=timestamp_client,
+        optimize=args.optimize,
+        visible_stamp=args.stamp,
+    )
+    signal.signal(signal.SIGINT, lambda *_: watch_signer.stop())
+    signal.signal(signal.SIGTERM, lambda *_: watch_signer.stop())
+    watch_signer.run()
+    if timestamp_client is not None:
+        timestamp_client.close()
+
+    logger.info('Watch folder application exited')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())